@@ -0,0 +1,127 @@
+"""Compares two run_benchmark.py result files and flags regressions
+
+Stages are matched on format, size, column count and stage name. A stage
+regresses when its time or its peak traced memory grows by more than the
+given tolerance. Time is the stage's relative_time, its median time over
+that of run_benchmark.reference_run on the same machine, so results from
+different machines can be compared; older results without it are compared
+in seconds. Time can also be given an absolute slack, so stages taking a
+few milliseconds do not fail on timer noise. The exit status is 1 if
+anything regressed.
+
+    python benchmark/compare_results.py baseline.json latest.json --tolerance 0.2
+    python benchmark/compare_results.py baseline.json latest.json --tolerance 0.5 --memory-tolerance 0.1 --min-seconds 0.005
+"""
+
+import argparse
+import json
+import sys
+
+
+def load_results(path: str) -> dict:
+    with open(path) as f:
+        return index_results(json.load(f)["results"])
+
+
+def index_results(results: list) -> dict:
+    """Keys run_benchmark.py results by format, size, column count, PII field count and stage"""
+
+    return {
+        (r["format"], r["bytes"], r["columns"], r["pii_fields"], r["stage"]): r
+        for r in results
+    }
+
+
+def compare(
+    baseline: dict,
+    latest: dict,
+    tolerance: float,
+    memory_tolerance: float = None,
+    min_seconds: float = 0.0,
+) -> list:
+    """Returns one row per stage present in both runs
+
+    Args:
+        baseline: results from load_results
+        latest: results from load_results
+        tolerance: allowed relative growth, e.g. 0.2 for 20%
+        memory_tolerance: allowed relative growth of peak memory, tolerance
+            by default
+        min_seconds: time a stage may grow by on top of tolerance
+
+    Returns:
+        A list of dictionaries with the stage key, the baseline and latest
+        median time, relative time (None unless both runs have it) and peak
+        memory, the time and memory ratios (latest / baseline) and whether
+        the stage regressed
+    """
+
+    if memory_tolerance is None:
+        memory_tolerance = tolerance
+    rows = []
+    for key in sorted(baseline.keys() & latest.keys()):
+        seconds = (baseline[key]["median_seconds"], latest[key]["median_seconds"])
+        relative = None
+        times, slack = seconds, min_seconds
+        if "relative_time" in baseline[key] and "relative_time" in latest[key]:
+            relative = (baseline[key]["relative_time"], latest[key]["relative_time"])
+            times = relative
+            slack = min_seconds / latest[key]["reference_seconds"]
+        peak_bytes = (baseline[key]["peak_traced_bytes"], latest[key]["peak_traced_bytes"])
+        rows.append(
+            {
+                "key": key,
+                "seconds": seconds,
+                "relative_time": relative,
+                "peak_traced_bytes": peak_bytes,
+                "time_ratio": times[1] / max(times[0], 1e-9),
+                "memory_ratio": peak_bytes[1] / max(peak_bytes[0], 1),
+                "regressed": times[1] > times[0] * (1 + tolerance) + slack
+                or peak_bytes[1] > peak_bytes[0] * (1 + memory_tolerance),
+            }
+        )
+    return rows
+
+
+def report(rows: list) -> str:
+    """Formats the rows from compare as a table, one line per stage"""
+
+    lines = []
+    for row in rows:
+        file_format, size, columns, pii_fields, stage = row["key"]
+        flag = "REGRESSED" if row["regressed"] else "ok"
+        if row["relative_time"] is None:
+            time = f" {row['seconds'][0]:8.3f} -> {row['seconds'][1]:8.3f} s"
+        else:
+            time = f" {row['relative_time'][0]:6.3f} -> {row['relative_time'][1]:6.3f} x reference"
+        lines.append(
+            f"{file_format:>8} {size:>12,} B  {stage:<22}"
+            f"{time} (x{row['time_ratio']:.2f})"
+            f" {row['peak_traced_bytes'][0] / 2**20:7.1f} -> {row['peak_traced_bytes'][1] / 2**20:7.1f} MiB"
+            f" (x{row['memory_ratio']:.2f})  {flag}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("latest")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--memory-tolerance", type=float, default=None)
+    parser.add_argument("--min-seconds", type=float, default=0.0)
+    args = parser.parse_args()
+
+    rows = compare(
+        load_results(args.baseline),
+        load_results(args.latest),
+        args.tolerance,
+        args.memory_tolerance,
+        args.min_seconds,
+    )
+    print(report(rows))
+    sys.exit(1 if any(row["regressed"] for row in rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Deterministic synthetic data for benchmarking the obfuscator
+
+Files are generated in batches of rows so any size, from a few kilobytes
+to tens of gigabytes, can be written without holding the data in memory.
+The same arguments always produce byte-identical files.
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PII_COLUMN_KINDS = ["email_address", "first_name", "phone_number", "card_number", "postcode"]
+OTHER_COLUMN_KINDS = ["id", "amount", "created_at", "department_id", "status"]
+FIRST_NAMES = np.array(["Jeremie", "Deron", "Jeanette", "Ana", "Magdalena", "Korey", "Raphael", "Ida"])
+STATUSES = np.array(["active", "pending", "closed", "suspended"])
+FORMATS = [".csv", ".json", ".parquet"]
+BATCH_ROWS = 50_000
+SIZE_UNITS = {"KB": 1024, "MB": 1024**2, "GB": 1024**3}
+
+
+def parse_size(size: str) -> int:
+    """Converts a size such as "10MB" or "1GB" to a number of bytes"""
+
+    size = size.strip().upper()
+    for unit, multiplier in SIZE_UNITS.items():
+        if size.endswith(unit):
+            return int(float(size[: -len(unit)]) * multiplier)
+    return int(size)
+
+
+def column_layout(num_columns: int, pii_ratio: float) -> list:
+    """Returns (column name, kind, is pii) for each column of a generated table
+
+    PII columns are spread evenly across the row rather than grouped together.
+
+    Args:
+        num_columns: total number of columns
+        pii_ratio: fraction of the columns holding personal data
+    """
+
+    num_pii = min(num_columns, max(1, round(num_columns * pii_ratio)))
+    layout = []
+    pii_seen = other_seen = 0
+    for i in range(num_columns):
+        if pii_seen < num_pii and (i + 1) * num_pii // num_columns > pii_seen:
+            kinds, count, is_pii = PII_COLUMN_KINDS, pii_seen, True
+            pii_seen += 1
+        else:
+            kinds, count, is_pii = OTHER_COLUMN_KINDS, other_seen, False
+            other_seen += 1
+        kind = kinds[count % len(kinds)]
+        name = kind if count < len(kinds) else f"{kind}_{count // len(kinds)}"
+        layout.append((name, kind, is_pii))
+    return layout
+
+
+def pii_columns(num_columns: int, pii_ratio: float) -> list:
+    """Returns the names of the PII columns of a generated table"""
+
+    return [name for name, kind, is_pii in column_layout(num_columns, pii_ratio) if is_pii]
+
+
+def generate_batch(
+    rng: np.random.Generator, layout: list, start: int, num_rows: int
+) -> pd.DataFrame:
+    """Generates num_rows rows, numbered from start, with the given column layout"""
+
+    row_ids = np.arange(start, start + num_rows)
+    columns = {}
+    for name, kind, is_pii in layout:
+        if kind == "id":
+            values = row_ids
+        elif kind == "amount":
+            values = np.round(rng.uniform(0, 10_000, num_rows), 2)
+        elif kind == "created_at":
+            seconds = rng.integers(1_600_000_000, 1_700_000_000, num_rows)
+            values = pd.to_datetime(seconds, unit="s").strftime("%Y-%m-%d %H:%M:%S")
+        elif kind == "department_id":
+            values = rng.integers(1, 20, num_rows)
+        elif kind == "status":
+            values = STATUSES[rng.integers(0, len(STATUSES), num_rows)]
+        elif kind == "email_address":
+            values = "user" + pd.Series(row_ids).astype(str) + "@example.com"
+        elif kind == "first_name":
+            values = FIRST_NAMES[rng.integers(0, len(FIRST_NAMES), num_rows)]
+        elif kind == "phone_number":
+            values = "07" + pd.Series(rng.integers(100_000_000, 999_999_999, num_rows)).astype(str)
+        elif kind == "card_number":
+            values = "4" + pd.Series(rng.integers(10**14, 10**15 - 1, num_rows)).astype(str)
+        else:
+            values = (
+                pd.Series(FIRST_NAMES[rng.integers(0, len(FIRST_NAMES), num_rows)]).str[:2].str.upper()
+                + pd.Series(rng.integers(1, 99, num_rows)).astype(str)
+                + " 1AB"
+            )
+        columns[name] = np.asarray(values)
+    return pd.DataFrame(columns)
+
+
+def generate_file(
+    path: str,
+    file_format: str,
+    target_bytes: int,
+    num_columns: int = 8,
+    pii_ratio: float = 0.25,
+    seed: int = 0,
+) -> dict:
+    """Writes a synthetic csv, json or parquet file of roughly target_bytes
+
+    Rows are appended in batches until the file reaches target_bytes. json
+    files hold an array of records, matching data/dummy_json.json.
+
+    Args:
+        path: local path of the file to write
+        file_format: ".csv", ".json" or ".parquet"
+        target_bytes: approximate size of the file
+        num_columns: total number of columns
+        pii_ratio: fraction of the columns holding personal data
+        seed: random seed; the same arguments always give the same file
+
+    Returns:
+        A dictionary describing the file: path, format, rows, bytes, columns
+        and pii_fields
+    """
+
+    if file_format not in FORMATS:
+        raise ValueError(f"{file_format} is not one of {FORMATS}")
+    layout = column_layout(num_columns, pii_ratio)
+    rng = np.random.default_rng(seed)
+    rows = 0
+
+    with open(path, "wb") as f:
+        writer = None
+        if file_format == ".json":
+            f.write(b"[")
+        while f.tell() < target_bytes:
+            batch_rows = _batch_rows(target_bytes, f.tell(), rows)
+            batch = generate_batch(rng, layout, rows, batch_rows)
+            if file_format == ".csv":
+                f.write(batch.to_csv(index=False, header=not rows).encode())
+            elif file_format == ".json":
+                records = batch.to_json(orient="records")[1:-1]
+                f.write((b"," if rows else b"") + records.encode())
+            else:
+                table = pa.Table.from_pandas(batch, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(f, table.schema)
+                writer.write_table(table)
+            rows += batch_rows
+        if writer is not None:
+            writer.close()
+        if file_format == ".json":
+            f.write(b"]")
+        size = f.tell()
+
+    return {
+        "path": path,
+        "format": file_format,
+        "rows": rows,
+        "bytes": size,
+        "columns": [name for name, kind, is_pii in layout],
+        "pii_fields": [name for name, kind, is_pii in layout if is_pii],
+    }
+
+
+def _batch_rows(target_bytes: int, written_bytes: int, written_rows: int) -> int:
+    # size each batch from the bytes per row seen so far so small files are not overshot
+    if not written_rows:
+        return max(1, min(BATCH_ROWS, target_bytes // 200))
+    remaining = target_bytes - written_bytes
+    return max(1, min(BATCH_ROWS, int(remaining * written_rows / max(written_bytes, 1)) + 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path")
+    parser.add_argument("--size", default="1MB")
+    parser.add_argument("--columns", type=int, default=8)
+    parser.add_argument("--pii-ratio", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    extension = "." + args.path.rsplit(".", 1)[-1]
+    print(
+        generate_file(
+            args.path, extension, parse_size(args.size), args.columns, args.pii_ratio, args.seed
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
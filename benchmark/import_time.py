@@ -0,0 +1,136 @@
+"""Measures how long each module takes to import in a fresh interpreter
+
+Every module is imported in its own new Python process under -X importtime,
+which is what a Lambda cold start pays, and the cumulative import time of
+the module itself is read from the report. The heavy third-party libraries
+each module pulls in are recorded as well, so a new eager import shows up
+even when the timings are noisy. Results are written as JSON; given a
+baseline file, the exit status is 1 if any module got slower than the
+tolerance allows.
+
+    PYTHONPATH=$(pwd) python benchmark/import_time.py --repeat 5
+    PYTHONPATH=$(pwd) python benchmark/import_time.py --baseline old.json --tolerance 0.2
+"""
+
+import argparse
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+from benchmark.run_benchmark import environment, RESULTS_DIR
+
+MODULES = [
+    "src.transform_lambda.handler",
+    "src.transform_lambda.utils",
+    "src.transform_lambda.s3_utils",
+    "src.transform_lambda.metrics_utils",
+    "src.transform_lambda.csv_splice_utils",
+    "src.transform_lambda.csv_utils",
+    "src.transform_lambda.json_utils",
+    "src.transform_lambda.parquet_utils",
+    "boto3",
+    "numpy",
+    "pyarrow",
+    "pyarrow.parquet",
+    "pandas",
+    "awswrangler",
+]
+HEAVY_DEPENDENCIES = ["numpy", "pyarrow", "pandas", "awswrangler"]
+
+
+def import_once(module: str) -> dict:
+    """Imports module in a new interpreter
+
+    Returns:
+        A dictionary with the module's cumulative import time in seconds and
+        the heavy dependencies that were loaded alongside it
+    """
+
+    code = (
+        f"import sys, json, {module}; "
+        f"print(json.dumps([m for m in {HEAVY_DEPENDENCIES!r} if m in sys.modules]))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PYTHONPATH": os.getcwd()},
+    )
+    # lines look like "import time:  self [us] | cumulative | <indented name>"
+    microseconds = None
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            microseconds = int(fields[1])
+    if microseconds is None:
+        raise RuntimeError(f"no import time reported for {module}")
+    return {"seconds": microseconds / 1e6, "loaded": json.loads(result.stdout)}
+
+
+def measure(modules: list, repeat: int) -> list:
+    results = []
+    for module in modules:
+        runs = [import_once(module) for _ in range(repeat)]
+        seconds = [run["seconds"] for run in runs]
+        results.append(
+            {
+                "module": module,
+                "seconds": seconds,
+                "median_seconds": statistics.median(seconds),
+                "loaded": runs[-1]["loaded"],
+            }
+        )
+    return results
+
+
+def compare(baseline: list, latest: list, tolerance: float) -> list:
+    """Returns the modules whose median import time grew by more than tolerance"""
+
+    before = {result["module"]: result["median_seconds"] for result in baseline}
+    return [
+        result["module"]
+        for result in latest
+        if result["module"] in before
+        and result["median_seconds"] > before[result["module"]] * (1 + tolerance)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = measure(args.modules, args.repeat)
+    for result in results:
+        print(
+            f"{result['module']:<40} {result['median_seconds']:7.3f} s"
+            f"  loads {', '.join(result['loaded']) or '-'}"
+        )
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(
+            RESULTS_DIR, "imports_" + datetime.datetime.now().strftime("%Y%m%dT%H%M%S") + ".json"
+        )
+    with open(output, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+    print(f"results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressed = compare(json.load(f)["results"], results, args.tolerance)
+        for module in regressed:
+            print(f"{module} REGRESSED")
+        sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
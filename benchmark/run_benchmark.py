@@ -0,0 +1,215 @@
+"""Times and memory-profiles each obfuscation stage on synthetic data
+
+For every format and size requested, a file is generated with
+data_generator (and cached between runs), uploaded to an in-process moto S3
+stand-in, and pushed through get_data_from_bucket, censor_sensitive_data and
+write_sensitive_data. Each stage is timed over several repeats; a separate
+run under tracemalloc records the peak Python heap of each stage, so the
+timings are not slowed down by allocation tracing. Every repeat also times
+reference_run, which masks the same file with pandas alone, and each
+stage's relative_time is its median time divided by the reference's, which
+stays comparable between machines where seconds do not. Results are
+written as JSON for compare_results.py.
+
+    PYTHONPATH=$(pwd) python benchmark/run_benchmark.py --sizes 1MB 10MB
+"""
+
+import argparse
+import boto3
+import datetime
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import time
+import tracemalloc
+import pandas as pd
+from moto import mock_aws
+from benchmark.data_generator import generate_file, parse_size
+from src.transform_lambda.utils import (
+    get_data_from_bucket,
+    censor_sensitive_data,
+    write_sensitive_data,
+)
+
+SOURCE_BUCKET = "benchmark-source"
+DESTINATION_BUCKET = "benchmark-destination"
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+STAGES = ["get_data_from_bucket", "censor_sensitive_data", "write_sensitive_data"]
+# how reference_run reads and writes each format
+REFERENCE_IO = {
+    ".csv": (pd.read_csv, lambda df, sink: df.to_csv(sink, index=False)),
+    ".json": (pd.read_json, lambda df, sink: df.to_json(sink, orient="records")),
+    ".parquet": (pd.read_parquet, lambda df, sink: df.to_parquet(sink, index=False)),
+}
+
+
+def run_pipeline(path: str, pii_fields: list, session: boto3.session.Session, measure) -> dict:
+    """Runs the three pipeline stages, wrapping each call in measure(stage, function)"""
+
+    response = measure("get_data_from_bucket", lambda: get_data_from_bucket(path, session))
+    if response["status"] == "failure":
+        raise RuntimeError(response["message"])
+    rows = len(response["data"])
+    response = measure("censor_sensitive_data", lambda: censor_sensitive_data(response, pii_fields))
+    destination = f"s3://{DESTINATION_BUCKET}/output{response['format']}"
+    result = measure(
+        "write_sensitive_data", lambda: write_sensitive_data(response, destination, session)
+    )
+    if result["status"] == "failure":
+        raise RuntimeError(result["message"])
+    return {"rows": rows}
+
+
+def reference_run(file_info: dict) -> None:
+    """Reads a generated file with pandas, masks its PII fields with a
+    constant and writes it to memory, using none of this repository's code,
+    so its time depends on the machine and not on the code under test"""
+
+    reader, writer = REFERENCE_IO[file_info["format"]]
+    df = reader(file_info["path"])
+    df[file_info["pii_fields"]] = "***"
+    writer(df, io.BytesIO())
+
+
+def benchmark_file(file_info: dict, session: boto3.session.Session, repeat: int) -> list:
+    """Benchmarks one generated file, returning one result dictionary per stage"""
+
+    key = os.path.basename(file_info["path"])
+    session.client("s3").upload_file(file_info["path"], SOURCE_BUCKET, key)
+    path = f"s3://{SOURCE_BUCKET}/{key}"
+    timings = {stage: [] for stage in STAGES}
+
+    def timed(stage, function):
+        start = time.perf_counter()
+        result = function()
+        timings[stage].append(time.perf_counter() - start)
+        return result
+
+    reference = []
+    for _ in range(repeat):
+        run_pipeline(path, file_info["pii_fields"], session, timed)
+        start = time.perf_counter()
+        reference_run(file_info)
+        reference.append(time.perf_counter() - start)
+    reference_seconds = statistics.median(reference)
+
+    peaks = {}
+
+    def traced(stage, function):
+        tracemalloc.start()
+        try:
+            return function()
+        finally:
+            peaks[stage] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    run_pipeline(path, file_info["pii_fields"], session, traced)
+
+    return [
+        {
+            "format": file_info["format"],
+            "bytes": file_info["bytes"],
+            "rows": file_info["rows"],
+            "columns": len(file_info["columns"]),
+            "pii_fields": len(file_info["pii_fields"]),
+            "stage": stage,
+            "seconds": timings[stage],
+            "median_seconds": statistics.median(timings[stage]),
+            "reference_seconds": reference_seconds,
+            "relative_time": statistics.median(timings[stage]) / reference_seconds,
+            "peak_traced_bytes": peaks[stage],
+        }
+        for stage in STAGES
+    ]
+
+
+def generated_file(file_format: str, size: int, columns: int, pii_ratio: float, seed: int) -> dict:
+    """Generates a benchmark file, reusing a cached copy made with the same arguments"""
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    name = f"{size}_{columns}_{pii_ratio}_{seed}{file_format}"
+    path = os.path.join(DATA_DIR, name)
+    info_path = path + ".info.json"
+    if os.path.exists(path) and os.path.exists(info_path):
+        with open(info_path) as f:
+            return json.load(f)
+    file_info = generate_file(path, file_format, size, columns, pii_ratio, seed)
+    with open(info_path, "w") as f:
+        json.dump(file_info, f)
+    return file_info
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--formats", nargs="+", default=[".csv", ".json", ".parquet"])
+    parser.add_argument("--sizes", nargs="+", default=["1MB", "10MB"])
+    parser.add_argument("--columns", type=int, default=8)
+    parser.add_argument("--pii-ratio", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-2")
+
+    results = []
+    with mock_aws():
+        session = boto3.session.Session(region_name="eu-west-2")
+        for bucket in [SOURCE_BUCKET, DESTINATION_BUCKET]:
+            session.client("s3").create_bucket(
+                Bucket=bucket,
+                CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+            )
+        for size in args.sizes:
+            for file_format in args.formats:
+                file_format = file_format if file_format.startswith(".") else "." + file_format
+                file_info = generated_file(
+                    file_format, parse_size(size), args.columns, args.pii_ratio, args.seed
+                )
+                for result in benchmark_file(file_info, session, args.repeat):
+                    results.append(result)
+                    print(
+                        f"{result['format']:>8} {result['bytes']:>12,} B  {result['stage']:<22}"
+                        f" {result['median_seconds']:8.3f} s (x{result['relative_time']:.3f} of reference)"
+                        f" {result['peak_traced_bytes'] / 2**20:9.1f} MiB"
+                    )
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(
+            RESULTS_DIR, datetime.datetime.now().strftime("%Y%m%dT%H%M%S") + ".json"
+        )
+    environment_info = environment()
+    # ru_maxrss is in kilobytes on Linux
+    environment_info["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    with open(output, "w") as f:
+        json.dump({"environment": environment_info, "results": results}, f, indent=2)
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import boto3
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+from src.transform_lambda.idempotency_utils import idempotency_key
+from src.transform_lambda.s3_utils import split_s3_path, get_s3_client
+from src.transform_lambda.compression_utils import split_extension
+from src.transform_lambda.storage_utils import is_s3_path, open_object_writer
+
+DEFAULT_CACHE_DIRECTORY = "/tmp/obfuscator_cache"
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+# (directory, max_bytes) -> cache, kept so warm invocations reuse the index
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class ResultCache:
+    """Obfuscated files kept in a local directory for later jobs to reuse
+
+    Files are named after the idempotency key of the job that wrote them,
+    so a job with the same source content, masking, output format and
+    settings finds the file it would write. When the files add up to more
+    than max_bytes the least recently used are deleted. The directory
+    survives warm Lambda invocations, and files already in it are picked
+    up, oldest first, when the cache is created.
+    """
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIRECTORY, max_bytes: int = DEFAULT_CACHE_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # filename -> size, least recently used first
+        self.entries = OrderedDict()
+        # writers use temporary files starting with a dot, which are skipped
+        files = [
+            entry for entry in os.scandir(directory) if entry.is_file() and not entry.name.startswith(".")
+        ]
+        for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+            self.entries[entry.name] = entry.stat().st_size
+
+    def path(self, filename: str) -> str:
+        """Returns the file:// path a job writes its output to on a miss"""
+
+        return "file://" + os.path.join(self.directory, filename)
+
+    def size(self) -> int:
+        return sum(self.entries.values())
+
+    def open(self, filename: str):
+        """Opens a cached file for reading, or counts a miss and returns None
+
+        The file is opened while the lock is held, so it can still be read
+        if another job evicts it in the meantime.
+        """
+
+        with self.lock:
+            if filename in self.entries:
+                try:
+                    stream = open(os.path.join(self.directory, filename), "rb")
+                except FileNotFoundError:
+                    del self.entries[filename]
+                else:
+                    self.entries.move_to_end(filename)
+                    self.hits += 1
+                    return stream
+            self.misses += 1
+            return None
+
+    def put(self, filename: str):
+        """Adds a file written to path(filename), evicting the least recently used files if over max_bytes"""
+
+        try:
+            size = os.path.getsize(os.path.join(self.directory, filename))
+        except FileNotFoundError:
+            # discarded by a job that failed writing the same output
+            return
+        with self.lock:
+            self.entries[filename] = size
+            self.entries.move_to_end(filename)
+            total = sum(self.entries.values())
+            while total > self.max_bytes:
+                evicted, evicted_size = self.entries.popitem(last=False)
+                total -= evicted_size
+                try:
+                    os.remove(os.path.join(self.directory, evicted))
+                except FileNotFoundError:
+                    pass
+
+    def discard(self, filename: str):
+        """Deletes a file written to path(filename) that was never added with put"""
+
+        with self.lock:
+            if filename in self.entries:
+                return
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass
+
+    def counts(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def get_result_cache(config) -> ResultCache:
+    """Returns the cache described by a job's cache setting
+
+    Args:
+        config: None or False, True for the defaults, or a dictionary with
+            the optional path and max_bytes of the cache
+
+    Returns:
+        A ResultCache, or None if config is empty
+    """
+
+    if not config:
+        return None
+    if config is True:
+        config = {}
+    directory = config.get("path", DEFAULT_CACHE_DIRECTORY)
+    max_bytes = int(config.get("max_bytes", DEFAULT_CACHE_BYTES))
+    if max_bytes <= 0:
+        raise ValueError("cache max_bytes must be a positive number of bytes")
+    with _caches_lock:
+        if (directory, max_bytes) not in _caches:
+            _caches[directory, max_bytes] = ResultCache(directory, max_bytes)
+        return _caches[directory, max_bytes]
+
+
+def cache_filename(job: dict, cache: ResultCache, session: boto3.session.Session) -> str:
+    """Returns the name a job's output is cached under
+
+    The name is the job's idempotency key followed by the extension of its
+    destination, e.g. <key>.csv.gz, so the pipeline writes the cached file
+    in the destination's format. Both the ETag and size of the source come
+    from one HEAD request.
+
+    Returns:
+        The filename, or None when the job cannot be cached: the source is
+        not in S3 (it has no ETag), cannot be read, or is larger than the
+        whole cache
+    """
+
+    source = job["file_to_obfuscate"]
+    if not is_s3_path(source):
+        return None
+    try:
+        bucket, key = split_s3_path(source)
+        head = get_s3_client(session).head_object(Bucket=bucket, Key=key)
+        filename = idempotency_key(head["ETag"], job)
+    except (ClientError, ValueError):
+        # let the pipeline report the missing file or bad settings
+        return None
+    if head["ContentLength"] > cache.max_bytes:
+        return None
+    file_extension, compression = split_extension(job["destination"])
+    if compression is not None:
+        file_extension += os.path.splitext(job["destination"])[1]
+    return filename + file_extension
+
+
+def upload_cached_file(stream, destination: str, session: boto3.session.Session) -> int:
+    """Copies an open cached file to the destination in COPY_CHUNK_SIZE chunks
+
+    Returns:
+        The number of bytes uploaded
+    """
+
+    with stream, open_object_writer(destination, session) as writer:
+        shutil.copyfileobj(stream, writer, COPY_CHUNK_SIZE)
+        return stream.tell()
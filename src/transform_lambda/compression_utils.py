@@ -0,0 +1,167 @@
+import boto3
+import bz2
+import contextlib
+import gzip
+import importlib
+import io
+import os
+from src.transform_lambda.s3_utils import read_downloaded_object, DEFAULT_PART_SIZE
+from src.transform_lambda.storage_utils import open_object_stream, open_object_writer
+
+# compression suffix -> codec, as in file.csv.gz
+COMPRESSION_EXTENSIONS = {".gz": "gzip", ".bz2": "bz2", ".zst": "zstd"}
+CODECS = list(COMPRESSION_EXTENSIONS.values())
+# levels used when a job does not set one: gzip's own default, which is a
+# good deal faster than its maximum, bzip2's only sensible level and zstd's
+# default
+DEFAULT_LEVELS = {"gzip": 6, "bz2": 9, "zstd": 3}
+
+
+def split_extension(path: str) -> tuple:
+    """Returns the file format and compression codec of a path
+
+    Args:
+        path: a path such as s3://bucket/file.csv.gz
+
+    Returns:
+        A tuple of (file extension, codec), e.g. (".csv", "gzip"), or
+        (".csv", None) for an uncompressed file
+    """
+
+    filename, extension = os.path.splitext(path)
+    if extension in COMPRESSION_EXTENSIONS:
+        return os.path.splitext(filename)[1], COMPRESSION_EXTENSIONS[extension]
+    return extension, None
+
+
+def open_decompressed(source, codec: str):
+    """Opens a compressed local path or binary file object for reading
+
+    The returned file object decompresses as it is read, so only its
+    internal buffers are held in memory, never the whole uncompressed file.
+    """
+
+    if codec == "gzip":
+        return gzip.open(source, "rb")
+    if codec == "bz2":
+        return bz2.open(source, "rb")
+    if codec == "zstd":
+        return _zstandard().open(source, "rb")
+    raise ValueError(f"Unknown compression {codec}. Can only use {CODECS}")
+
+
+def open_compressed(sink, codec: str, level: int = None):
+    """Wraps a binary file object so everything written to it is compressed
+
+    Closing the returned file object flushes the compressor but leaves sink
+    open.
+
+    Args:
+        sink: writable binary file object, such as an S3MultipartWriter
+        codec: one of CODECS
+        level: compression level, DEFAULT_LEVELS[codec] if not given
+    """
+
+    if level is None:
+        level = DEFAULT_LEVELS.get(codec)
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=sink, mode="wb", compresslevel=level)
+    if codec == "bz2":
+        return bz2.BZ2File(sink, "wb", compresslevel=level)
+    if codec == "zstd":
+        return _zstandard().ZstdCompressor(level=level).stream_writer(sink, closefd=False)
+    raise ValueError(f"Unknown compression {codec}. Can only use {CODECS}")
+
+
+def read_compressed_object(
+    path: str,
+    session: boto3.session.Session,
+    parser,
+    codec: str,
+    ranged_download: dict = None,
+):
+    """Parses a compressed file, decompressing it as the parser reads
+
+    The file is streamed (from a single GET for S3), or downloaded with
+    download_s3_object when ranged_download is given, and passed to parser
+    through open_decompressed.
+
+    Args:
+        path: string representing S3 object, or local or in-memory file, to
+            be parsed
+        session: Boto3 session
+        parser: function taking a binary file object, such as pd.read_csv
+        codec: one of CODECS
+        ranged_download: optional keyword arguments for download_s3_object
+
+    Returns:
+        Whatever parser returns
+    """
+
+    def parse(source):
+        with open_decompressed(source, codec) as stream:
+            return parser(stream)
+
+    if ranged_download is not None:
+        return read_downloaded_object(path, session, parse, **ranged_download)
+    body = open_object_stream(path, session)
+    try:
+        return parse(body)
+    finally:
+        body.close()
+
+
+@contextlib.contextmanager
+def open_compressed_writer(
+    path: str,
+    session: boto3.session.Session,
+    codec: str = None,
+    level: int = None,
+    part_size: int = DEFAULT_PART_SIZE,
+):
+    """Opens a writer for a file in any storage, compressing what is written to it if codec is given
+
+    A thin wrapper over storage_utils.open_object_writer, so for S3 the
+    writer is an S3MultipartWriter. The file is only written if the with
+    block exits without an exception.
+    """
+
+    with open_object_writer(path, session, part_size) as writer:
+        if codec is None:
+            yield writer
+        else:
+            with open_compressed(writer, codec, level) as stream:
+                yield stream
+
+
+class PrefixedReader(io.RawIOBase):
+    """Binary file object reading prefix and then the rest of stream
+
+    Lets bytes that were already read from a forward-only stream, such as a
+    decompressing one, be handed back to a parser that needs them.
+    """
+
+    def __init__(self, prefix: bytes, stream):
+        self.prefix = memoryview(prefix)
+        self.stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.prefix:
+            size = min(len(buffer), len(self.prefix))
+            buffer[:size] = self.prefix[:size]
+            self.prefix = self.prefix[size:]
+            return size
+        data = self.stream.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def _zstandard():
+    # imported on first use, so jobs that never use zstd do not load it
+    try:
+        return importlib.import_module("zstandard")
+    except ImportError:
+        raise ValueError("zstd compression needs the zstandard package to be installed")
@@ -0,0 +1,302 @@
+import boto3
+import csv
+import numpy as np
+from botocore.exceptions import ClientError
+from src.transform_lambda.s3_utils import DEFAULT_PART_SIZE
+from src.transform_lambda.storage_utils import open_object_stream
+from src.transform_lambda.compression_utils import open_decompressed, open_compressed_writer
+from src.transform_lambda.pipeline_utils import pipeline_splice_data
+
+DEFAULT_SPLICE_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class CsvSplicer:
+    """Replaces csv columns with a mask without parsing the rest of the file
+
+    Bytes are fed in arbitrary chunks and the censored bytes for every
+    complete record are returned. Records are only tokenized far enough to
+    find the field boundaries of the censored columns; every other byte,
+    including quoting, line endings and the header, is copied through
+    unchanged. Runs of lines without quotes are spliced in one vectorized
+    pass with numpy; records containing quotes are split one at a time.
+    Quoted fields may contain delimiters, doubled quotes and newlines: a
+    record is complete once it holds an even number of quote characters.
+    Records with too few fields are left untouched.
+    """
+
+    def __init__(
+        self,
+        pii_fields: list,
+        mask: bytes = b"***",
+        delimiter: bytes = b",",
+        quotechar: bytes = b'"',
+        encoding: str = "utf-8",
+    ):
+        self.pii_fields = pii_fields
+        self.mask = mask
+        self.delimiter = delimiter
+        self.quotechar = quotechar
+        self.encoding = encoding
+        self.indices = None
+        self.missing_fields = []
+        self.terminator = None
+        self.pending = b""
+        self.record = []
+
+    def feed(self, data: bytes) -> bytes:
+        """Consumes a chunk of input and returns the censored complete records"""
+
+        data = self.pending + data
+        if self.terminator is None:
+            newline = data.find(b"\n")
+            if newline == -1:
+                self.pending = data
+                return b""
+            self.terminator = b"\r\n" if data[:newline].endswith(b"\r") else b"\n"
+        end = data.rfind(self.terminator)
+        if end == -1:
+            self.pending = data
+            return b""
+        end += len(self.terminator)
+        self.pending = data[end:]
+        return self._splice_block(data[:end])
+
+    def finish(self) -> bytes:
+        """Returns the censored final record if the input lacked a trailing newline"""
+
+        data, self.pending = self.pending, b""
+        if self.record:
+            data = (self.terminator or b"\n").join(self.record + [data])
+            self.record = []
+        elif not data:
+            return b""
+        if data.count(self.quotechar) % 2:
+            raise ValueError("csv ends inside a quoted field")
+        return self._splice_record(data)
+
+    def _splice_block(self, block: bytes) -> bytes:
+        output = []
+        terminator = self.terminator
+        quote = self.quotechar
+        position = 0
+        while position < len(block):
+            if self.record or self.indices is None:
+                line_start = position
+            else:
+                next_quote = block.find(quote, position)
+                if next_quote == -1:
+                    output.append(self._splice_lines(block[position:]))
+                    break
+                line_start = block.rfind(terminator, position, next_quote)
+                line_start = position if line_start == -1 else line_start + len(terminator)
+                if line_start > position:
+                    output.append(self._splice_lines(block[position:line_start]))
+            line_end = block.find(terminator, line_start)
+            line = block[line_start:line_end]
+            position = line_end + len(terminator)
+            if self.record:
+                self.record.append(line)
+                if line.count(quote) % 2:
+                    record = terminator.join(self.record)
+                    self.record = []
+                    output.append(self._splice_record(record) + terminator)
+            elif line.count(quote) % 2:
+                self.record.append(line)
+            else:
+                output.append(self._splice_record(line) + terminator)
+        return b"".join(output)
+
+    def _splice_lines(self, lines: bytes) -> bytes:
+        if not self.indices:
+            return lines
+        data = np.frombuffer(lines, dtype=np.uint8)
+        line_ends = np.flatnonzero(data == ord("\n"))
+        delimiters = np.flatnonzero(data == self.delimiter[0])
+        line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+        content_ends = line_ends - (data[np.maximum(line_ends - 1, 0)] == ord("\r"))
+        first_delimiter = np.searchsorted(delimiters, line_starts)
+        delimiter_counts = np.searchsorted(delimiters, line_ends) - first_delimiter
+        complete = delimiter_counts >= self.indices[-1]
+        line_starts = line_starts[complete]
+        content_ends = content_ends[complete]
+        first_delimiter = first_delimiter[complete]
+        delimiter_counts = delimiter_counts[complete]
+        boundaries = np.append(delimiters, len(data))
+        starts = []
+        ends = []
+        for index in self.indices:
+            if index == 0:
+                starts.append(line_starts)
+            else:
+                starts.append(boundaries[first_delimiter + index - 1] + 1)
+            ends.append(
+                np.where(
+                    delimiter_counts > index,
+                    boundaries[first_delimiter + index],
+                    content_ends,
+                )
+            )
+        starts = np.stack(starts, axis=1).ravel()
+        ends = np.stack(ends, axis=1).ravel()
+        edges = np.zeros(len(data) + 1, dtype=np.int8)
+        edges[starts] += 1
+        edges[ends] -= 1
+        kept = data[np.cumsum(edges[:-1], dtype=np.int8) == 0]
+        lengths = ends - starts
+        insert_at = starts - (np.cumsum(lengths) - lengths)
+        mask = np.frombuffer(self.mask, dtype=np.uint8)
+        return np.insert(
+            kept, np.repeat(insert_at, len(mask)), np.tile(mask, len(starts))
+        ).tobytes()
+
+    def _splice_record(self, record: bytes) -> bytes:
+        if self.indices is None:
+            self._read_header(record)
+            return record
+        if not self.indices or not record:
+            return record
+        if self.quotechar in record:
+            fields = self._split_quoted(record)
+        else:
+            fields = record.split(self.delimiter, self.indices[-1] + 1)
+        if len(fields) <= self.indices[-1]:
+            return record
+        for index in self.indices:
+            fields[index] = self.mask
+        return self.delimiter.join(fields)
+
+    def _read_header(self, record: bytes):
+        header = next(
+            csv.reader(
+                [record.decode(self.encoding)],
+                delimiter=self.delimiter.decode(),
+                quotechar=self.quotechar.decode(),
+            )
+        )
+        self.indices = sorted(
+            header.index(field) for field in self.pii_fields if field in header
+        )
+        self.missing_fields = [
+            field for field in self.pii_fields if field not in header
+        ]
+
+    def _split_quoted(self, record: bytes) -> list:
+        fields = []
+        delimiter = self.delimiter
+        quote = self.quotechar
+        start = position = 0
+        while True:
+            next_delimiter = record.find(delimiter, position)
+            next_quote = record.find(quote, position)
+            if next_quote != -1 and (next_delimiter == -1 or next_quote < next_delimiter):
+                position = record.find(quote, next_quote + 1) + 1
+                continue
+            if next_delimiter == -1:
+                fields.append(record[start:])
+                return fields
+            fields.append(record[start:next_delimiter])
+            start = position = next_delimiter + 1
+
+
+def iter_spliced_csv_chunks(
+    path: str,
+    pii_fields: list,
+    session: boto3.session.Session,
+    chunk_size: int = DEFAULT_SPLICE_CHUNK_SIZE,
+    compression: str = None,
+):
+    """Censors a csv file at byte level and yields the result in chunks
+
+    No type inference is done and every field that is not censored is
+    passed through byte for byte, see CsvSplicer. A compressed file is
+    decompressed chunk_size bytes at a time as it is read.
+
+    Args:
+        path: string representing S3 object to be censored
+        pii_fields: list containing personally identifiable information fields
+        session: Boto3 session
+        chunk_size: number of bytes read from S3 (or decompressed) at a time
+        compression: codec the object is compressed with, if any
+
+    Yields:
+        The censored csv as consecutive byte strings
+    """
+
+    body = open_object_stream(path, session)
+    splicer = CsvSplicer(pii_fields)
+    if compression is not None:
+        with body, open_decompressed(body, compression) as stream:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                yield splicer.feed(chunk)
+    else:
+        with body:
+            for chunk in iter(lambda: body.read(chunk_size), b""):
+                yield splicer.feed(chunk)
+    yield splicer.finish()
+    for field in splicer.missing_fields:
+        print(f"{field} not in data set")
+
+
+def splice_csv_data(
+    path: str,
+    destination_bucket: str,
+    pii_fields: list,
+    session: boto3.session.Session,
+    chunk_size: int = DEFAULT_SPLICE_CHUNK_SIZE,
+    part_size: int = DEFAULT_PART_SIZE,
+    compression: str = None,
+    output_compression: str = None,
+    compression_level: int = None,
+    pipelined: bool = False,
+) -> dict:
+    """Censors a csv file at byte level, streaming the result to S3
+
+    Args:
+        path: string representing S3 object to be censored
+        destination_bucket: S3 path the censored csv is written to
+        pii_fields: list containing personally identifiable information fields
+        session: Boto3 session
+        chunk_size: number of bytes read from S3 at a time
+        part_size: size in bytes of each multipart upload part
+        compression: codec the source is compressed with, if any
+        output_compression: codec to compress the output with, if any
+        compression_level: optional level for output_compression
+        pipelined: overlap the download, splicing and upload of consecutive
+            chunks, see pipeline_splice_data
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            message: a relevant success/failure message
+    """
+
+    if pipelined:
+        return pipeline_splice_data(
+            path,
+            destination_bucket,
+            CsvSplicer(pii_fields),
+            session,
+            chunk_size,
+            part_size,
+            compression=compression,
+            output_compression=output_compression,
+            compression_level=compression_level,
+        )
+    try:
+        with open_compressed_writer(
+            destination_bucket, session, output_compression, compression_level, part_size
+        ) as writer:
+            for chunk in iter_spliced_csv_chunks(
+                path, pii_fields, session, chunk_size, compression
+            ):
+                writer.write(chunk)
+        return {
+            "status": "success",
+            "message": f"csv streamed to {destination_bucket}",
+        }
+    except ClientError as ce:
+        return {"status": "failure", "message": ce.response}
+    except ValueError as ve:
+        return {"status": "failure", "message": str(ve)}
+    except (OSError, EOFError) as e:
+        return {"status": "failure", "message": f"{path} could not be decompressed: {e}"}
@@ -1,21 +1,125 @@
 import boto3
+import csv
+import functools
+import io
 from botocore.exceptions import ClientError
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 import awswrangler as wr
 from awswrangler.exceptions import NoFilesFound
+from src.transform_lambda.s3_utils import (
+    split_s3_path,
+    read_downloaded_object,
+    DEFAULT_PART_SIZE,
+)
+from src.transform_lambda.storage_utils import (
+    is_s3_path,
+    read_object_bytes,
+    open_object_stream,
+)
+from src.transform_lambda.csv_splice_utils import (
+    CsvSplicer,
+    iter_spliced_csv_chunks,
+    splice_csv_data,
+    DEFAULT_SPLICE_CHUNK_SIZE,
+)
+from src.transform_lambda.masking_utils import (
+    masking_strategies,
+    get_hmac_key,
+    pseudonymize_series,
+)
+from src.transform_lambda.compression_utils import (
+    read_compressed_object,
+    open_decompressed,
+    open_compressed_writer,
+    PrefixedReader,
+)
+from src.transform_lambda.preflight_utils import csv_header_end
 import logging
 
 logger = logging.getLogger("ftpuploader")
 
+DEFAULT_CSV_CHUNKSIZE = 100_000
+# bytes read at a time while looking for the end of a csv header
+HEADER_READ_SIZE = 64 * 1024
+
+
+def arrow_column_types(column_types: dict = None) -> dict:
+    """Resolves a dictionary of column -> type name (such as "string" or
+    "int64") into Arrow types, raising ValueError for an unknown name"""
+
+    return {
+        name: pa.type_for_alias(type_name) for name, type_name in (column_types or {}).items()
+    }
+
+
+def read_csv_text(source) -> pd.DataFrame:
+    """Parses a local csv file or buffer with pd.read_csv, every field as text
+
+    Empty fields stay empty strings, so every mode of the pipeline writes
+    untouched fields back as they appeared in the source and hashes the
+    same text, see iter_censored_csv_chunks.
+    """
+
+    return pd.read_csv(source, dtype=str, keep_default_na=False)
+
+
+def read_csv_arrow(source, column_types: dict = None) -> pd.DataFrame:
+    """Parses a local csv file or buffer with Arrow's multi-threaded reader
+
+    The file is cut into blocks that are parsed on every core at once, so a
+    Lambda with more memory (and so more vCPUs) parses faster, which
+    pd.read_csv cannot do. Columns in column_types are read as those types;
+    the rest are read as text, as read_csv_text reads them.
+
+    Returns:
+        A pandas dataframe, as read_csv_text would return
+    """
+
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            return read_csv_arrow(f, column_types)
+    names, rest = read_csv_header(source)
+    if not names:
+        return pd.DataFrame()
+    return pa_csv.read_csv(
+        rest,
+        read_options=pa_csv.ReadOptions(use_threads=True, column_names=names),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={
+                **dict.fromkeys(names, pa.string()),
+                **arrow_column_types(column_types),
+            },
+            strings_can_be_null=False,
+        ),
+    ).to_pandas()
+
 
 def get_csv_data_from_ingestion_bucket(
-    path: str, session: boto3.session.Session
+    path: str,
+    session: boto3.session.Session,
+    ranged_download: dict = None,
+    compression: str = None,
+    reader: str = "pandas",
+    column_types: dict = None,
 ) -> dict:
     """Downloads csv data from S3 ingestion bucket and returns a pandas dataframe
 
     Args:
         key: string representing S3 object to be downloaded
         session: Boto3 session
+        ranged_download: optional keyword arguments for download_s3_object
+            (part_size, max_concurrency, local_path). When given, the object
+            is fetched with parallel ranged requests and parsed locally
+        compression: codec the object is compressed with, see
+            compression_utils.split_extension. It is decompressed while it
+            is parsed
+        reader: "pandas" parses with read_csv_text, "pyarrow" with
+            read_csv_arrow, which uses every core. Either way every field
+            is read as text
+        column_types: optional dictionary of column -> Arrow type name for
+            the pyarrow reader, see read_csv_arrow
 
     Returns:
         A dictionary containing the following:
@@ -24,22 +128,49 @@ def get_csv_data_from_ingestion_bucket(
             message: a relevant error message (if unsuccessful)
     """
 
+    parser = read_csv_text
+    if reader == "pyarrow":
+        parser = functools.partial(read_csv_arrow, column_types=column_types)
     try:
-        df = wr.s3.read_csv(path=path, boto3_session=session)
+        if compression is not None:
+            df = read_compressed_object(
+                path, session, parser, compression, ranged_download
+            )
+        elif ranged_download is not None:
+            df = read_downloaded_object(path, session, parser, **ranged_download)
+        elif reader == "pyarrow" or not is_s3_path(path):
+            df = parser(pa.BufferReader(read_object_bytes(path, session)))
+        else:
+            # passed as a list because awswrangler reads a single path as a
+            # prefix, which would pick up file.csv.gz alongside file.csv
+            df = wr.s3.read_csv(
+                path=[path], boto3_session=session, dtype=str, keep_default_na=False
+            )
         return {"status": "success", "data": df, "format": ".csv"}
     except ClientError as ce:
         return {"status": "failure", "message": ce.response}
     except NoFilesFound as nff:
         return {"status": "failure", "message": nff}
+    except ValueError as ve:
+        return {"status": "failure", "message": str(ve)}
+    except (OSError, EOFError) as e:
+        return {"status": "failure", "message": f"{path} could not be decompressed: {e}"}
 
 
 def write_csv_data(
-    data: pd.DataFrame, destination_bucket: str, session: boto3.session.Session
+    data: pd.DataFrame,
+    destination_bucket: str,
+    session: boto3.session.Session,
+    compression: str = None,
+    compression_level: int = None,
 ) -> dict:
     """Writes a pandas dataframe to csv format in destination bucket
 
     Args:
         data: a pandas dataframe
+        compression: optional codec to compress the file with as it is
+            uploaded, see compression_utils.open_compressed
+        compression_level: optional level for the codec
 
     Returns:
         A dictionary containing the following:
@@ -49,7 +180,15 @@ def write_csv_data(
 
     if isinstance(data, pd.DataFrame):
         try:
-            wr.s3.to_csv(df=data, path=destination_bucket, boto3_session=session, index=False)
+            if compression is not None or not is_s3_path(destination_bucket):
+                with open_compressed_writer(
+                    destination_bucket, session, compression, compression_level
+                ) as writer:
+                    data.to_csv(writer, index=False)
+            else:
+                wr.s3.to_csv(
+                    df=data, path=destination_bucket, boto3_session=session, index=False
+                )
             return {
                 "status": "success",
                 "message": f"csv written to {destination_bucket}",
@@ -70,3 +209,347 @@ def write_csv_data(
             "status": "failure",
             "message": f"Data is in wrong format {str(type(data))} is not a pandas dataframe",
         }
+
+
+def csv_data_to_bytes(data: pd.DataFrame) -> dict:
+    """Encodes a pandas dataframe as csv bytes, exactly as write_csv_data writes it
+
+    Args:
+        data: a pandas dataframe
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: a BytesIO holding the csv file (if successful)
+            message: a relevant error message (if unsuccessful)
+    """
+
+    if isinstance(data, pd.DataFrame):
+        return {
+            "status": "success",
+            "data": io.BytesIO(data.to_csv(index=False).encode("utf-8")),
+            "format": ".csv",
+        }
+    return {
+        "status": "failure",
+        "message": f"Data is in wrong format {str(type(data))} is not a pandas dataframe",
+    }
+
+
+def read_csv_table_source(source) -> pa.Table:
+    """Parses a local csv file or buffer into an Arrow table with every column as text
+
+    Reading every column as text means fields that are not censored are
+    written back as they appeared in the source, apart from quoting.
+    """
+
+    names = pa_csv.open_csv(source).schema.names
+    if not isinstance(source, str):
+        source.seek(0)
+    return pa_csv.read_csv(
+        source,
+        convert_options=pa_csv.ConvertOptions(
+            column_types=dict.fromkeys(names, pa.string())
+        ),
+    )
+
+
+def read_csv_table_stream(stream) -> pa.Table:
+    """read_csv_table_source for a file object that can only be read forwards
+
+    A decompressing stream cannot be rewound after its column names are
+    found, so the header is read here and the rest of the stream is parsed
+    with those names.
+    """
+
+    reader = open_csv_table_stream(stream)
+    return pa.table({}) if reader is None else reader.read_all()
+
+
+def open_csv_table_stream(stream):
+    """Opens a forward-only csv file object for reading in Arrow record batches
+
+    See read_csv_table_stream. Every column is read as a string, and only
+    one block of the file is parsed at a time.
+
+    Returns:
+        A pyarrow CSVStreamingReader, or None if the file has no header
+    """
+
+    names, rest = read_csv_header(stream)
+    if not names:
+        return None
+    return pa_csv.open_csv(
+        rest,
+        read_options=pa_csv.ReadOptions(column_names=names),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=dict.fromkeys(names, pa.string())
+        ),
+    )
+
+
+def read_csv_header(stream) -> tuple:
+    """Reads the header of a forward-only csv file object
+
+    Returns:
+        A tuple of the column names (empty if the file has no header) and a
+        file object reading the rest of the file
+    """
+
+    data = b""
+    end = None
+    while end is None:
+        chunk = stream.read(HEADER_READ_SIZE)
+        data += chunk
+        end = csv_header_end(data)
+        if not chunk:
+            break
+    if end is None:
+        end = len(data)
+    names = next(csv.reader(io.StringIO(data[:end].decode("utf-8-sig"))), [])
+    return names, PrefixedReader(data[end + 1 :], stream)
+
+
+def get_csv_table_from_ingestion_bucket(
+    path: str,
+    session: boto3.session.Session,
+    ranged_download: dict = None,
+    compression: str = None,
+) -> dict:
+    """Downloads csv data from S3 ingestion bucket and returns an Arrow table
+
+    Args:
+        path: string representing S3 object to be downloaded
+        session: Boto3 session
+        ranged_download: optional keyword arguments for download_s3_object,
+            see get_csv_data_from_ingestion_bucket
+        compression: codec the object is compressed with, see
+            get_csv_data_from_ingestion_bucket
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: a pyarrow table containing downloaded data (if successful)
+            message: a relevant error message (if unsuccessful)
+    """
+
+    try:
+        if compression is not None:
+            table = read_compressed_object(
+                path, session, read_csv_table_stream, compression, ranged_download
+            )
+        elif ranged_download is not None:
+            table = read_downloaded_object(
+                path, session, read_csv_table_source, **ranged_download
+            )
+        else:
+            table = read_csv_table_source(pa.BufferReader(read_object_bytes(path, session)))
+        return {"status": "success", "data": table, "format": ".csv"}
+    except ClientError as ce:
+        return {"status": "failure", "message": ce.response}
+    except ValueError as ve:
+        return {"status": "failure", "message": str(ve)}
+    except (OSError, EOFError) as e:
+        return {"status": "failure", "message": f"{path} could not be decompressed: {e}"}
+
+
+def write_csv_table(
+    data: pa.Table,
+    destination_bucket: str,
+    session: boto3.session.Session,
+    compression: str = None,
+    compression_level: int = None,
+) -> dict:
+    """Writes an Arrow table to csv format in destination bucket
+
+    The table is encoded in batches straight into an S3 multipart upload
+    (through the compressor, if one is given). Unlike write_csv_data every
+    text field is quoted.
+
+    Args:
+        data: a pyarrow table
+        compression: optional codec, see write_csv_data
+        compression_level: optional level for the codec
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            message: a relevant success/failure message
+    """
+
+    if isinstance(data, pa.Table):
+        try:
+            with open_compressed_writer(
+                destination_bucket, session, compression, compression_level
+            ) as writer:
+                pa_csv.write_csv(data, writer)
+            return {
+                "status": "success",
+                "message": f"csv written to {destination_bucket}",
+            }
+        except ClientError as e:
+            return {
+                "status": "failure",
+                "message": e.response,
+            }
+        except Exception as e:
+            logger.error("Failed to upload to ftp: %s", repr(e))
+            return {
+                "status": "failure",
+                "message": "did not write to s3. Please specify an appropriate destination i.e s3://my-bucket/my-file.csv",
+            }
+    else:
+        return {
+            "status": "failure",
+            "message": f"Data is in wrong format {str(type(data))} is not a pyarrow table",
+        }
+
+
+def csv_table_to_bytes(data: pa.Table) -> dict:
+    """Encodes an Arrow table as csv bytes, exactly as write_csv_table writes it
+
+    Args:
+        data: a pyarrow table
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: a BytesIO holding the csv file (if successful)
+            message: a relevant error message (if unsuccessful)
+    """
+
+    if isinstance(data, pa.Table):
+        buffer = io.BytesIO()
+        pa_csv.write_csv(data, buffer)
+        buffer.seek(0)
+        return {"status": "success", "data": buffer, "format": ".csv"}
+    return {
+        "status": "failure",
+        "message": f"Data is in wrong format {str(type(data))} is not a pyarrow table",
+    }
+
+
+def iter_censored_csv_chunks(
+    path: str,
+    pii_fields: list,
+    session: boto3.session.Session,
+    chunksize: int = DEFAULT_CSV_CHUNKSIZE,
+    masking: dict = None,
+    compression: str = None,
+):
+    """Reads a csv file in chunks of rows and yields each censored chunk as bytes
+
+    Only one chunk of rows is held in memory at a time. Fields are read as
+    text so every chunk is written back exactly as the in-memory path writes
+    it, without per-chunk type inference changing how a column is formatted.
+    Hashed fields are hashed as text, so empty fields are hashed rather than
+    left empty. A compressed file is decompressed as it is read.
+
+    Args:
+        path: string representing S3 object to be censored
+        pii_fields: list containing personally identifiable information fields
+        session: Boto3 session
+        chunksize: number of rows read and censored at a time
+        masking: optional dictionary of field -> "mask" or "hash"
+        compression: codec the object is compressed with, if any
+
+    Yields:
+        The censored csv, header first, as consecutive byte strings
+    """
+
+    strategies = masking_strategies(pii_fields, masking)
+    key = get_hmac_key() if "hash" in strategies.values() else None
+    if compression is not None or not is_s3_path(path):
+        body = open_object_stream(path, session)
+        with body:
+            stream = body if compression is None else open_decompressed(body, compression)
+            with stream:
+                yield from _censor_csv_chunks(
+                    pd.read_csv(stream, chunksize=chunksize, dtype=str, keep_default_na=False),
+                    pii_fields,
+                    strategies,
+                    key,
+                )
+        return
+    chunks = wr.s3.read_csv(
+        path=[path],
+        boto3_session=session,
+        chunksize=chunksize,
+        dtype=str,
+        keep_default_na=False,
+    )
+    yield from _censor_csv_chunks(chunks, pii_fields, strategies, key)
+
+
+def _censor_csv_chunks(chunks, pii_fields: list, strategies: dict, key: bytes):
+    header = True
+    for chunk in chunks:
+        if header:
+            for field in pii_fields:
+                if field not in chunk:
+                    print(f"{field} not in data set")
+        for field, strategy in strategies.items():
+            if field in chunk and strategy == "hash":
+                chunk[field] = pseudonymize_series(chunk[field], key)
+            elif field in chunk:
+                chunk[field] = "***"
+        yield chunk.to_csv(index=False, header=header).encode("utf-8")
+        header = False
+
+
+def stream_csv_data(
+    path: str,
+    destination_bucket: str,
+    pii_fields: list,
+    session: boto3.session.Session,
+    chunksize: int = DEFAULT_CSV_CHUNKSIZE,
+    part_size: int = DEFAULT_PART_SIZE,
+    masking: dict = None,
+    compression: str = None,
+    output_compression: str = None,
+    compression_level: int = None,
+) -> dict:
+    """Censors a csv file chunk by chunk, streaming the result to S3
+
+    The chunks from iter_censored_csv_chunks are sent with an S3 multipart
+    upload, so peak memory depends on chunksize and part_size rather than on
+    the size of the file, whether or not either side is compressed.
+
+    Args:
+        path: string representing S3 object to be censored
+        destination_bucket: S3 path the censored csv is written to
+        pii_fields: list containing personally identifiable information fields
+        session: Boto3 session
+        chunksize: number of rows read and censored at a time
+        part_size: size in bytes of each multipart upload part
+        masking: optional dictionary of field -> "mask" or "hash"
+        compression: codec the source is compressed with, if any
+        output_compression: codec to compress the output with, if any
+        compression_level: optional level for output_compression
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            message: a relevant success/failure message
+    """
+
+    try:
+        with open_compressed_writer(
+            destination_bucket, session, output_compression, compression_level, part_size
+        ) as writer:
+            for chunk in iter_censored_csv_chunks(
+                path, pii_fields, session, chunksize, masking, compression
+            ):
+                writer.write(chunk)
+        return {
+            "status": "success",
+            "message": f"csv streamed to {destination_bucket}",
+        }
+    except ClientError as ce:
+        return {"status": "failure", "message": ce.response}
+    except NoFilesFound as nff:
+        return {"status": "failure", "message": nff}
+    except ValueError as ve:
+        return {"status": "failure", "message": str(ve)}
+    except (OSError, EOFError) as e:
+        return {"status": "failure", "message": f"{path} could not be decompressed: {e}"}
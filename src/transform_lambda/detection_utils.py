@@ -0,0 +1,197 @@
+import boto3
+import json
+import re
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+from src.transform_lambda.storage_utils import open_object_stream, open_object_reader
+from src.transform_lambda.compression_utils import split_extension, open_decompressed
+from src.transform_lambda.json_splice_utils import JsonRecordSplitter, JSON_LINES_EXTENSIONS
+
+DEFAULT_SAMPLE_ROWS = 1000
+# share of a column's non-empty sampled values that must be one kind of PII
+DEFAULT_DETECTION_THRESHOLD = 0.8
+SAMPLE_READ_SIZE = 64 * 1024
+# kind of PII -> pattern a whole value must match. They are tried in this
+# order, so a card number is not taken for a phone number
+PII_PATTERNS = {
+    "email": r"[A-Za-z0-9._%+'-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}",
+    "card_number": r"\d(?:[ -]?\d){12,18}",
+    # UK National Insurance number or US Social Security number
+    "national_id": r"[A-CEGHJ-PR-TW-Za-ceghj-pr-tw-z]{2} ?\d{2} ?\d{2} ?\d{2} ?[A-Da-d]|\d{3}-\d{2}-\d{4}",
+    "postcode": r"[A-Za-z]{1,2}\d[A-Za-z\d]? ?\d[A-Za-z]{2}",
+    # 10 to 15 digits, laid out as an international number (+44 ...), a
+    # national number starting with 0 (020 7946 0958) or a separated North
+    # American one (212-555-0187), so dates and numeric IDs do not match
+    "phone_number": r"(?!\d{4}-\d{2}-\d{2})(?=(?:\D*\d){10,15}\D*$)(?:"
+    r"\+\d{1,3}[ .-]?\(?\d{1,5}\)?(?:[ .-]?\d{2,4}){2,5}"
+    r"|\(?0\d{2,4}\)?(?:[ .-]?\d{2,4}){2,4}"
+    r"|\(?[2-9]\d{2}\)?[ .-]\d{3}[ .-]\d{4})",
+}
+# one pattern with a named group per kind, so every value of a column is
+# matched against all of them in a single vectorized pass
+COMBINED_PATTERN = re.compile(
+    r"^\s*(?:"
+    + "|".join(f"(?P<{kind}>{pattern})" for kind, pattern in PII_PATTERNS.items())
+    + r")\s*$"
+)
+
+
+def sample_rows(
+    bucket_path: str, session: boto3.session.Session, rows: int = DEFAULT_SAMPLE_ROWS
+) -> pd.DataFrame:
+    """Reads the first rows of a file as text, without reading the rest of it
+
+    csv is parsed from the start of the stream, json records are split off
+    the start of the stream with JsonRecordSplitter, and parquet is read
+    from its first row group with ranged requests. The stream is closed as
+    soon as the rows are read, so a 10 GB file costs no more than a small
+    one. Compressed csv and json are decompressed as they are read.
+
+    Args:
+        bucket_path: path containing file
+        session: boto3 session
+        rows: number of rows to read
+
+    Returns:
+        A pandas dataframe of at most rows rows, every value as a string
+    """
+
+    file_extension, compression = split_extension(bucket_path)
+    if file_extension == ".parquet":
+        if compression is not None:
+            raise ValueError("Compressed parquet files are not supported, parquet is compressed internally")
+        parquet_file = pq.ParquetFile(open_object_reader(bucket_path, session))
+        batch = next(parquet_file.iter_batches(batch_size=rows), None)
+        if batch is None:
+            return pd.DataFrame(columns=parquet_file.schema_arrow.names)
+        return batch.to_pandas().astype(str)
+    if file_extension != ".csv" and file_extension != ".json" and file_extension not in JSON_LINES_EXTENSIONS:
+        raise ValueError("Unsuported data type. Can only process csv, json, and parquet file types")
+
+    body = open_object_stream(bucket_path, session)
+    with body:
+        stream = body if compression is None else open_decompressed(body, compression)
+        with stream:
+            if file_extension == ".csv":
+                return pd.read_csv(stream, nrows=rows, dtype=str, keep_default_na=False)
+            return _sample_json(stream, rows, file_extension in JSON_LINES_EXTENSIONS)
+
+
+def _sample_json(stream, rows: int, lines: bool) -> pd.DataFrame:
+    splitter = JsonRecordSplitter()
+    records = []
+    for chunk in iter(lambda: stream.read(SAMPLE_READ_SIZE), b""):
+        if not lines and not records and splitter.record_depth == 0 and chunk.strip()[:1] == b"{":
+            raise ValueError("column oriented json cannot be sampled, its rows are spread over the whole file")
+        records += splitter.feed(chunk)
+        if len(records) >= rows:
+            break
+    records = [json.loads(record) for record in records[:rows]]
+    # nested values are left as json text, which no pattern matches whole
+    return pd.DataFrame(records).map(
+        lambda value: json.dumps(value) if isinstance(value, (dict, list)) else value
+    ).astype(str)
+
+
+def match_pii_kinds(sample: pd.DataFrame, threshold: float = DEFAULT_DETECTION_THRESHOLD) -> dict:
+    """Finds the columns of a sample whose values are mostly one kind of PII
+
+    Each column is matched against COMBINED_PATTERN with a single
+    vectorized str.extract, which reports for every value the kind whose
+    group matched. Card numbers must also pass the Luhn check. Empty values
+    are ignored.
+
+    Args:
+        sample: a pandas dataframe of strings, see sample_rows
+        threshold: share of a column's non-empty values that must match
+
+    Returns:
+        A dictionary of column -> (kind, share of values matching it)
+    """
+
+    detected = {}
+    for name in sample.columns:
+        values = sample[name].str.strip()
+        values = values[(values != "") & (values != "nan") & (values != "None")]
+        if values.empty:
+            continue
+        kinds = values.str.extract(COMBINED_PATTERN).notna()
+        if "card_number" in kinds:
+            kinds["card_number"] &= luhn_valid(values)
+        rates = kinds.mean()
+        kind = rates.idxmax()
+        if rates[kind] >= threshold:
+            detected[name] = (kind, float(rates[kind]))
+    return detected
+
+
+def luhn_valid(values: pd.Series) -> pd.Series:
+    """Checks the Luhn checksum of every value of a column at once
+
+    The digits of the values are laid out right aligned in one array, so
+    doubling every second digit from the right and summing is a handful of
+    numpy operations over the whole column.
+    """
+
+    digits = values.str.replace(r"\D", "", regex=True)
+    width = max(int(digits.str.len().max()), 1)
+    padded = digits.str.zfill(width).to_numpy(dtype=f"S{width}")
+    table = np.frombuffer(padded.tobytes(), dtype=np.uint8).reshape(-1, width) - ord("0")
+    doubled = table[:, ::-1].astype(np.int64)
+    doubled[:, 1::2] *= 2
+    doubled[doubled > 9] -= 9
+    return pd.Series(
+        (doubled.sum(axis=1) % 10 == 0) & (digits.str.len() >= 13).to_numpy(),
+        index=values.index,
+    )
+
+
+def detect_pii_fields(
+    bucket_path: str,
+    session: boto3.session.Session,
+    rows: int = DEFAULT_SAMPLE_ROWS,
+    threshold: float = DEFAULT_DETECTION_THRESHOLD,
+) -> dict:
+    """Detects the PII columns of a file from a sample of its rows
+
+    Reads rows rows with sample_rows and matches them with match_pii_kinds,
+    so the cost is the sample alone, whatever the size of the file.
+
+    Args:
+        bucket_path: path containing file
+        session: boto3 session
+        rows: number of rows sampled
+        threshold: share of a column's non-empty sampled values that must
+            be one kind of PII for it to be detected
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: a dictionary of fields (the detected columns, in file
+                order), kinds (column -> kind of PII), match_rates
+                (column -> share of values matching) and rows (number of
+                rows sampled) (if successful)
+            message: a relevant error message (if unsuccessful)
+    """
+
+    try:
+        sample = sample_rows(bucket_path, session, rows)
+    except ClientError as ce:
+        return {"status": "failure", "message": ce.response}
+    except ValueError as ve:
+        return {"status": "failure", "message": str(ve)}
+    except (OSError, EOFError) as e:
+        return {"status": "failure", "message": f"{bucket_path} could not be sampled: {e}"}
+
+    detected = match_pii_kinds(sample, threshold)
+    return {
+        "status": "success",
+        "data": {
+            "fields": list(detected),
+            "kinds": {name: kind for name, (kind, _) in detected.items()},
+            "match_rates": {name: rate for name, (_, rate) in detected.items()},
+            "rows": len(sample),
+        },
+    }
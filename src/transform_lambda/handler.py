@@ -1,46 +1,515 @@
 import boto3
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 from src.transform_lambda.utils import (
     get_data_from_bucket,
     censor_sensitive_data,
     write_sensitive_data,
+    stream_sensitive_data,
+    spill_sensitive_data,
+    detect_sensitive_data,
 )
+from src.transform_lambda.metrics_utils import StageMetrics
+from src.transform_lambda.profiling_utils import (
+    get_profiler,
+    profile_destination,
+    write_profile,
+)
+from src.transform_lambda.preflight_utils import preflight_check
+from src.transform_lambda.planner_utils import plan_execution
+from src.transform_lambda.idempotency_utils import (
+    DEFAULT_TTL_SECONDS,
+    get_idempotency_store,
+    check_idempotency,
+    record_idempotency,
+)
+from src.transform_lambda.cache_utils import (
+    get_result_cache,
+    cache_filename,
+    upload_cached_file,
+)
+from src.transform_lambda.prefix_utils import (
+    process_prefix,
+    enqueue_prefix,
+    process_queue_records,
+)
+from src.transform_lambda.s3_utils import get_s3_client, connection_pool
+from src.transform_lambda.storage_utils import get_file_size, is_s3_path
+from src.transform_lambda.compression_utils import split_extension
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+DEFAULT_MAX_WORKERS = 8
+MAX_WORKERS_MESSAGE = "max_workers must be at least 1"
+# prefix event keys that configure the run rather than each file
+PREFIX_SETTINGS = [
+    "prefix_to_obfuscate",
+    "destination",
+    "max_workers",
+    "pool",
+    "checkpoint",
+    "queue_url",
+]
 
-def lambda_handler(event, context):
-    session = boto3.session.Session(region_name="eu-west-2")
+# kept at module level so warm invocations reuse the session and its clients
+_session = None
+
+
+def get_session() -> boto3.session.Session:
+    """Returns the boto3 session shared by every invocation of this container"""
+
+    global _session
+    if _session is None:
+        _session = boto3.session.Session(region_name="eu-west-2")
+    return _session
+
+
+def process_file(job: dict, session: boto3.session.Session) -> dict:
+    """Obfuscates a single file described by a job dictionary
+
+    Args:
+        job: dictionary containing file_to_obfuscate, pii_fields and destination,
+            plus the optional detect_pii, detect_pii_rows, preflight, streaming,
+            spill, engine, pipelined, masking, use_arrow, reader, column_types,
+            ranged_download, compression_level, parquet_compression,
+            idempotency, cache, metrics and profile settings. pii_fields can
+            be left out when detect_pii is set
+        session: boto3 session
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            message: a relevant success/failure message
+            metrics: wall time, bytes, rows and peak RSS per stage (if metrics
+                were enabled)
+            plan: the execution plan and the estimates behind it (if the
+                job left streaming unset), see plan_execution
+            detected_pii: the pii fields detected in the file (if the job
+                set detect_pii), see detect_sensitive_data
+            cache: whether the output came from the result cache, and the
+                cache's hit and miss counts since the container started (if
+                the job set cache), see run_cached_pipeline
+            profile: the paths of the cProfile and tracemalloc artifacts
+                written for each stage (if the job set profile), see
+                write_profile
+    """
+
+    try:
+        bucket_path = job["file_to_obfuscate"]
+        pii_fields = job.get("pii_fields", []) if job.get("detect_pii") else job["pii_fields"]
+        destination = job["destination"]
+    except:
+        return {"status": "failure", "message": "json input is incorrect"}
+
+    try:
+        profiler = get_profiler(job.get("profile"))
+        if profiler is not None:
+            profile_prefix = profile_destination(job["profile"], bucket_path)
+    except ValueError as ve:
+        return {"status": "failure", "message": str(ve)}
+
+    metrics = StageMetrics(
+        enabled=job.get("metrics", os.environ.get("OBFUSCATOR_METRICS") == "true"),
+        dimensions={"Format": split_extension(bucket_path)[0]},
+        profiler=profiler,
+    )
+    try:
+        idempotency = job.get("idempotency") or {}
+        store = get_idempotency_store(idempotency, session)
+        cache = get_result_cache(job.get("cache"))
+        if job.get("detect_pii") == "report":
+            # nothing is written, so there is nothing to reuse or record
+            store, cache = None, None
+        if not (is_s3_path(bucket_path) and is_s3_path(destination)):
+            # idempotency is keyed on, and checked against, S3 ETags
+            store = None
+        key, response = None, None
+        if store is not None:
+            with metrics.stage("idempotency_check"):
+                key, response = check_idempotency(job, store, session)
+        if response is None:
+            if cache is not None:
+                response = run_cached_pipeline(
+                    job, cache, bucket_path, pii_fields, destination, session, metrics
+                )
+            else:
+                response = run_pipeline(
+                    job, bucket_path, pii_fields, destination, session, metrics
+                )
+            if key is not None and response["status"] == "success":
+                record_idempotency(
+                    key,
+                    job,
+                    store,
+                    session,
+                    idempotency.get("ttl_seconds", DEFAULT_TTL_SECONDS),
+                )
+    except:
+        response = {"status": "failure", "message": "unexpected error"}
+
+    if metrics.enabled:
+        metrics.emit()
+        response["metrics"] = metrics.to_dict()
+    if profiler is not None:
+        response["profile"] = write_profile(profiler, profile_prefix, session)
+    return response
+
+
+def run_cached_pipeline(
+    job: dict,
+    cache,
+    bucket_path: str,
+    pii_fields: list,
+    destination: str,
+    session: boto3.session.Session,
+    metrics: StageMetrics,
+) -> dict:
+    """Runs a job through the result cache in /tmp
+
+    On a hit the cached output is uploaded to the destination straight
+    away, without reading the source. On a miss the pipeline writes the
+    output into the cache, from where it is uploaded, so the next job with
+    the same source content, masking, output format and settings is a hit.
+    Jobs that cannot be cached (see cache_filename) run as usual.
+    """
+
+    with metrics.stage("cache_check"):
+        filename = cache_filename(job, cache, session)
+        cached = None if filename is None else cache.open(filename)
+    hit = cached is not None
+
+    if hit:
+        with metrics.stage("cache_upload") as stage:
+            stage["bytes_out"] = upload_cached_file(cached, destination, session)
+        response = {"status": "success", "message": f"{destination} written from cache"}
+    elif filename is None:
+        response = run_pipeline(job, bucket_path, pii_fields, destination, session, metrics)
+    else:
+        cache_path = cache.path(filename)
+        try:
+            response = run_pipeline(job, bucket_path, pii_fields, cache_path, session, metrics)
+            if response["status"] == "success":
+                with metrics.stage("cache_upload") as stage:
+                    written = open(os.path.join(cache.directory, filename), "rb")
+                    stage["bytes_out"] = upload_cached_file(written, destination, session)
+                cache.put(filename)
+                response["message"] = response["message"].replace(cache_path, destination)
+        finally:
+            # a file that was never put would never be evicted
+            cache.discard(filename)
+    response["cache"] = {"hit": hit, **cache.counts()}
+    return response
+
+
+def run_pipeline(
+    job: dict,
+    bucket_path: str,
+    pii_fields: list,
+    destination: str,
+    session: boto3.session.Session,
+    metrics: StageMetrics,
+) -> dict:
+    """Runs the download, censor and write stages for one file, see process_file
+
+    Unless the job sets streaming or spill, plan_execution decides whether
+    the file is processed in memory, streamed or spilled to /tmp, and the
+    plan is added to the response. If the job sets detect_pii, PII columns
+    are first detected from a sample of the file (see
+    detect_sensitive_data) and added to pii_fields, and what was detected
+    is added to the response; with detect_pii set to "report" nothing else
+    is done.
+    """
+
+    if job.get("detect_pii"):
+        with metrics.stage("detect_pii"):
+            detection = detect_sensitive_data(bucket_path, session, job.get("detect_pii_rows"))
+        if detection["status"] == "failure":
+            return detection
+        if job["detect_pii"] == "report":
+            return {
+                "status": "success",
+                "message": f"{len(detection['data']['fields'])} pii fields detected",
+                "detected_pii": detection["data"],
+            }
+        pii_fields = pii_fields + [
+            field for field in detection["data"]["fields"] if field not in pii_fields
+        ]
+        response = run_pipeline(
+            {**job, "detect_pii": False}, bucket_path, pii_fields, destination, session, metrics
+        )
+        response["detected_pii"] = detection["data"]
+        return response
+
+    if job.get("preflight", True):
+        with metrics.stage("preflight_check"):
+            response0 = preflight_check(
+                bucket_path, pii_fields, session, job.get("masking")
+            )
+        if response0["status"] == "failure":
+            return response0
+        for warning in response0["data"]["warnings"]:
+            logger.warning("%s: %s", bucket_path, warning)
+
+    if job.get("streaming") is not None or job.get("spill") is not None:
+        return execute_plan(job, bucket_path, pii_fields, destination, session, metrics)
+
+    with metrics.stage("plan_execution"):
+        plan = plan_execution(bucket_path, session, job)
+    if plan["status"] == "failure":
+        return plan
+    mode = plan["data"]["mode"]
+    response = execute_plan(
+        {**job, "streaming": mode == "streaming", "spill": mode == "spill"},
+        bucket_path,
+        pii_fields,
+        destination,
+        session,
+        metrics,
+    )
+    response["plan"] = plan["data"]
+    return response
+
+
+def execute_plan(
+    job: dict,
+    bucket_path: str,
+    pii_fields: list,
+    destination: str,
+    session: boto3.session.Session,
+    metrics: StageMetrics,
+) -> dict:
+    """Processes one file in memory or, if the job sets streaming or spill, streamed or spilled"""
+
+    if job.get("spill", False):
+        with metrics.stage("spill_sensitive_data") as stage:
+            response = spill_sensitive_data(
+                bucket_path,
+                pii_fields,
+                destination,
+                session,
+                masking=job.get("masking"),
+                compression_level=job.get("compression_level"),
+                parquet_compression=job.get("parquet_compression", "snappy"),
+            )
+        if metrics.enabled and response["status"] == "success":
+            stage["bytes_in"] = get_file_size(bucket_path, session)
+            stage["bytes_out"] = get_file_size(destination, session)
+        return response
+
+    if job.get("streaming", False):
+        with metrics.stage("stream_sensitive_data") as stage:
+            response = stream_sensitive_data(
+                bucket_path,
+                pii_fields,
+                destination,
+                session,
+                engine=job.get("engine", "pandas"),
+                masking=job.get("masking"),
+                compression_level=job.get("compression_level"),
+                parquet_compression=job.get("parquet_compression", "snappy"),
+                pipelined=job.get("pipelined", False),
+            )
+        if metrics.enabled and response["status"] == "success":
+            stage["bytes_in"] = get_file_size(bucket_path, session)
+            stage["bytes_out"] = get_file_size(destination, session)
+        return response
+
+    with metrics.stage("get_data_from_bucket") as stage:
+        response1 = get_data_from_bucket(
+            bucket_path,
+            session,
+            job.get("ranged_download"),
+            job.get("use_arrow", False),
+            job.get("reader", "pandas"),
+            # PII fields are read as text unless the job types them itself
+            {**dict.fromkeys(pii_fields, "string"), **(job.get("column_types") or {})},
+        )
+
+    if response1["status"] == "failure":
+        return response1
+
+    if metrics.enabled:
+        stage["bytes_in"] = get_file_size(bucket_path, session)
+        stage["rows"] = len(response1["data"])
+
+    with metrics.stage("censor_sensitive_data") as stage:
+        response2 = censor_sensitive_data(response1, pii_fields, job.get("masking"))
+
+    if response2["status"] == "failure":
+        return response2
+
+    if metrics.enabled:
+        stage["rows"] = len(response2["data"])
+
+    with metrics.stage("write_sensitive_data") as stage:
+        response3 = write_sensitive_data(
+            response2,
+            destination,
+            session,
+            compression_level=job.get("compression_level"),
+            parquet_compression=job.get("parquet_compression", "snappy"),
+        )
+
+    if metrics.enabled and response3["status"] == "success":
+        stage["bytes_out"] = get_file_size(destination, session)
+    return response3
+
+
+def process_batch(
+    jobs: list, session: boto3.session.Session, max_workers: int = DEFAULT_MAX_WORKERS
+) -> dict:
+    """Obfuscates several files concurrently on a bounded thread pool
+
+    All jobs share one session. While they run, its S3 clients and
+    awswrangler pool at least one connection per worker, see
+    s3_utils.connection_pool, so concurrent transfers do not wait for one.
+
+    Args:
+        jobs: list of job dictionaries, see process_file
+        session: boto3 session shared by every job
+        max_workers: maximum number of files processed at the same time
+
+    Returns:
+        A dictionary containing the following:
+            status: "success" if every file was obfuscated, otherwise "failure"
+            message: how many files were obfuscated
+            results: one dictionary per job, in the order given, holding the
+                job's file_to_obfuscate and the response from process_file
+    """
+
+    with connection_pool(session, max_workers):
+        # resolve credentials once before the session is shared between threads
+        get_s3_client(session)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            responses = list(executor.map(lambda job: process_file(job, session), jobs))
+
+    results = [
+        {"file_to_obfuscate": job.get("file_to_obfuscate"), **response}
+        for job, response in zip(jobs, responses)
+    ]
+    succeeded = sum(result["status"] == "success" for result in results)
+    return {
+        "status": "success" if succeeded == len(results) else "failure",
+        "message": f"{succeeded} of {len(results)} files obfuscated",
+        "results": results,
+    }
+
+
+def process_prefix_event(event: dict, session: boto3.session.Session) -> dict:
+    """Obfuscates, or queues, every file under prefix_to_obfuscate
+
+    Args:
+        event: dictionary containing prefix_to_obfuscate, destination (a
+            prefix) and pii_fields, plus the optional max_workers, pool,
+            checkpoint and queue_url settings. Any other settings are
+            applied to every file, see process_file
+        session: boto3 session
+
+    Returns:
+        The response from process_prefix, or from enqueue_prefix if a
+        queue_url was given
+    """
 
     try:
-        bucket_path = event["file_to_obfuscate"]
-        pii_fields = event["pii_fields"]
+        prefix_path = event["prefix_to_obfuscate"]
         destination = event["destination"]
+        event["pii_fields"]
+        job = {
+            key: value
+            for key, value in event.items()
+            if key not in PREFIX_SETTINGS
+        }
+        max_workers = int(event.get("max_workers", DEFAULT_MAX_WORKERS))
     except:
         return {"status": "failure", "message": "json input is incorrect"}
+    if max_workers < 1:
+        return {"status": "failure", "message": MAX_WORKERS_MESSAGE}
 
     try:
-        response1 = get_data_from_bucket(bucket_path, session)
+        if "queue_url" in event:
+            return enqueue_prefix(
+                prefix_path,
+                destination,
+                job,
+                session,
+                event["queue_url"],
+                checkpoint_path=event.get("checkpoint"),
+            )
+        # Lambda has no /dev/shm for process pools to use, so threads by default
+        return process_prefix(
+            prefix_path,
+            destination,
+            job,
+            session,
+            max_workers,
+            pool=event.get("pool", "thread"),
+            checkpoint_path=event.get("checkpoint"),
+        )
+    except ClientError as ce:
+        return {"status": "failure", "message": ce.response}
+    except ValueError as ve:
+        return {"status": "failure", "message": str(ve)}
+
 
-        if response1["status"] == "failure":
-            return response1
+def lambda_handler(event, context):
+    session = get_session()
+
+    if "Records" in event:
+        return process_queue_records(event["Records"], session)
 
-        response2 = censor_sensitive_data(response1, pii_fields)
+    if "prefix_to_obfuscate" in event:
+        return process_prefix_event(event, session)
 
-        if response2["status"] == "failure":
-            return response2
+    if "files" not in event:
+        return process_file(event, session)
 
-        response3 = write_sensitive_data(response2, destination, session)
-        return response3
+    try:
+        defaults = {key: value for key, value in event.items() if key != "files"}
+        jobs = [{**defaults, **job} for job in event["files"]]
+        max_workers = int(event.get("max_workers", DEFAULT_MAX_WORKERS))
     except:
-        return {"status": "failure", "message": "unexpected error"}
+        return {"status": "failure", "message": "json input is incorrect"}
+    if max_workers < 1:
+        return {"status": "failure", "message": MAX_WORKERS_MESSAGE}
+
+    return process_batch(jobs, session, max_workers)
 
 
 # event = {
 #     "file_to_obfuscate": "s3://<source_bucket>/<source_file>",
 #     "pii_fields": ["field1", "field2"],
-#     "destination": "s3://<destination_bucket>/<destination_file>"
+#     "destination": "s3://<destination_bucket>/<destination_file>",
+#     "preflight": True,
+#     "streaming": None,
+#     "spill": None,
+#     "engine": "pandas",
+#     "pipelined": False,
+#     "masking": {"field1": "hash"},
+#     "detect_pii": False,
+#     "detect_pii_rows": 1000,
+#     "use_arrow": False,
+#     "reader": "pandas",
+#     "column_types": {"field1": "string"},
+#     "ranged_download": {"part_size": 8388608, "max_concurrency": 10},
+#     "compression_level": 6,
+#     "parquet_compression": "snappy",
+#     "idempotency": {"store": "dynamodb", "table": "<table>", "ttl_seconds": 604800},
+#     "cache": {"path": "/tmp/obfuscator_cache", "max_bytes": 268435456},
+#     "profile": {"profilers": ["cprofile", "tracemalloc"], "destination": "s3://<bucket>/profiles"},
+#     "metrics": False
+# }
+
+# prefix_event = {
+#     "prefix_to_obfuscate": "s3://<source_bucket>/<source_prefix>/",
+#     "pii_fields": ["field1", "field2"],
+#     "destination": "s3://<destination_bucket>/<destination_prefix>/",
+#     "max_workers": 8,
+#     "pool": "thread",
+#     "checkpoint": "s3://<destination_bucket>/<destination_prefix>/_checkpoint/",
+#     "queue_url": "https://sqs.<region>.amazonaws.com/<account>/<queue>"
 # }
 
 # lambda_handler(event, "unused")
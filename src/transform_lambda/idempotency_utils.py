@@ -0,0 +1,237 @@
+import abc
+import boto3
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from botocore.exceptions import ClientError
+from src.transform_lambda.preflight_utils import HMAC_KEY_ENV, masking_strategies
+from src.transform_lambda.s3_utils import split_s3_path, get_s3_client, get_object_etag
+from src.transform_lambda.compression_utils import split_extension
+
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+DEFAULT_SQLITE_PATH = "/tmp/obfuscator_idempotency.db"
+# job settings that change the bytes written, besides pii_fields and masking
+OUTPUT_SETTINGS = [
+    "detect_pii",
+    "detect_pii_rows",
+    "streaming",
+    "spill",
+    "engine",
+    "use_arrow",
+    "reader",
+    "column_types",
+    "compression_level",
+    "parquet_compression",
+]
+
+# (store, location) -> store, kept so warm invocations reuse connections
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class IdempotencyStore(abc.ABC):
+    """Interface of the stores that remember which objects were obfuscated
+
+    Records are dictionaries stored under an idempotency key for
+    ttl_seconds; get returns None for keys that were never stored or have
+    expired.
+    """
+
+    @abc.abstractmethod
+    def get(self, key: str):
+        pass
+
+    @abc.abstractmethod
+    def put(self, key: str, record: dict, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        pass
+
+
+class SqliteIdempotencyStore(IdempotencyStore):
+    """Idempotency store in a local SQLite file
+
+    Suited to tests and to a single Lambda container (using a path under
+    /tmp); records are not shared between containers. Expired records are
+    deleted whenever a record is stored.
+    """
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency "
+                "(idempotency_key TEXT PRIMARY KEY, record TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT record FROM idempotency WHERE idempotency_key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, key: str, record: dict, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM idempotency WHERE expires_at <= ?", (now,))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO idempotency VALUES (?, ?, ?)",
+                (key, json.dumps(record), now + ttl_seconds),
+            )
+
+
+class DynamoDbIdempotencyStore(IdempotencyStore):
+    """Idempotency store in a DynamoDB table shared by every invocation
+
+    The table needs a string partition key named idempotency_key. Enabling
+    DynamoDB TTL on its expires_at attribute lets DynamoDB delete expired
+    records; as that can take a while, get also ignores them.
+    """
+
+    def __init__(self, table_name: str, session: boto3.session.Session):
+        self.table_name = table_name
+        self.client = session.client("dynamodb")
+
+    def get(self, key: str):
+        item = self.client.get_item(
+            TableName=self.table_name,
+            Key={"idempotency_key": {"S": key}},
+            ConsistentRead=True,
+        ).get("Item")
+        if item is None or float(item["expires_at"]["N"]) <= time.time():
+            return None
+        return json.loads(item["record"]["S"])
+
+    def put(self, key: str, record: dict, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                "idempotency_key": {"S": key},
+                "record": {"S": json.dumps(record)},
+                "expires_at": {"N": str(int(time.time() + ttl_seconds))},
+            },
+        )
+
+
+def get_idempotency_store(config: dict, session: boto3.session.Session):
+    """Returns the store described by a job's idempotency settings
+
+    Args:
+        config: None, or a dictionary with store ("sqlite" or "dynamodb")
+            and path (sqlite) or table (dynamodb)
+        session: boto3 session
+
+    Returns:
+        An IdempotencyStore, or None if config is empty
+    """
+
+    if not config:
+        return None
+    store = config.get("store", "sqlite")
+    if store == "sqlite":
+        location = config.get("path", DEFAULT_SQLITE_PATH)
+    elif store == "dynamodb":
+        location = config["table"]
+    else:
+        raise ValueError(f"Unknown idempotency store {store}. Can only use sqlite or dynamodb")
+    with _stores_lock:
+        if (store, location) not in _stores:
+            if store == "sqlite":
+                _stores[store, location] = SqliteIdempotencyStore(location)
+            else:
+                _stores[store, location] = DynamoDbIdempotencyStore(location, session)
+        return _stores[store, location]
+
+
+def idempotency_key(source_etag: str, job: dict) -> str:
+    """Returns the key identifying the output of a job
+
+    Two jobs share a key when they would write the same bytes: the source
+    content (its ETag), the PII fields and how each is masked, the output
+    format and settings, and, for hashed fields, the HMAC key (by
+    fingerprint) all match. The source path is deliberately not part of
+    the key.
+    """
+
+    pii_fields = job.get("pii_fields", [])
+    if job.get("detect_pii"):
+        # detected fields are only known once the file is sampled, so every
+        # masking entry could apply
+        pii_fields = pii_fields + list(job.get("masking") or {})
+    strategies = masking_strategies(pii_fields, job.get("masking"))
+    hmac_key = os.environ.get(HMAC_KEY_ENV, "") if "hash" in strategies.values() else ""
+    fields = {
+        "etag": source_etag,
+        "masking": sorted(strategies.items()),
+        "format": split_extension(job["destination"]),
+        "settings": {setting: job.get(setting) for setting in OUTPUT_SETTINGS},
+        "hmac_key": hashlib.sha256(hmac_key.encode("utf-8")).hexdigest() if hmac_key else None,
+    }
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def check_idempotency(job: dict, store: IdempotencyStore, session: boto3.session.Session) -> tuple:
+    """Looks up a job in the store and reuses its earlier output if it is still there
+
+    The earlier output is reused only if it still has the ETag it was
+    written with. If it is at the job's destination nothing is done;
+    otherwise it is copied to the destination inside S3.
+
+    Returns:
+        A tuple of (idempotency key, response). The response is None when
+        the job has to run, in which case the key is passed to
+        record_idempotency afterwards
+    """
+
+    try:
+        key = idempotency_key(get_object_etag(job["file_to_obfuscate"], session), job)
+    except (ClientError, ValueError):
+        # let the pipeline report the missing file or bad settings
+        return None, None
+    record = store.get(key)
+    if record is None:
+        return key, None
+    try:
+        if get_object_etag(record["destination"], session) != record["output_etag"]:
+            return key, None
+    except ClientError:
+        return key, None
+
+    destination = job["destination"]
+    if record["destination"] == destination:
+        return key, {
+            "status": "success",
+            "message": f"{destination} already obfuscated",
+        }
+    source_bucket, source_key = split_s3_path(record["destination"])
+    bucket, object_key = split_s3_path(destination)
+    get_s3_client(session).copy({"Bucket": source_bucket, "Key": source_key}, bucket, object_key)
+    return key, {
+        "status": "success",
+        "message": f"{destination} copied from {record['destination']}",
+    }
+
+
+def record_idempotency(
+    key: str,
+    job: dict,
+    store: IdempotencyStore,
+    session: boto3.session.Session,
+    ttl_seconds: int = DEFAULT_TTL_SECONDS,
+):
+    """Stores the output of a successful job under its idempotency key"""
+
+    store.put(
+        key,
+        {
+            "source": job["file_to_obfuscate"],
+            "destination": job["destination"],
+            "output_etag": get_object_etag(job["destination"], session),
+        },
+        ttl_seconds,
+    )
@@ -0,0 +1,438 @@
+import boto3
+import json
+import re
+from botocore.exceptions import ClientError
+from src.transform_lambda.s3_utils import DEFAULT_PART_SIZE
+from src.transform_lambda.storage_utils import open_object_stream
+from src.transform_lambda.compression_utils import open_decompressed, open_compressed_writer
+from src.transform_lambda.pipeline_utils import pipeline_splice_data
+
+DEFAULT_SPLICE_CHUNK_SIZE = 8 * 1024 * 1024
+# newline delimited json, one record per line, which can only be streamed
+JSON_LINES_EXTENSIONS = (".jsonl", ".ndjson")
+# path segment standing for every element of an array, as in orders[].card_number
+ANY_ELEMENT = "[]"
+
+# a string (group 1 is its closing quote, missing while the string is cut
+# off at the end of the data read so far) or a structural character
+TOKEN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*(")?|[{}\[\]:,]')
+# inside a subtree copied or dropped whole only strings and brackets matter
+BRACKET = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*(")?|[{}\[\]]')
+WHITESPACE = re.compile(rb"[ \t\r\n]*")
+SCALAR_END = re.compile(rb"[,:\]} \t\r\n]")
+
+
+def split_json_path(field: str) -> list:
+    """Splits a PII field into the keys leading to it
+
+    "customer.contact.email" gives ["customer", "contact", "email"] and
+    "orders[].card_number" gives ["orders", "[]", "card_number"], where "[]"
+    stands for every element of an array. A field without dots or brackets
+    is a single top-level key.
+    """
+
+    segments = []
+    for part in field.split("."):
+        elements = 0
+        while part.endswith(ANY_ELEMENT):
+            part = part[: -len(ANY_ELEMENT)]
+            elements += 1
+        if part:
+            segments.append(part)
+        segments.extend([ANY_ELEMENT] * elements)
+    return segments
+
+
+def is_json_path(field: str) -> bool:
+    """Returns whether a PII field points below the top level of a record"""
+
+    return len(split_json_path(field)) > 1
+
+
+def parse_json_paths(pii_fields: list) -> dict:
+    """Builds the tree of keys JsonSplicer follows
+
+    Each level maps a key (or "[]") to the next level, and each path ends in
+    the PII field it came from. A field that is the prefix of another masks
+    the whole subtree, so the longer one is dropped.
+    """
+
+    root = {}
+    for field in pii_fields:
+        segments = split_json_path(field)
+        if not segments:
+            continue
+        node = root
+        for segment in segments[:-1]:
+            child = node.setdefault(segment, {})
+            if isinstance(child, str):
+                break
+            node = child
+        else:
+            node[segments[-1]] = field
+    return root
+
+
+def mask_json_path(value, segments: list, mask: str = "***"):
+    """Returns a parsed json value with everything at segments replaced by mask
+
+    Used for nested fields of records that are already in memory; values
+    without the path are returned unchanged.
+    """
+
+    if not segments:
+        return mask
+    head, rest = segments[0], segments[1:]
+    if head == ANY_ELEMENT:
+        if isinstance(value, list):
+            return [mask_json_path(element, rest, mask) for element in value]
+        return value
+    if isinstance(value, dict) and head in value:
+        return {**value, head: mask_json_path(value[head], rest, mask)}
+    return value
+
+
+class JsonSplicer:
+    """Replaces the values at given paths of a json stream without parsing the rest
+
+    Bytes are fed in arbitrary chunks, as with CsvSplicer, and the censored
+    bytes are returned as soon as they are decided. The input can be a
+    document holding an array of records or a single record, or newline
+    delimited records; paths are relative to each record. Only the keys of
+    objects on the way to a PII path are decoded. Subtrees with no PII below
+    them are copied and masked subtrees are dropped while only their
+    brackets are counted, so no Python objects are built for either and
+    memory use does not depend on the size of a record. A masked value of
+    any type, including objects and arrays, is replaced with mask.
+    """
+
+    def __init__(self, pii_fields: list, mask: bytes = b'"***"'):
+        self.pii_fields = pii_fields
+        self.mask = mask
+        self.paths = parse_json_paths(pii_fields)
+        # one [is_object, node, expecting_key, value_node] per open container
+        # on the way to a PII path
+        self.stack = []
+        # depth inside a subtree that is being copied or dropped whole
+        self.depth = 0
+        self.dropping = False
+        self.mask_next = False
+        self.found = set()
+        self.pending = b""
+
+    @property
+    def missing_fields(self) -> list:
+        return [field for field in self.pii_fields if field not in self.found]
+
+    def feed(self, data: bytes) -> bytes:
+        """Consumes a chunk of input and returns as much censored output as is decided"""
+
+        self.pending += data
+        return self._splice(final=False)
+
+    def finish(self) -> bytes:
+        """Returns the rest of the output once all the input has been fed"""
+
+        output = self._splice(final=True)
+        if self.pending.strip() or self.stack or self.depth or self.mask_next:
+            raise ValueError("json ends in the middle of a value")
+        output += self.pending
+        self.pending = b""
+        return output
+
+    def _value_node(self):
+        # the node of the value starting now; the record itself at the top level
+        if not self.stack:
+            return self.paths
+        frame = self.stack[-1]
+        return frame[3] if frame[0] else frame[1]
+
+    def _splice(self, final: bool) -> bytes:
+        data = self.pending
+        end = len(data)
+        output = []
+        start = position = 0
+        while position < end:
+            if self.depth:
+                match = BRACKET.search(data, position)
+                if match is None:
+                    position = end
+                    break
+                token = match.group(0)
+                if token[:1] == b'"':
+                    if match.group(1) is None:
+                        position = match.start()
+                        break
+                elif token in b"{[":
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+                position = match.end()
+                if self.dropping:
+                    start = position
+                    if not self.depth:
+                        output.append(self.mask)
+                        self.dropping = False
+                continue
+
+            if self.mask_next:
+                value = WHITESPACE.match(data, position).end()
+                if value == end:
+                    position = end
+                    break
+                first = data[value : value + 1]
+                if first in b"]}":
+                    # an empty array has no element to mask
+                    self.mask_next = False
+                    position = value
+                    continue
+                if first == b'"':
+                    match = TOKEN.match(data, value)
+                    if match.group(1) is None:
+                        position = value
+                        break
+                    value_end = match.end()
+                elif first in b"{[":
+                    output.append(data[start:value])
+                    start = position = value + 1
+                    self.depth = 1
+                    self.dropping = True
+                    self.mask_next = False
+                    continue
+                else:
+                    match = SCALAR_END.search(data, value)
+                    if match is None and not final:
+                        position = value
+                        break
+                    value_end = end if match is None else match.start()
+                output.append(data[start:value])
+                output.append(self.mask)
+                start = position = value_end
+                self.mask_next = False
+                continue
+
+            match = TOKEN.search(data, position)
+            if match is None:
+                position = end
+                break
+            token = match.group(0)
+            if token[:1] == b'"':
+                if match.group(1) is None:
+                    position = match.start()
+                    break
+                if self.stack and self.stack[-1][0] and self.stack[-1][2]:
+                    frame = self.stack[-1]
+                    frame[3] = frame[1].get(json.loads(token))
+                    frame[2] = False
+                position = match.end()
+                continue
+
+            position = match.end()
+            if token == b"{":
+                node = self._value_node()
+                if isinstance(node, dict) and node:
+                    self.stack.append([True, node, True, None])
+                else:
+                    self.depth = 1
+            elif token == b"[":
+                node = self._value_node()
+                if not self.stack:
+                    # a top-level array holds records
+                    element = node
+                elif isinstance(node, dict):
+                    element = node.get(ANY_ELEMENT)
+                else:
+                    element = None
+                if element:
+                    self.stack.append([False, element, False, None])
+                    if isinstance(element, str):
+                        self.found.add(element)
+                        self.mask_next = True
+                else:
+                    self.depth = 1
+            elif token == b":":
+                frame = self.stack[-1] if self.stack else None
+                if frame is not None and isinstance(frame[3], str):
+                    self.found.add(frame[3])
+                    self.mask_next = True
+            elif token == b",":
+                frame = self.stack[-1] if self.stack else None
+                if frame is not None and frame[0]:
+                    frame[2] = True
+                    frame[3] = None
+                elif frame is not None and isinstance(frame[1], str):
+                    self.mask_next = True
+            elif self.stack:
+                self.stack.pop()
+
+        if self.dropping:
+            start = position
+        output.append(data[start:position])
+        self.pending = data[position:]
+        return b"".join(output)
+
+
+class JsonRecordSplitter:
+    """Splits a json stream into the bytes of each of its records
+
+    Records are the objects in a top-level array, or newline delimited
+    objects. As with JsonSplicer only strings and brackets are scanned and
+    bytes are fed in arbitrary chunks; only the record being read is held.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        # depth records start at, 1 inside a top-level array
+        self.record_depth = 0
+        self.start = None
+        self.pending = b""
+        self.position = 0
+
+    def feed(self, data: bytes) -> list:
+        """Consumes a chunk of input and returns the records completed by it"""
+
+        data = self.pending + data
+        records = []
+        position = self.position
+        while True:
+            match = BRACKET.search(data, position)
+            if match is None:
+                position = len(data)
+                break
+            token = match.group(0)
+            if token[:1] == b'"':
+                if match.group(1) is None:
+                    position = match.start()
+                    break
+            elif token in b"{[":
+                if self.depth == 0 and token == b"[" and self.start is None:
+                    self.record_depth = 1
+                elif self.depth == self.record_depth and token == b"{":
+                    self.start = match.start()
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth == self.record_depth and self.start is not None:
+                    records.append(data[self.start : match.end()])
+                    self.start = None
+            position = match.end()
+        keep = position if self.start is None else self.start
+        self.pending = data[keep:]
+        self.position = position - keep
+        if self.start is not None:
+            self.start = 0
+        return records
+
+    def finish(self):
+        """Checks that the input did not end inside a record"""
+
+        if self.depth or self.start is not None:
+            raise ValueError("json ends in the middle of a value")
+
+
+def iter_spliced_json_chunks(
+    path: str,
+    pii_fields: list,
+    session: boto3.session.Session,
+    chunk_size: int = DEFAULT_SPLICE_CHUNK_SIZE,
+    compression: str = None,
+):
+    """Censors a json or newline delimited json file and yields the result in chunks
+
+    Only the values at the PII paths are rewritten, see JsonSplicer; every
+    other byte, including whitespace and number formatting, is passed
+    through unchanged.
+
+    Args:
+        path: string representing S3 object to be censored
+        pii_fields: list of PII keys or paths, such as customer.contact.email
+            or orders[].card_number
+        session: Boto3 session
+        chunk_size: number of bytes read from S3 (or decompressed) at a time
+        compression: codec the object is compressed with, if any
+
+    Yields:
+        The censored json as consecutive byte strings
+    """
+
+    body = open_object_stream(path, session)
+    splicer = JsonSplicer(pii_fields)
+    if compression is not None:
+        with body, open_decompressed(body, compression) as stream:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                yield splicer.feed(chunk)
+    else:
+        with body:
+            for chunk in iter(lambda: body.read(chunk_size), b""):
+                yield splicer.feed(chunk)
+    yield splicer.finish()
+    for field in splicer.missing_fields:
+        print(f"{field} not in data set")
+
+
+def splice_json_data(
+    path: str,
+    destination_bucket: str,
+    pii_fields: list,
+    session: boto3.session.Session,
+    chunk_size: int = DEFAULT_SPLICE_CHUNK_SIZE,
+    part_size: int = DEFAULT_PART_SIZE,
+    compression: str = None,
+    output_compression: str = None,
+    compression_level: int = None,
+    pipelined: bool = False,
+) -> dict:
+    """Censors a json or newline delimited json file, streaming the result to S3
+
+    Peak memory is one chunk plus one multipart upload part, however large
+    the file or its records are.
+
+    Args:
+        path: string representing S3 object to be censored
+        destination_bucket: S3 path the censored json is written to
+        pii_fields: list of PII keys or paths, see iter_spliced_json_chunks
+        session: Boto3 session
+        chunk_size: number of bytes read from S3 at a time
+        part_size: size in bytes of each multipart upload part
+        compression: codec the source is compressed with, if any
+        output_compression: codec to compress the output with, if any
+        compression_level: optional level for output_compression
+        pipelined: overlap the download, splicing and upload of consecutive
+            chunks, see pipeline_splice_data
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            message: a relevant success/failure message
+    """
+
+    if pipelined:
+        return pipeline_splice_data(
+            path,
+            destination_bucket,
+            JsonSplicer(pii_fields),
+            session,
+            chunk_size,
+            part_size,
+            compression=compression,
+            output_compression=output_compression,
+            compression_level=compression_level,
+        )
+    try:
+        with open_compressed_writer(
+            destination_bucket, session, output_compression, compression_level, part_size
+        ) as writer:
+            for chunk in iter_spliced_json_chunks(
+                path, pii_fields, session, chunk_size, compression
+            ):
+                writer.write(chunk)
+        return {
+            "status": "success",
+            "message": f"json streamed to {destination_bucket}",
+        }
+    except ClientError as ce:
+        return {"status": "failure", "message": ce.response}
+    except ValueError as ve:
+        return {"status": "failure", "message": str(ve)}
+    except (OSError, EOFError) as e:
+        return {"status": "failure", "message": f"{path} could not be decompressed: {e}"}
@@ -1,21 +1,154 @@
 import boto3
+import functools
+import io
+import json
 from botocore.exceptions import ClientError
 import pandas as pd
+import pyarrow as pa
+import pyarrow.json as pa_json
 import awswrangler as wr
 from awswrangler.exceptions import NoFilesFound
+from src.transform_lambda.s3_utils import read_downloaded_object
+from src.transform_lambda.storage_utils import is_s3_path, read_object_bytes
+from src.transform_lambda.compression_utils import read_compressed_object, open_compressed_writer
+from src.transform_lambda.csv_utils import arrow_column_types
 import logging
 
 logger = logging.getLogger("ftpuploader")
 
 
+def pandas_text_types(column_types: dict = None) -> dict:
+    """Returns the pd.read_json dtype for the columns column_types types as
+    text, so values such as 07700900123 are not parsed as numbers"""
+
+    return {
+        name: "string"
+        for name, data_type in arrow_column_types(column_types).items()
+        if pa.types.is_string(data_type) or pa.types.is_large_string(data_type)
+    }
+
+
+def read_json_text(source, column_types: dict = None) -> pd.DataFrame:
+    """Parses a local json file or buffer with pd.read_json
+
+    Columns column_types types as text (the pii_fields, see
+    handler.execute_plan) are read as text rather than as the numbers or
+    dates pandas would guess, so they are hashed as read_json_arrow and
+    read_json_table_source read them.
+    """
+
+    return pd.read_json(source, dtype=pandas_text_types(column_types) or True)
+
+
+def read_json_records(data: bytes, schema: pa.Schema = None) -> pa.Table:
+    """Parses the bytes of a list of json records into an Arrow table
+
+    Arrow only reads newline delimited records, so the list is wrapped as
+    the single value of a one line document, read in one block and unnested
+    into columns. That block is parsed by one thread, but without building
+    a Python object per field as json.load does. Arrow guesses that text
+    such as 2022-11-03 is a timestamp, so those columns are read again as
+    text and every value is kept as it was written. schema fixes the types
+    of its columns instead, such as those of the first batch of a spilled
+    file; other columns are appended after them.
+
+    Raises:
+        ValueError: if data is not valid json or not a list of records, or
+            a value does not fit schema
+    """
+
+    document = b'{"records":' + data + b"}"
+    records_type = None if schema is None else pa.list_(pa.struct(schema))
+    records = _parse_records(document, records_type)
+    text_type = _timestamps_as_text(records.type)
+    if text_type != records.type:
+        records = _parse_records(document, text_type)
+    if pa.types.is_null(records.type.value_type):
+        return pa.table({})
+    if not pa.types.is_struct(records.type.value_type):
+        raise ValueError("json does not hold a list of records")
+    table = pa.Table.from_struct_array(records.flatten())
+    return table
+
+
+def _parse_records(document: bytes, records_type: pa.DataType = None) -> pa.Array:
+    parse_options = None
+    if records_type is not None:
+        parse_options = pa_json.ParseOptions(
+            explicit_schema=pa.schema([pa.field("records", records_type)])
+        )
+    return (
+        pa_json.read_json(
+            pa.BufferReader(document),
+            read_options=pa_json.ReadOptions(use_threads=True, block_size=len(document)),
+            parse_options=parse_options,
+        )
+        .column("records")
+        .combine_chunks()
+    )
+
+
+def _timestamps_as_text(data_type: pa.DataType) -> pa.DataType:
+    if pa.types.is_timestamp(data_type):
+        return pa.string()
+    if pa.types.is_struct(data_type):
+        return pa.struct([field.with_type(_timestamps_as_text(field.type)) for field in data_type])
+    if pa.types.is_list(data_type):
+        return pa.list_(data_type.value_field.with_type(_timestamps_as_text(data_type.value_type)))
+    return data_type
+
+
+def read_json_arrow(source, column_types: dict = None) -> pd.DataFrame:
+    """Parses a local json file or buffer with Arrow's json reader
+
+    A list of records is read with read_json_records, and columns in
+    column_types are then cast to those types. A column oriented object is
+    parsed with read_json_text.
+
+    Returns:
+        A pandas dataframe, as pd.read_json would return
+    """
+
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            data = f.read()
+    else:
+        data = source.read()
+    if data.lstrip()[:1] != b"[":
+        return read_json_text(io.BytesIO(data), column_types)
+    table = read_json_records(data)
+    for name, data_type in arrow_column_types(column_types).items():
+        if name in table.column_names:
+            table = table.set_column(
+                table.column_names.index(name), name, table[name].cast(data_type)
+            )
+    return table.to_pandas()
+
+
 def get_json_data_from_ingestion_bucket(
-    path: str, session: boto3.session.Session
+    path: str,
+    session: boto3.session.Session,
+    ranged_download: dict = None,
+    compression: str = None,
+    reader: str = "pandas",
+    column_types: dict = None,
 ) -> dict:
     """Downloads JSON data from S3 ingestion bucket and returns a pandas dataframe
 
     Args:
         key: string representing S3 object to be downloaded
         session: Boto3 session
+        ranged_download: optional keyword arguments for download_s3_object
+            (part_size, max_concurrency, local_path). When given, the object
+            is fetched with parallel ranged requests and parsed locally
+        compression: codec the object is compressed with, see
+            compression_utils.split_extension. It is decompressed while it
+            is parsed
+        reader: "pandas" parses with read_json_text, "pyarrow" with
+            read_json_arrow
+        column_types: optional dictionary of column -> Arrow type name, see
+            csv_utils.read_csv_arrow. The pandas reader only applies the
+            text types
 
     Returns:
         A dictionary containing the following:
@@ -24,22 +157,50 @@ def get_json_data_from_ingestion_bucket(
             message: a relevant error message (if unsuccessful)
     """
 
+    parser = functools.partial(read_json_text, column_types=column_types)
+    if reader == "pyarrow":
+        parser = functools.partial(read_json_arrow, column_types=column_types)
     try:
-        df = wr.s3.read_json(path=path, boto3_session=session)
+        if compression is not None:
+            df = read_compressed_object(
+                path, session, parser, compression, ranged_download
+            )
+        elif ranged_download is not None:
+            df = read_downloaded_object(path, session, parser, **ranged_download)
+        elif reader == "pyarrow" or not is_s3_path(path):
+            df = parser(pa.BufferReader(read_object_bytes(path, session)))
+        else:
+            # a list, so only this object is read and not every key it prefixes
+            df = wr.s3.read_json(
+                path=[path],
+                boto3_session=session,
+                dtype=pandas_text_types(column_types) or True,
+            )
         return {"status": "success", "data": df, "format": ".json"}
     except ClientError as ce:
         return {"status": "failure", "message": ce.response}
     except NoFilesFound as nff:
         return {"status": "failure", "message": nff}
+    except ValueError as ve:
+        return {"status": "failure", "message": str(ve)}
+    except (OSError, EOFError) as e:
+        return {"status": "failure", "message": f"{path} could not be decompressed: {e}"}
 
 
 def write_json_data(
-    data: pd.DataFrame, destination_bucket: str, session: boto3.session.Session
+    data: pd.DataFrame,
+    destination_bucket: str,
+    session: boto3.session.Session,
+    compression: str = None,
+    compression_level: int = None,
 ) -> dict:
-    """Writes a pandas dataframe to json format
+    """Writes a pandas dataframe to json format, as a list of records
 
     Args:
         data: a pandas dataframe
+        compression: optional codec to compress the file with as it is
+            uploaded, see compression_utils.open_compressed
+        compression_level: optional level for the codec
 
     Returns:
         A dictionary containing the following:
@@ -49,7 +210,19 @@ def write_json_data(
 
     if isinstance(data, pd.DataFrame):
         try:
-            wr.s3.to_json(df=data, path=destination_bucket, boto3_session=session, index=False)
+            if compression is not None or not is_s3_path(destination_bucket):
+                with open_compressed_writer(
+                    destination_bucket, session, compression, compression_level
+                ) as writer:
+                    data.to_json(writer, orient="records")
+            else:
+                wr.s3.to_json(
+                    df=data,
+                    path=destination_bucket,
+                    boto3_session=session,
+                    orient="records",
+                    index=False,
+                )
             return {
                 "status": "success",
                 "message": f"json written to {destination_bucket}",
@@ -70,3 +243,185 @@ def write_json_data(
             "status": "failure",
             "message": f"Data is in wrong format {str(type(data))} is not a pandas dataframe",
         }
+
+
+def json_data_to_bytes(data: pd.DataFrame) -> dict:
+    """Encodes a pandas dataframe as json bytes, exactly as write_json_data writes it
+
+    Args:
+        data: a pandas dataframe
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: a BytesIO holding the json file (if successful)
+            message: a relevant error message (if unsuccessful)
+    """
+
+    if isinstance(data, pd.DataFrame):
+        return {
+            "status": "success",
+            "data": io.BytesIO(data.to_json(orient="records").encode("utf-8")),
+            "format": ".json",
+        }
+    return {
+        "status": "failure",
+        "message": f"Data is in wrong format {str(type(data))} is not a pandas dataframe",
+    }
+
+
+def read_json_table_source(source) -> pa.Table:
+    """Parses a local json file or buffer into an Arrow table
+
+    Accepts a list of records, as in data/dummy_json.json and as the json
+    writers write, which is parsed by read_json_records, or a column
+    oriented object such as DataFrame.to_json writes by default, which
+    Arrow cannot read and is parsed with the json module and converted
+    column by column.
+    """
+
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            data = f.read()
+    else:
+        data = source.read()
+    if data.lstrip()[:1] == b"[":
+        return read_json_records(data)
+    document = json.loads(data)
+    if not isinstance(document, dict):
+        raise ValueError("json does not hold a list of records or a column oriented object")
+    return pa.table({name: list(column.values()) for name, column in document.items()})
+
+
+def get_json_table_from_ingestion_bucket(
+    path: str,
+    session: boto3.session.Session,
+    ranged_download: dict = None,
+    compression: str = None,
+) -> dict:
+    """Downloads JSON data from S3 ingestion bucket and returns an Arrow table
+
+    Args:
+        path: string representing S3 object to be downloaded
+        session: Boto3 session
+        ranged_download: optional keyword arguments for download_s3_object,
+            see get_json_data_from_ingestion_bucket
+        compression: codec the object is compressed with, see
+            get_json_data_from_ingestion_bucket
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: a pyarrow table containing downloaded data (if successful)
+            message: a relevant error message (if unsuccessful)
+    """
+
+    try:
+        if compression is not None:
+            table = read_compressed_object(
+                path, session, read_json_table_source, compression, ranged_download
+            )
+        elif ranged_download is not None:
+            table = read_downloaded_object(
+                path, session, read_json_table_source, **ranged_download
+            )
+        else:
+            table = read_json_table_source(pa.BufferReader(read_object_bytes(path, session)))
+        return {"status": "success", "data": table, "format": ".json"}
+    except ClientError as ce:
+        return {"status": "failure", "message": ce.response}
+    except ValueError as ve:
+        return {"status": "failure", "message": str(ve)}
+    except (OSError, EOFError) as e:
+        return {"status": "failure", "message": f"{path} could not be decompressed: {e}"}
+
+
+def write_json_table(
+    data: pa.Table,
+    destination_bucket: str,
+    session: boto3.session.Session,
+    compression: str = None,
+    compression_level: int = None,
+) -> dict:
+    """Writes an Arrow table to json format, as a list of records like write_json_data
+
+    Args:
+        data: a pyarrow table
+        compression: optional codec, see write_json_data
+        compression_level: optional level for the codec
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            message: a relevant success/failure message
+    """
+
+    if isinstance(data, pa.Table):
+        try:
+            with open_compressed_writer(
+                destination_bucket, session, compression, compression_level
+            ) as writer:
+                for chunk in _iter_table_json(data):
+                    writer.write(chunk)
+            return {
+                "status": "success",
+                "message": f"json written to {destination_bucket}",
+            }
+        except ClientError as e:
+            return {
+                "status": "failure",
+                "message": e.response,
+            }
+        except Exception as e:
+            logger.error("Failed to upload to ftp: %s", repr(e))
+            return {
+                "status": "failure",
+                "message": "did not write to s3. Please specify an appropriate destination i.e s3://my-bucket/my-file.csv",
+            }
+    else:
+        return {
+            "status": "failure",
+            "message": f"Data is in wrong format {str(type(data))} is not a pyarrow table",
+        }
+
+
+def json_table_to_bytes(data: pa.Table) -> dict:
+    """Encodes an Arrow table as json bytes, exactly as write_json_table writes it
+
+    Args:
+        data: a pyarrow table
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: a BytesIO holding the json file (if successful)
+            message: a relevant error message (if unsuccessful)
+    """
+
+    if isinstance(data, pa.Table):
+        return {"status": "success", "data": io.BytesIO(_table_to_json(data)), "format": ".json"}
+    return {
+        "status": "failure",
+        "message": f"Data is in wrong format {str(type(data))} is not a pyarrow table",
+    }
+
+
+def _table_to_json(data: pa.Table) -> bytes:
+    return b"".join(_iter_table_json(data))
+
+
+def _iter_table_json(data: pa.Table):
+    # a list of records, as DataFrame.to_json(orient="records") writes,
+    # encoded one record batch at a time so a memory mapped table is never
+    # turned into Python objects all at once
+    encode = json.JSONEncoder(separators=(",", ":"), default=str).encode
+    yield b"["
+    first = True
+    for batch in data.to_batches():
+        records = batch.to_pylist()
+        if not records:
+            continue
+        text = ",".join(encode(record) for record in records)
+        yield f"{'' if first else ','}{text}".encode("utf-8")
+        first = False
+    yield b"]"
@@ -0,0 +1,131 @@
+import hashlib
+import hmac
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from src.transform_lambda.preflight_utils import MASK, HMAC_KEY_ENV, masking_strategies
+from src.transform_lambda.json_splice_utils import is_json_path
+
+
+def get_hmac_key() -> bytes:
+    """Reads the pseudonymization key from the OBFUSCATOR_HMAC_KEY environment variable"""
+
+    key = os.environ.get(HMAC_KEY_ENV)
+    if not key:
+        raise ValueError(f"{HMAC_KEY_ENV} must be set to hash fields")
+    return key.encode("utf-8")
+
+
+def hash_values(values, key: bytes) -> list:
+    """Returns the hex HMAC-SHA256 of the text of each value
+
+    The keyed hash object is built once and copied for every value, which
+    skips re-deriving the padded key each time.
+    """
+
+    keyed = hmac.new(key, digestmod=hashlib.sha256)
+    tokens = []
+    for value in values:
+        digest = keyed.copy()
+        digest.update(str(value).encode("utf-8"))
+        tokens.append(digest.hexdigest())
+    return tokens
+
+
+def pseudonymize_series(series: pd.Series, key: bytes) -> pd.Series:
+    """Replaces each value of a column with its keyed hash
+
+    The column is factorized first, so each distinct value is hashed once
+    and the tokens are spread back over the rows with a single vectorized
+    take. Missing values stay missing.
+
+    Args:
+        series: column to pseudonymize
+        key: HMAC key, see get_hmac_key
+
+    Returns:
+        A column of hex tokens with the same index and name
+    """
+
+    codes, uniques = pd.factorize(series)
+    # the extra None is picked up by the -1 code factorize gives missing values
+    tokens = np.array(hash_values(uniques, key) + [None], dtype=object)
+    return pd.Series(tokens.take(codes), index=series.index, name=series.name)
+
+
+def pseudonymize_array(array, key: bytes):
+    """Arrow version of pseudonymize_series, for an Array or ChunkedArray
+
+    The column is dictionary encoded so only the dictionary is hashed. A
+    ChunkedArray is hashed one chunk at a time and returned as a
+    ChunkedArray, so a memory mapped column is never copied whole.
+    """
+
+    if isinstance(array, pa.ChunkedArray):
+        return pa.chunked_array(
+            [pseudonymize_array(chunk, key) for chunk in array.chunks], pa.string()
+        )
+    encoded = array.dictionary_encode()
+    tokens = pa.array(hash_values(encoded.dictionary.to_pylist(), key), pa.string())
+    return tokens.take(encoded.indices)
+
+
+def constant_column(value: str, num_rows: int) -> pa.DictionaryArray:
+    """Returns a column holding value in every row
+
+    The column is dictionary encoded: value is stored once and each row is
+    a one byte index into it, rather than a copy of the string per row.
+    Parquet writes it as a dictionary encoded column and the csv writer
+    expands it as it goes.
+    """
+
+    indices = pa.array(np.zeros(num_rows, dtype=np.int8))
+    return pa.DictionaryArray.from_arrays(indices, pa.array([value], pa.string()))
+
+
+def constant_column_like(value: str, column: pa.ChunkedArray) -> pa.ChunkedArray:
+    """Returns constant_column(value) chunked the same way as column
+
+    Every chunk is a zero-copy slice of one constant_column as long as the
+    largest chunk, so masking a table of many batches, such as a memory
+    mapped one, costs one byte per row of its largest batch.
+    """
+
+    lengths = [len(chunk) for chunk in column.chunks]
+    constant = constant_column(value, max(lengths, default=0))
+    return pa.chunked_array([constant.slice(0, length) for length in lengths], constant.type)
+
+
+def censor_table(table: pa.Table, pii_fields: list, masking: dict = None) -> pa.Table:
+    """Arrow version of censor_sensitive_data
+
+    Masked columns become constant_column_like(MASK) and hashed columns are
+    pseudonymized with pseudonymize_array, both chunk by chunk. Every other
+    column is left as it is, without being copied. Nested json paths such as
+    customer.contact.email are not supported here, as json objects are read
+    into struct columns; they raise a ValueError rather than being skipped.
+
+    Args:
+        table: Arrow table containing sensitive information
+        pii_fields: list containing personally identifiable information fields
+        masking: optional dictionary of field -> "mask" or "hash"
+
+    Returns:
+        The censored table
+    """
+
+    strategies = masking_strategies(pii_fields, masking)
+    key = get_hmac_key() if "hash" in strategies.values() else None
+    for field, strategy in strategies.items():
+        if field not in table.column_names and is_json_path(field):
+            raise ValueError(f"{field} is a nested path, which cannot be censored with use_arrow")
+        if field not in table.column_names:
+            print(f"{field} not in data set")
+            continue
+        if strategy == "hash":
+            column = pseudonymize_array(table[field], key)
+        else:
+            column = constant_column_like(MASK, table[field])
+        table = table.set_column(table.schema.get_field_index(field), field, column)
+    return table
@@ -0,0 +1,153 @@
+import contextlib
+import json
+import resource
+import time
+
+METRICS_NAMESPACE = "GdprObfuscator"
+# record key -> (CloudWatch metric name, unit)
+METRIC_DEFINITIONS = {
+    "wall_seconds": ("WallTime", "Seconds"),
+    "bytes_in": ("BytesIn", "Bytes"),
+    "bytes_out": ("BytesOut", "Bytes"),
+    "rows": ("Rows", "Count"),
+    "peak_rss_bytes": ("PeakRss", "Bytes"),
+    "process_peak_rss_bytes": ("ProcessPeakRss", "Bytes"),
+}
+
+
+class StageMetrics:
+    """Records wall time, bytes, row counts and peak RSS for each pipeline stage
+
+    On Linux the peak RSS is the stage's own: the kernel's high-water mark
+    is reset through /proc/self/clear_refs when the stage starts and read
+    from VmHWM when it ends. The reset is process wide, so when files of a
+    batch run concurrently a stage's peak covers the process since the
+    latest stage started on any thread. Where the mark cannot be reset, the
+    peak of the whole process so far is recorded instead, as
+    process_peak_rss_bytes.
+
+    Each stage is wrapped in stage(), which yields a dictionary the caller
+    can add bytes_in, bytes_out and rows to. emit() prints one CloudWatch
+    Embedded Metric Format line per stage, which CloudWatch turns into
+    metrics when the line is logged from Lambda.
+
+    A disabled instance records nothing: stage() hands back a throwaway
+    dictionary without reading any clocks, so instrumented code costs no
+    more than an attribute check when metrics are turned off.
+
+    A profiler (see profiling_utils.StageProfiler) is run around every
+    stage, whether or not metrics are enabled.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        dimensions: dict = None,
+        namespace: str = METRICS_NAMESPACE,
+        profiler=None,
+    ):
+        self.enabled = enabled
+        self.dimensions = dimensions or {}
+        self.namespace = namespace
+        self.profiler = profiler
+        self.stages = {}
+
+    def stage(self, name: str):
+        if self.profiler is not None:
+            return self._profiled_stage(name)
+        if not self.enabled:
+            return contextlib.nullcontext({})
+        return self._stage(name)
+
+    @contextlib.contextmanager
+    def _profiled_stage(self, name: str):
+        # the profiler is inside the timed stage, so its own cost shows up
+        # in the stage's wall time rather than hiding between stages
+        with (self._stage(name) if self.enabled else contextlib.nullcontext({})) as record:
+            with self.profiler.stage(name):
+                yield record
+
+    @contextlib.contextmanager
+    def _stage(self, name: str):
+        record = {}
+        self.stages[name] = record
+        reset = _reset_peak_rss()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["wall_seconds"] = time.perf_counter() - start
+            peak = _peak_rss() if reset else None
+            if peak is not None:
+                record["peak_rss_bytes"] = peak
+            else:
+                # ru_maxrss is in kilobytes on Linux and is the peak of the process so far
+                record["process_peak_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def to_dict(self) -> dict:
+        return {name: dict(record) for name, record in self.stages.items()}
+
+    def emf_records(self) -> list:
+        """Returns one Embedded Metric Format dictionary per recorded stage"""
+
+        records = []
+        timestamp = int(time.time() * 1000)
+        for name, record in self.stages.items():
+            dimensions = {"Stage": name, **self.dimensions}
+            metrics = [
+                {"Name": METRIC_DEFINITIONS[key][0], "Unit": METRIC_DEFINITIONS[key][1]}
+                for key in record
+                if key in METRIC_DEFINITIONS
+            ]
+            values = {
+                METRIC_DEFINITIONS[key][0]: value
+                for key, value in record.items()
+                if key in METRIC_DEFINITIONS
+            }
+            records.append(
+                {
+                    "_aws": {
+                        "Timestamp": timestamp,
+                        "CloudWatchMetrics": [
+                            {
+                                "Namespace": self.namespace,
+                                "Dimensions": [list(dimensions)],
+                                "Metrics": metrics,
+                            }
+                        ],
+                    },
+                    **dimensions,
+                    **values,
+                }
+            )
+        return records
+
+    def emit(self):
+        """Prints the recorded stages as Embedded Metric Format log lines"""
+
+        for record in self.emf_records():
+            print(json.dumps(record))
+
+
+def _reset_peak_rss() -> bool:
+    """Resets the kernel's RSS high-water mark of the process, returning whether it could"""
+
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss() -> int:
+    """Returns the RSS high-water mark of the process in bytes, or None if unavailable"""
+
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
@@ -1,21 +1,68 @@
 import boto3
+import io
 from botocore.exceptions import ClientError
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import awswrangler as wr
 from awswrangler.exceptions import NoFilesFound
+from src.transform_lambda.s3_utils import read_downloaded_object, DEFAULT_PART_SIZE
+from src.transform_lambda.storage_utils import (
+    is_s3_path,
+    read_object_bytes,
+    open_object_reader,
+    open_object_writer,
+)
+from src.transform_lambda.masking_utils import (
+    masking_strategies,
+    get_hmac_key,
+    pseudonymize_array,
+)
 import logging
 
 logger = logging.getLogger("ftpuploader")
 
+# codecs parquet files can be written with; "none" writes them uncompressed
+PARQUET_CODECS = ["snappy", "gzip", "zstd", "none"]
+DEFAULT_PARQUET_CODEC = "snappy"
+
+# the nullable pandas dtypes awswrangler uses when it reads parquet
+PANDAS_EXTENSION_TYPES = {
+    pa.int8(): pd.Int8Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+    pa.uint8(): pd.UInt8Dtype(),
+    pa.uint16(): pd.UInt16Dtype(),
+    pa.uint32(): pd.UInt32Dtype(),
+    pa.uint64(): pd.UInt64Dtype(),
+    pa.bool_(): pd.BooleanDtype(),
+    pa.string(): pd.StringDtype(),
+    pa.large_string(): pd.StringDtype(),
+}
+
+
+def read_parquet_source(source) -> pd.DataFrame:
+    """Parses a local parquet file or buffer the same way awswrangler does"""
+
+    return pq.read_table(source).to_pandas(
+        split_blocks=True,
+        self_destruct=True,
+        types_mapper=PANDAS_EXTENSION_TYPES.get,
+    )
+
 
 def get_parquet_data_from_ingestion_bucket(
-    path: str, session: boto3.session.Session
+    path: str, session: boto3.session.Session, ranged_download: dict = None
 ) -> dict:
     """Downloads parquet data from S3 ingestion bucket and returns a pandas dataframe
 
     Args:
         key: string representing S3 object to be downloaded
         session: Boto3 session
+        ranged_download: optional keyword arguments for download_s3_object
+            (part_size, max_concurrency, local_path). When given, the object
+            is fetched with parallel ranged requests and parsed locally
 
     Returns:
         A dictionary containing the following:
@@ -25,7 +72,15 @@ def get_parquet_data_from_ingestion_bucket(
     """
 
     try:
-        df = wr.s3.read_parquet(path=path, boto3_session=session)
+        if ranged_download is not None:
+            df = read_downloaded_object(
+                path, session, read_parquet_source, **ranged_download
+            )
+        elif not is_s3_path(path):
+            df = read_parquet_source(pa.BufferReader(read_object_bytes(path, session)))
+        else:
+            # a list, so only this object is read and not every key it prefixes
+            df = wr.s3.read_parquet(path=[path], boto3_session=session)
         return {"status": "success", "data": df, "format": ".parquet"}
     except ClientError as ce:
         return {"status": "failure", "message": ce.response}
@@ -34,12 +89,19 @@ def get_parquet_data_from_ingestion_bucket(
 
 
 def write_parquet_data(
-    data: pd.DataFrame, destination_bucket: str, session: boto3.session.Session
+    data: pd.DataFrame,
+    destination_bucket: str,
+    session: boto3.session.Session,
+    compression: str = DEFAULT_PARQUET_CODEC,
+    compression_level: int = None,
 ) -> dict:
     """Writes a pandas dataframe to parquet format
 
     Args:
         data: a pandas dataframe
+        compression: codec the column chunks are compressed with, one of
+            PARQUET_CODECS
+        compression_level: optional level for gzip and zstd
 
     Returns:
         A dictionary containing the following:
@@ -47,9 +109,21 @@ def write_parquet_data(
             message: a relevant success/failure message
     """
 
+    if compression not in PARQUET_CODECS:
+        return _unknown_codec(compression)
     if isinstance(data, pd.DataFrame):
         try:
-            wr.s3.to_parquet(df=data, path=destination_bucket, boto3_session=session)
+            if not is_s3_path(destination_bucket):
+                with open_object_writer(destination_bucket, session) as writer:
+                    _write_dataframe(data, writer, compression, compression_level)
+            else:
+                wr.s3.to_parquet(
+                    df=data,
+                    path=destination_bucket,
+                    boto3_session=session,
+                    compression=None if compression == "none" else compression,
+                    pyarrow_additional_kwargs=_level_option(compression_level),
+                )
             return {
                 "status": "success",
                 "message": f"parquet written to {destination_bucket}",
@@ -70,3 +144,332 @@ def write_parquet_data(
             "status": "failure",
             "message": f"Data is in wrong format {str(type(data))} is not a pandas dataframe",
         }
+
+
+def parquet_data_to_bytes(
+    data: pd.DataFrame,
+    compression: str = DEFAULT_PARQUET_CODEC,
+    compression_level: int = None,
+) -> dict:
+    """Encodes a pandas dataframe as parquet bytes, as write_parquet_data writes it
+
+    Column names are sanitized the same way awswrangler sanitizes them.
+
+    Args:
+        data: a pandas dataframe
+        compression: codec, see write_parquet_data
+        compression_level: optional level for gzip and zstd
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: a BytesIO holding the parquet file (if successful)
+            message: a relevant error message (if unsuccessful)
+    """
+
+    if compression not in PARQUET_CODECS:
+        return _unknown_codec(compression)
+    if isinstance(data, pd.DataFrame):
+        buffer = io.BytesIO()
+        _write_dataframe(data, buffer, compression, compression_level)
+        buffer.seek(0)
+        return {"status": "success", "data": buffer, "format": ".parquet"}
+    return {
+        "status": "failure",
+        "message": f"Data is in wrong format {str(type(data))} is not a pandas dataframe",
+    }
+
+
+def get_parquet_table_from_ingestion_bucket(
+    path: str, session: boto3.session.Session, ranged_download: dict = None
+) -> dict:
+    """Downloads parquet data from S3 ingestion bucket and returns an Arrow table
+
+    Args:
+        path: string representing S3 object to be downloaded
+        session: Boto3 session
+        ranged_download: optional keyword arguments for download_s3_object,
+            see get_parquet_data_from_ingestion_bucket
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: a pyarrow table containing downloaded data (if successful)
+            message: a relevant error message (if unsuccessful)
+    """
+
+    try:
+        if ranged_download is not None:
+            table = read_downloaded_object(path, session, pq.read_table, **ranged_download)
+        else:
+            table = pq.read_table(pa.BufferReader(read_object_bytes(path, session)))
+        return {"status": "success", "data": table, "format": ".parquet"}
+    except ClientError as ce:
+        return {"status": "failure", "message": ce.response}
+    except ValueError as ve:
+        return {"status": "failure", "message": str(ve)}
+
+
+def write_parquet_table(
+    data: pa.Table,
+    destination_bucket: str,
+    session: boto3.session.Session,
+    compression: str = DEFAULT_PARQUET_CODEC,
+    compression_level: int = None,
+) -> dict:
+    """Writes an Arrow table to parquet format in destination bucket
+
+    See parquet_table_to_bytes for how the table is encoded.
+
+    Args:
+        data: a pyarrow table
+        compression: codec, see write_parquet_data
+        compression_level: optional level for gzip and zstd
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            message: a relevant success/failure message
+    """
+
+    if compression not in PARQUET_CODECS:
+        return _unknown_codec(compression)
+    if isinstance(data, pa.Table):
+        try:
+            with open_object_writer(destination_bucket, session) as writer:
+                _write_table(data, writer, compression, compression_level)
+            return {
+                "status": "success",
+                "message": f"parquet written to {destination_bucket}",
+            }
+        except ClientError as e:
+            return {
+                "status": "failure",
+                "message": e.response,
+            }
+        except Exception as e:
+            logger.error("Failed to upload to ftp: %s", repr(e))
+            return {
+                "status": "failure",
+                "message": "did not write to s3. Please specify an appropriate destination i.e s3://my-bucket/my-file.csv",
+            }
+    else:
+        return {
+            "status": "failure",
+            "message": f"Data is in wrong format {str(type(data))} is not a pyarrow table",
+        }
+
+
+def parquet_table_to_bytes(
+    data: pa.Table,
+    compression: str = DEFAULT_PARQUET_CODEC,
+    compression_level: int = None,
+) -> dict:
+    """Encodes an Arrow table as parquet bytes, exactly as write_parquet_table writes it
+
+    Column names are sanitized the same way awswrangler sanitizes them, and
+    the Arrow schema is not stored in the file, so dictionary encoded
+    columns such as masked fields are read back as plain strings rather
+    than as categoricals.
+
+    Args:
+        data: a pyarrow table
+        compression: codec, see write_parquet_data
+        compression_level: optional level for gzip and zstd
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: a BytesIO holding the parquet file (if successful)
+            message: a relevant error message (if unsuccessful)
+    """
+
+    if compression not in PARQUET_CODECS:
+        return _unknown_codec(compression)
+    if isinstance(data, pa.Table):
+        buffer = io.BytesIO()
+        _write_table(data, buffer, compression, compression_level)
+        buffer.seek(0)
+        return {"status": "success", "data": buffer, "format": ".parquet"}
+    return {
+        "status": "failure",
+        "message": f"Data is in wrong format {str(type(data))} is not a pyarrow table",
+    }
+
+
+def _write_dataframe(
+    data: pd.DataFrame, sink, compression: str = DEFAULT_PARQUET_CODEC, compression_level: int = None
+):
+    wr.catalog.sanitize_dataframe_columns_names(df=data).to_parquet(
+        sink,
+        index=False,
+        compression=None if compression == "none" else compression,
+        **_level_option(compression_level),
+    )
+
+
+def _write_table(
+    data: pa.Table, sink, compression: str = DEFAULT_PARQUET_CODEC, compression_level: int = None
+):
+    data = data.rename_columns(
+        [wr.catalog.sanitize_column_name(name) for name in data.column_names]
+    )
+    pq.write_table(
+        data,
+        sink,
+        compression=compression,
+        compression_level=compression_level,
+        store_schema=False,
+    )
+
+
+def _level_option(compression_level: int) -> dict:
+    # snappy takes no level, so one is only passed on when it is set
+    return {} if compression_level is None else {"compression_level": compression_level}
+
+
+def _unknown_codec(compression: str) -> dict:
+    return {
+        "status": "failure",
+        "message": f"Unknown parquet compression {compression}. Can only use {PARQUET_CODECS}",
+    }
+
+
+class ChunkBuffer(io.RawIOBase):
+    """Write-only file object whose contents are handed out and discarded by drain()"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def write(self, data) -> int:
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer = bytearray()
+        return data
+
+
+def iter_censored_parquet_chunks(
+    path: str,
+    pii_fields: list,
+    session: boto3.session.Session,
+    masking: dict = None,
+    compression: str = DEFAULT_PARQUET_CODEC,
+    compression_level: int = None,
+):
+    """Censors a parquet file one row group at a time, yielding the output in chunks
+
+    The source is read with ranged requests, and for each row group only the
+    non-PII columns are fetched and decoded (into Arrow, never pandas). Masked
+    columns are not read at all: their replacement is built from the row
+    count in the file metadata. Hashed columns are read and dictionary
+    encoded so each distinct value is hashed once. Peak memory is therefore
+    one row group of non-masked columns.
+
+    Args:
+        path: string representing S3 object to be censored
+        pii_fields: list containing personally identifiable information fields
+        session: Boto3 session
+        masking: optional dictionary of field -> "mask" or "hash"
+        compression: codec the output is written with, see write_parquet_data
+        compression_level: optional level for gzip and zstd
+
+    Yields:
+        The censored parquet file as consecutive byte strings, one per row group
+        plus the footer
+    """
+
+    strategies = masking_strategies(pii_fields, masking)
+    key = get_hmac_key() if "hash" in strategies.values() else None
+    parquet_file = pq.ParquetFile(open_object_reader(path, session))
+    schema = parquet_file.schema_arrow
+    for field in pii_fields:
+        if field not in schema.names:
+            print(f"{field} not in data set")
+    censored = {field for field in pii_fields if field in schema.names}
+    masked = {field for field in censored if strategies[field] == "mask"}
+    read = [name for name in schema.names if name not in masked]
+    for field in censored:
+        index = schema.get_field_index(field)
+        schema = schema.set(index, pa.field(field, pa.string()))
+
+    output = ChunkBuffer()
+    with pq.ParquetWriter(
+        output, schema, compression=compression, compression_level=compression_level
+    ) as writer:
+        for i in range(parquet_file.num_row_groups):
+            table = parquet_file.read_row_group(i, columns=read)
+            num_rows = parquet_file.metadata.row_group(i).num_rows
+            columns = [
+                pa.repeat("***", num_rows)
+                if name in masked
+                else pseudonymize_array(table[name], key)
+                if name in censored
+                else table[name]
+                for name in schema.names
+            ]
+            writer.write_table(
+                pa.Table.from_arrays(columns, schema=schema),
+                row_group_size=max(num_rows, 1),
+            )
+            yield output.drain()
+    yield output.drain()
+
+
+def stream_parquet_data(
+    path: str,
+    destination_bucket: str,
+    pii_fields: list,
+    session: boto3.session.Session,
+    part_size: int = DEFAULT_PART_SIZE,
+    masking: dict = None,
+    compression: str = DEFAULT_PARQUET_CODEC,
+    compression_level: int = None,
+) -> dict:
+    """Censors a parquet file one row group at a time, streaming the result to S3
+
+    See iter_censored_parquet_chunks. Peak memory is one row group of non-PII
+    columns plus one multipart upload part.
+
+    Args:
+        path: string representing S3 object to be censored
+        destination_bucket: S3 path the censored parquet is written to
+        pii_fields: list containing personally identifiable information fields
+        session: Boto3 session
+        part_size: size in bytes of each multipart upload part
+        masking: optional dictionary of field -> "mask" or "hash"
+        compression: codec the output is written with, see write_parquet_data
+        compression_level: optional level for gzip and zstd
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            message: a relevant success/failure message
+    """
+
+    if compression not in PARQUET_CODECS:
+        return _unknown_codec(compression)
+    try:
+        with open_object_writer(destination_bucket, session, part_size) as writer:
+            for chunk in iter_censored_parquet_chunks(
+                path, pii_fields, session, masking, compression, compression_level
+            ):
+                writer.write(chunk)
+        return {
+            "status": "success",
+            "message": f"parquet streamed to {destination_bucket}",
+        }
+    except ClientError as ce:
+        return {"status": "failure", "message": ce.response}
+    except ValueError as ve:
+        return {"status": "failure", "message": str(ve)}
@@ -0,0 +1,165 @@
+import asyncio
+import boto3
+import io
+from botocore.exceptions import ClientError
+from src.transform_lambda.s3_utils import DEFAULT_PART_SIZE
+from src.transform_lambda.storage_utils import open_object_stream, open_object_writer
+from src.transform_lambda.compression_utils import open_decompressed, open_compressed
+
+DEFAULT_PIPELINE_CHUNK_SIZE = 8 * 1024 * 1024
+# chunks waiting between two stages; with one chunk in each stage and one
+# part in the writer this bounds the memory held by a pipeline
+DEFAULT_QUEUE_SIZE = 2
+
+
+async def run_stages(read, transform, finish, write, queue_size: int = DEFAULT_QUEUE_SIZE):
+    """Runs read, transform and write as three stages overlapping on chunks
+
+    Each stage is a task that hands its blocking calls to a worker thread,
+    so while one chunk is transformed the next is being read and the one
+    before is being written. boto3 and socket reads release the GIL, so the
+    transfers really do run alongside the transform. The stages are joined
+    by queues of queue_size chunks, so a slow stage holds the others back
+    rather than letting chunks pile up in memory. If a stage fails the
+    others are cancelled and the exception is raised.
+
+    Args:
+        read: function returning the next chunk, or b"" at the end
+        transform: function taking a chunk and returning the output for it
+        finish: function returning the last of the output after every chunk
+        write: function taking a chunk of output
+        queue_size: number of chunks each queue holds
+    """
+
+    read_chunks = asyncio.Queue(queue_size)
+    output_chunks = asyncio.Queue(queue_size)
+
+    async def read_stage():
+        while True:
+            chunk = await asyncio.to_thread(read)
+            await read_chunks.put(chunk)
+            if not chunk:
+                return
+
+    async def transform_stage():
+        while True:
+            chunk = await read_chunks.get()
+            if not chunk:
+                await output_chunks.put(await asyncio.to_thread(finish))
+                await output_chunks.put(None)
+                return
+            await output_chunks.put(await asyncio.to_thread(transform, chunk))
+
+    async def write_stage():
+        while True:
+            chunk = await output_chunks.get()
+            if chunk is None:
+                return
+            if chunk:
+                await asyncio.to_thread(write, chunk)
+
+    tasks = [
+        asyncio.create_task(read_stage()),
+        asyncio.create_task(transform_stage()),
+        asyncio.create_task(write_stage()),
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def pipeline_splice_data(
+    path: str,
+    destination_bucket: str,
+    splicer,
+    session: boto3.session.Session,
+    chunk_size: int = DEFAULT_PIPELINE_CHUNK_SIZE,
+    part_size: int = DEFAULT_PART_SIZE,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    compression: str = None,
+    output_compression: str = None,
+    compression_level: int = None,
+) -> dict:
+    """Censors a file with a splicer, overlapping download, censoring and upload
+
+    Does what splice_csv_data and splice_json_data do, but with run_stages:
+    the next chunk downloads (and decompresses) and the last one uploads
+    (and is compressed) while the current one is spliced, so a large file
+    takes about as long as its slowest stage instead of the sum of the
+    three. Output parts are sent with an S3MultipartWriter (or the writer
+    of the destination's storage, see storage_utils).
+
+    Args:
+        path: string representing S3 object to be censored
+        destination_bucket: S3 path the censored file is written to
+        splicer: a CsvSplicer or JsonSplicer for the PII fields
+        session: Boto3 session
+        chunk_size: number of bytes read from S3 (or decompressed) at a time
+        part_size: size in bytes of each multipart upload part
+        queue_size: chunks held between stages, see run_stages
+        compression: codec the source is compressed with, if any
+        output_compression: codec to compress the output with, if any
+        compression_level: optional level for output_compression
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            message: a relevant success/failure message
+    """
+
+    try:
+        body = open_object_stream(path, session)
+        with body, open_object_writer(destination_bucket, session, part_size) as writer:
+            source = body if compression is None else open_decompressed(body, compression)
+            transform, finish = splicer.feed, splicer.finish
+            if output_compression is not None:
+                transform, finish = _compressing(
+                    transform, finish, output_compression, compression_level
+                )
+            with source:
+                asyncio.run(
+                    run_stages(
+                        lambda: source.read(chunk_size),
+                        transform,
+                        finish,
+                        writer.write,
+                        queue_size,
+                    )
+                )
+        for field in splicer.missing_fields:
+            print(f"{field} not in data set")
+        return {
+            "status": "success",
+            "message": f"file pipelined to {destination_bucket}",
+        }
+    except ClientError as ce:
+        return {"status": "failure", "message": ce.response}
+    except ValueError as ve:
+        return {"status": "failure", "message": str(ve)}
+    except (OSError, EOFError) as e:
+        return {"status": "failure", "message": f"{path} could not be decompressed: {e}"}
+
+
+def _compressing(transform, finish, codec: str, level: int = None) -> tuple:
+    # compresses inside the transform stage, leaving the write stage free to upload
+    buffer = io.BytesIO()
+    stream = open_compressed(buffer, codec, level)
+
+    def drain() -> bytes:
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    def compressed_transform(chunk: bytes) -> bytes:
+        stream.write(transform(chunk))
+        return drain()
+
+    def compressed_finish() -> bytes:
+        stream.write(finish())
+        stream.close()
+        return drain()
+
+    return compressed_transform, compressed_finish
@@ -0,0 +1,202 @@
+import boto3
+import os
+import resource
+import shutil
+from botocore.exceptions import ClientError
+from src.transform_lambda.storage_utils import get_file_size
+from src.transform_lambda.compression_utils import split_extension
+from src.transform_lambda.json_splice_utils import JSON_LINES_EXTENSIONS
+
+MIB = 1024 * 1024
+# memory used while a whole file is processed / its size uncompressed: the
+# parsed data, the censored copy and the encoded output. pandas holds text
+# as Python objects, which costs far more than Arrow's buffers
+PANDAS_EXPANSION = {".csv": 6.0, ".json": 8.0, ".parquet": 10.0}
+ARROW_EXPANSION = {".csv": 2.5, ".json": 3.0, ".parquet": 4.0}
+# usual uncompressed / compressed size of csv and json
+COMPRESSION_RATIOS = {"gzip": 5.0, "bz2": 6.0, "zstd": 5.0}
+# streamed csv and json hold a chunk of rows or bytes and one upload part
+TEXT_STREAMING_MEMORY = 64 * MIB
+# share of the available memory a plan may use, leaving room for the runtime
+MEMORY_HEADROOM = 0.75
+SPILL_DIRECTORY = "/tmp"
+# a spilled file is decoded to Arrow on disk and processed one batch at a time
+SPILL_FORMATS = [".csv", ".json", ".parquet"]
+SPILL_MEMORY = 64 * MIB
+# column types that read csv as the text streaming reads it
+TEXT_COLUMN_TYPES = ["string", "str", "utf8"]
+
+
+def available_memory() -> int:
+    """Returns the number of bytes of memory this process can still use
+
+    On Lambda that is the function's memory size less what the process
+    already holds; elsewhere it is the memory the kernel reports as
+    available.
+    """
+
+    limit = os.environ.get("AWS_LAMBDA_FUNCTION_MEMORY_SIZE")
+    if limit:
+        return max(int(limit) * MIB - _resident_memory(), 0)
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def available_disk(path: str = SPILL_DIRECTORY) -> int:
+    """Returns the free space in bytes of the file system holding path"""
+
+    return shutil.disk_usage(path).free
+
+
+def output_modes(file_extension: str, job: dict = None) -> list:
+    """Returns the modes that write exactly the bytes processing a job in memory writes
+
+    The pandas path reads csv as text and writes it with DataFrame.to_csv,
+    as the pandas streaming engine does chunk by chunk, unless column_types
+    gives a column another type. Jobs with use_arrow read and write through
+    the same Arrow readers and writers as a spilled file. Every other pair
+    writes the same data differently: the splice engines copy the source's
+    own text and layout, and pandas and Arrow encode values, quote csv and
+    lay out parquet differently. Newline delimited json can only be
+    streamed.
+    """
+
+    job = job or {}
+    if file_extension in JSON_LINES_EXTENSIONS:
+        return ["streaming"]
+    if job.get("use_arrow", False):
+        return ["in_memory", "spill"] if file_extension in SPILL_FORMATS else ["in_memory"]
+    if (
+        file_extension == ".csv"
+        and job.get("engine", "pandas") != "splice"
+        and all(name in TEXT_COLUMN_TYPES for name in (job.get("column_types") or {}).values())
+    ):
+        return ["in_memory", "streaming"]
+    return ["in_memory"]
+
+
+def plan_execution(bucket_path: str, session: boto3.session.Session, job: dict = None) -> dict:
+    """Chooses how a file is processed from its size and the memory available
+
+    Only the modes in output_modes are considered, so the bytes written for
+    a file never depend on its size or on the Lambda's memory. The object is
+    HEADed and the memory needed to process it whole is estimated from its
+    size, format and compression (see PANDAS_EXPANSION and
+    ARROW_EXPANSION). A file that fits in MEMORY_HEADROOM of
+    available_memory is processed in memory. Otherwise csv is streamed,
+    which only ever holds a chunk of it, and with use_arrow a file whose
+    decoded Arrow form (estimated with ARROW_EXPANSION) fits in the free
+    space of /tmp is spilled there, see utils.spill_sensitive_data. Newline
+    delimited json is always streamed, unless it is hashed. A file that
+    fits no mode writing the same output fails, naming the modes the job
+    would have to set itself.
+
+    Args:
+        bucket_path: path containing file
+        session: boto3 session
+        job: optional job dictionary, see handler.process_file, whose
+            engine, masking, use_arrow and column_types settings are taken
+            into account
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: the plan (if successful): mode ("in_memory",
+                "streaming" or "spill"), reason, the modes it was chosen
+                from, format, compression, size and the estimated_memory,
+                streaming_memory, spill_disk, available_memory and
+                available_disk it was based on, in bytes
+            message: a relevant error message (if unsuccessful)
+    """
+
+    job = job or {}
+    file_extension, compression = split_extension(bucket_path)
+    modes = output_modes(file_extension, job)
+    try:
+        size = get_file_size(bucket_path, session)
+        decoded_size = size * COMPRESSION_RATIOS.get(compression, 1.0)
+        expansion = ARROW_EXPANSION if job.get("use_arrow", False) else PANDAS_EXPANSION
+        estimated_memory = int(decoded_size * expansion.get(file_extension, 1.0))
+        if job.get("ranged_download"):
+            # the downloaded bytes are held alongside what is parsed from them
+            estimated_memory += size
+        budget = int(available_memory() * MEMORY_HEADROOM)
+        streaming_memory = None
+        if "streaming" in modes and (estimated_memory > budget or "in_memory" not in modes):
+            streaming_memory = _streaming_memory(file_extension, job)
+    except ClientError as ce:
+        return {"status": "failure", "message": ce.response}
+    except ValueError as ve:
+        return {"status": "failure", "message": str(ve)}
+    except FileNotFoundError as fnf:
+        return {"status": "failure", "message": str(fnf)}
+
+    spill_disk = int(decoded_size * ARROW_EXPANSION.get(file_extension, 1.0))
+    plan = {
+        "modes": modes,
+        "format": file_extension,
+        "compression": compression,
+        "size": size,
+        "estimated_memory": estimated_memory,
+        "streaming_memory": streaming_memory,
+        "spill_disk": spill_disk,
+        "available_memory": budget,
+        "available_disk": available_disk(),
+    }
+    if file_extension in JSON_LINES_EXTENSIONS and streaming_memory is not None:
+        return _chosen(plan, "streaming", "newline delimited json is always streamed")
+    if file_extension not in JSON_LINES_EXTENSIONS and estimated_memory <= budget:
+        return _chosen(plan, "in_memory", "the file fits in memory")
+    if streaming_memory is not None and streaming_memory <= budget:
+        return _chosen(plan, "streaming", "the file is too large for memory, streaming bounds it")
+    if "spill" in modes and SPILL_MEMORY <= budget and spill_disk <= plan["available_disk"]:
+        return _chosen(plan, "spill", "the file is too large for memory or streaming, it fits on disk")
+    message = (
+        f"{bucket_path} needs about {_mib(estimated_memory)} MB of memory"
+        + ("" if streaming_memory is None else f" ({_mib(streaming_memory)} MB streamed)")
+        + f", only {_mib(budget)} MB is available"
+    )
+    if "spill" in modes:
+        message += f" and {_mib(spill_disk)} MB of disk to spill to, {_mib(plan['available_disk'])} MB is free"
+    others = [
+        mode
+        for mode in ["streaming", "spill"]
+        if mode not in modes and (mode == "streaming" or file_extension in SPILL_FORMATS)
+    ]
+    if others:
+        message += (
+            f". {' or '.join(others).capitalize()} would write a different file,"
+            f" set {' or '.join(others)} in the job to allow it"
+        )
+    return {"status": "failure", "message": message, "plan": plan}
+
+
+def _streaming_memory(file_extension: str, job: dict):
+    # None when the job cannot be streamed: json is spliced, which only masks
+    hashing = any(strategy != "mask" for strategy in (job.get("masking") or {}).values())
+    if file_extension in JSON_LINES_EXTENSIONS and hashing:
+        return None
+    return TEXT_STREAMING_MEMORY
+
+
+def _chosen(plan: dict, mode: str, reason: str) -> dict:
+    return {"status": "success", "data": {"mode": mode, "reason": reason, **plan}}
+
+
+def _resident_memory() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _mib(size: int) -> int:
+    return -(-size // MIB)
@@ -0,0 +1,395 @@
+import boto3
+import heapq
+import importlib
+import json
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from src.transform_lambda.s3_utils import get_s3_client, connection_pool
+from src.transform_lambda.compression_utils import COMPRESSION_EXTENSIONS
+from src.transform_lambda.json_splice_utils import JSON_LINES_EXTENSIONS
+
+# compressed csv and json keep their compression in the destination
+TEXT_EXTENSIONS = (".csv", ".json") + JSON_LINES_EXTENSIONS
+SUPPORTED_EXTENSIONS = TEXT_EXTENSIONS + (".parquet",) + tuple(
+    extension + suffix for extension in TEXT_EXTENSIONS for suffix in COMPRESSION_EXTENSIONS
+)
+# readers such as Athena, Glue and Spark skip paths starting with an underscore
+CHECKPOINT_PREFIX = "_checkpoint/"
+DEFAULT_MAX_WORKERS = 8
+SHARDS_PER_WORKER = 4
+DEFAULT_SHARD_SIZE = 100
+DEFAULT_CHECKPOINT_EVERY = 50
+# process_file is looked up when a shard runs, as the handler imports this module
+HANDLER_MODULE = "src.transform_lambda.handler"
+
+
+def list_objects(prefix_path: str, session: boto3.session.Session) -> list:
+    """Lists the csv, json and parquet objects under an S3 prefix
+
+    csv and json objects compressed with gzip, bz2 or zstd are included.
+
+    Args:
+        prefix_path: S3 prefix of the form s3://<bucket>/<prefix>. It is
+            taken as a folder, so s3://<bucket>/data does not list data2/
+        session: Boto3 session
+
+    Returns:
+        A list of dictionaries holding each object's path, etag and size, in
+        key order. Anything under a checkpoint prefix is left out
+    """
+
+    bucket, prefix = _split_folder(prefix_path)
+    paginator = get_s3_client(session).get_paginator("list_objects_v2")
+    objects = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get("Contents", []):
+            key = item["Key"]
+            if key.endswith(SUPPORTED_EXTENSIONS) and CHECKPOINT_PREFIX not in key:
+                objects.append(
+                    {"path": f"s3://{bucket}/{key}", "etag": item["ETag"], "size": item["Size"]}
+                )
+    return objects
+
+
+def load_checkpoint(checkpoint_path: str, session: boto3.session.Session) -> dict:
+    """Reads every manifest under a checkpoint prefix
+
+    Returns:
+        A dictionary of source path -> etag for every file obfuscated by an
+        earlier run
+    """
+
+    bucket, prefix = _split_prefix(checkpoint_path)
+    client = get_s3_client(session)
+    done = {}
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get("Contents", []):
+            body = client.get_object(Bucket=bucket, Key=item["Key"])["Body"].read()
+            for line in body.decode("utf-8").splitlines():
+                entry = json.loads(line)
+                done[entry["file_to_obfuscate"]] = entry["etag"]
+    return done
+
+
+def plan_shards(objects: list, num_shards: int) -> list:
+    """Splits objects (or jobs) into at most num_shards shards of similar total size
+
+    Objects are handed out largest first, each to the shard with the fewest
+    bytes so far, so no worker is left with a long tail of big files.
+
+    Returns:
+        A list of non-empty lists of objects
+    """
+
+    shards = [[] for _ in range(max(1, min(num_shards, len(objects))))]
+    loads = [(0, i) for i in range(len(shards))]
+    for item in sorted(objects, key=lambda item: -item["size"]):
+        load, i = heapq.heappop(loads)
+        shards[i].append(item)
+        heapq.heappush(loads, (load + item["size"], i))
+    return [shard for shard in shards if shard]
+
+
+def pending_jobs(
+    prefix_path: str,
+    destination_prefix: str,
+    job: dict,
+    session: boto3.session.Session,
+    checkpoint_path: str,
+) -> tuple:
+    """Lists a prefix and builds a job for every object not yet checkpointed
+
+    An object is skipped only if the checkpoint holds its current etag, so
+    objects that changed since they were obfuscated are processed again.
+
+    Returns:
+        A tuple of (pending jobs, number of objects skipped)
+    """
+
+    done = load_checkpoint(checkpoint_path, session)
+    bucket, prefix = _split_folder(prefix_path)
+    source_root = f"s3://{bucket}/{prefix}"
+    destination_root = destination_prefix.rstrip("/") + "/"
+    jobs = []
+    skipped = 0
+    for item in list_objects(prefix_path, session):
+        if done.get(item["path"]) == item["etag"]:
+            skipped += 1
+            continue
+        jobs.append(
+            {
+                **job,
+                "file_to_obfuscate": item["path"],
+                "destination": destination_root + item["path"][len(source_root) :],
+                "etag": item["etag"],
+                "size": item["size"],
+            }
+        )
+    return jobs, skipped
+
+
+def run_shard(shard: dict, session: boto3.session.Session = None) -> dict:
+    """Obfuscates the files of one shard in turn, checkpointing as it goes
+
+    The shard's manifest is rewritten after every checkpoint_every files
+    obfuscated and once more at the end. Files that fail are not recorded,
+    so the next run retries them.
+
+    Args:
+        shard: dictionary holding name, jobs, checkpoint_path,
+            checkpoint_every and region_name
+        session: boto3 session, or None to create one (in a worker process)
+
+    Returns:
+        A dictionary containing the following:
+            succeeded: the number of files obfuscated
+            failures: the file_to_obfuscate and message of each file that failed
+    """
+
+    if session is None:
+        session = boto3.session.Session(region_name=shard.get("region_name"))
+    process_file = importlib.import_module(HANDLER_MODULE).process_file
+    bucket, prefix = _split_prefix(shard["checkpoint_path"])
+    manifest_key = f"{prefix}{shard['name']}.jsonl"
+    checkpoint_every = shard.get("checkpoint_every", DEFAULT_CHECKPOINT_EVERY)
+
+    done = []
+    failures = []
+
+    def write_manifest():
+        get_s3_client(session).put_object(
+            Bucket=bucket, Key=manifest_key, Body="".join(done).encode("utf-8")
+        )
+
+    for job in shard["jobs"]:
+        response = process_file(job, session)
+        if response["status"] == "success":
+            entry = {"file_to_obfuscate": job["file_to_obfuscate"], "etag": job["etag"]}
+            done.append(json.dumps(entry) + "\n")
+            if len(done) % checkpoint_every == 0:
+                write_manifest()
+        else:
+            failures.append(
+                {"file_to_obfuscate": job["file_to_obfuscate"], "message": response["message"]}
+            )
+    if done and len(done) % checkpoint_every:
+        write_manifest()
+    return {"succeeded": len(done), "failures": failures}
+
+
+def process_prefix(
+    prefix_path: str,
+    destination_prefix: str,
+    job: dict,
+    session: boto3.session.Session,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    pool: str = "process",
+    checkpoint_path: str = None,
+    checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY,
+) -> dict:
+    """Obfuscates every csv, json and parquet object under a prefix
+
+    Objects are written to the same relative key under destination_prefix.
+    The pending objects are split into SHARDS_PER_WORKER size-balanced
+    shards per worker and the shards run on a pool of processes (or
+    threads). Each shard records the files it finished in its own manifest
+    under checkpoint_path, so an interrupted run can simply be started
+    again and only the unfinished files are processed.
+
+    Args:
+        prefix_path: S3 prefix holding the files to obfuscate
+        destination_prefix: S3 prefix the obfuscated files are written to
+        job: settings applied to every file, such as pii_fields, masking
+            and streaming, see process_file
+        session: boto3 session
+        max_workers: number of processes (or threads) obfuscating at once
+        pool: "process" to use a process pool, which scales with CPU cores,
+            or "thread". Lambda has no /dev/shm, so process pools only work
+            outside Lambda
+        checkpoint_path: S3 prefix of the manifests, by default
+            _checkpoint/ under destination_prefix
+        checkpoint_every: files obfuscated between manifest writes
+
+    Returns:
+        A dictionary containing the following:
+            status: "success" if every pending file was obfuscated, otherwise "failure"
+            message: how many files were obfuscated and skipped
+            failures: the file_to_obfuscate and message of each file that failed
+    """
+
+    if pool not in ["process", "thread"]:
+        return {"status": "failure", "message": "pool must be process or thread"}
+    checkpoint_path = checkpoint_path or default_checkpoint_path(destination_prefix)
+    jobs, skipped = pending_jobs(prefix_path, destination_prefix, job, session, checkpoint_path)
+
+    run_id = uuid.uuid4().hex[:8]
+    shards = [
+        {
+            "name": f"{run_id}-{i:05d}",
+            "jobs": shard,
+            "checkpoint_path": checkpoint_path,
+            "checkpoint_every": checkpoint_every,
+            "region_name": session.region_name,
+        }
+        for i, shard in enumerate(
+            plan_shards(jobs, max_workers * SHARDS_PER_WORKER)
+        )
+    ]
+
+    if pool == "process":
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(run_shard, shards))
+    else:
+        with connection_pool(session, max_workers):
+            # resolve credentials once before the session is shared between threads
+            get_s3_client(session)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(partial(run_shard, session=session), shards))
+
+    return _summarise(results, skipped)
+
+
+def enqueue_prefix(
+    prefix_path: str,
+    destination_prefix: str,
+    job: dict,
+    session: boto3.session.Session,
+    queue_url: str,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    checkpoint_path: str = None,
+    checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY,
+) -> dict:
+    """Queues the pending files under a prefix as shards on an SQS queue
+
+    Each message holds one shard of up to shard_size files, for run_shard
+    to process in whichever worker receives it: a Lambda with the queue as
+    its trigger, or drain_queue. Shards checkpoint exactly as in
+    process_prefix, so queueing the prefix again after an interruption only
+    queues the files that were not finished.
+
+    Args:
+        prefix_path: S3 prefix holding the files to obfuscate
+        destination_prefix: S3 prefix the obfuscated files are written to
+        job: settings applied to every file, see process_prefix
+        session: boto3 session
+        queue_url: URL of the SQS queue
+        shard_size: number of files in each message
+        checkpoint_path: S3 prefix of the manifests, see process_prefix
+        checkpoint_every: files obfuscated between manifest writes
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            message: how many files and shards were queued and skipped
+    """
+
+    checkpoint_path = checkpoint_path or default_checkpoint_path(destination_prefix)
+    jobs, skipped = pending_jobs(prefix_path, destination_prefix, job, session, checkpoint_path)
+    run_id = uuid.uuid4().hex[:8]
+    messages = [
+        json.dumps(
+            {
+                "shard": {
+                    "name": f"{run_id}-{i // shard_size:05d}",
+                    "jobs": jobs[i : i + shard_size],
+                    "checkpoint_path": checkpoint_path,
+                    "checkpoint_every": checkpoint_every,
+                    "region_name": session.region_name,
+                }
+            }
+        )
+        for i in range(0, len(jobs), shard_size)
+    ]
+    client = session.client("sqs")
+    # SQS takes at most 10 messages per batch
+    for i in range(0, len(messages), 10):
+        entries = [
+            {"Id": str(j), "MessageBody": body} for j, body in enumerate(messages[i : i + 10])
+        ]
+        response = client.send_message_batch(QueueUrl=queue_url, Entries=entries)
+        if response.get("Failed"):
+            return {
+                "status": "failure",
+                "message": f"could not queue shards: {response['Failed']}",
+            }
+    return {
+        "status": "success",
+        "message": f"{len(jobs)} files queued in {len(messages)} shards, {skipped} already obfuscated",
+    }
+
+
+def process_queue_records(records: list, session: boto3.session.Session) -> dict:
+    """Runs the shards in the records of an SQS Lambda event, see enqueue_prefix"""
+
+    results = [run_shard(json.loads(record["body"])["shard"], session) for record in records]
+    return _summarise(results, 0)
+
+
+def drain_queue(
+    queue_url: str,
+    session: boto3.session.Session,
+    max_messages: int = None,
+    wait_seconds: int = 0,
+) -> dict:
+    """Receives and runs shards from an SQS queue until it is empty
+
+    A local stand-in for a Lambda triggered by the queue. Each message is
+    deleted once its shard has run; files that failed are not checkpointed
+    and are picked up by the next enqueue_prefix.
+
+    Args:
+        queue_url: URL of the SQS queue
+        session: boto3 session
+        max_messages: optional limit on the number of messages processed
+        wait_seconds: long polling wait for each receive
+
+    Returns:
+        A dictionary in the form returned by process_prefix
+    """
+
+    client = session.client("sqs")
+    results = []
+    while max_messages is None or len(results) < max_messages:
+        limit = 10 if max_messages is None else min(10, max_messages - len(results))
+        response = client.receive_message(
+            QueueUrl=queue_url, MaxNumberOfMessages=limit, WaitTimeSeconds=wait_seconds
+        )
+        messages = response.get("Messages", [])
+        if not messages:
+            break
+        for message in messages:
+            results.append(run_shard(json.loads(message["Body"])["shard"], session))
+            client.delete_message(QueueUrl=queue_url, ReceiptHandle=message["ReceiptHandle"])
+    return _summarise(results, 0)
+
+
+def default_checkpoint_path(destination_prefix: str) -> str:
+    return destination_prefix.rstrip("/") + "/" + CHECKPOINT_PREFIX
+
+
+def _split_prefix(prefix_path: str) -> tuple:
+    if not prefix_path.startswith("s3://"):
+        raise ValueError(f"{prefix_path} is not an s3 path i.e s3://my-bucket/my-prefix/")
+    bucket, _, prefix = prefix_path[len("s3://") :].partition("/")
+    if not bucket:
+        raise ValueError(f"{prefix_path} is not an s3 path i.e s3://my-bucket/my-prefix/")
+    return bucket, prefix
+
+
+def _split_folder(prefix_path: str) -> tuple:
+    # a prefix without a trailing slash would also match sibling keys
+    bucket, prefix = _split_prefix(prefix_path)
+    if prefix and not prefix.endswith("/"):
+        prefix += "/"
+    return bucket, prefix
+
+
+def _summarise(results: list, skipped: int) -> dict:
+    succeeded = sum(result["succeeded"] for result in results)
+    failures = [failure for result in results for failure in result["failures"]]
+    return {
+        "status": "failure" if failures else "success",
+        "message": f"{succeeded} of {succeeded + len(failures)} files obfuscated, {skipped} already obfuscated",
+        "failures": failures,
+    }
@@ -0,0 +1,369 @@
+import boto3
+import csv
+import importlib
+import io
+import json
+import re
+from botocore.exceptions import ClientError
+from src.transform_lambda.s3_utils import split_s3_path, get_s3_client
+from src.transform_lambda.storage_utils import (
+    is_s3_path,
+    get_file_size,
+    open_object_stream,
+    open_object_reader,
+)
+from src.transform_lambda.compression_utils import split_extension, open_decompressed
+from src.transform_lambda.json_splice_utils import JSON_LINES_EXTENSIONS, split_json_path
+
+MASK = "***"
+# "mask" replaces every value with MASK, "hash" replaces each value with its
+# keyed HMAC-SHA256 so equal values still match across datasets
+MASKING_STRATEGIES = ["mask", "hash"]
+HMAC_KEY_ENV = "OBFUSCATOR_HMAC_KEY"
+SNIFF_BYTES = 64 * 1024
+MAX_SNIFF_BYTES = 16 * 1024 * 1024
+# json records whose keys are merged into the sniffed columns, if they fit
+# in the bytes fetched for the first one
+SNIFF_RECORDS = 100
+# values of these types have no single text form to hash
+NESTED_TYPES = ("struct", "list", "large_list", "fixed_size_list", "map")
+
+
+def masking_strategies(pii_fields: list, masking: dict = None) -> dict:
+    """Returns the masking strategy of every PII field
+
+    Args:
+        pii_fields: list containing personally identifiable information fields
+        masking: optional dictionary of field -> strategy; fields not listed
+            are masked
+
+    Returns:
+        A dictionary of field -> strategy covering every field in pii_fields
+    """
+
+    strategies = {field: "mask" for field in pii_fields}
+    for field, strategy in (masking or {}).items():
+        if strategy not in MASKING_STRATEGIES:
+            raise ValueError(
+                f"Unknown masking strategy {strategy} for {field}. Can only use {MASKING_STRATEGIES}"
+            )
+        if field in strategies:
+            strategies[field] = strategy
+    return strategies
+
+
+def sniff_schema(bucket_path: str, session: boto3.session.Session) -> dict:
+    """Reads the column names and types of a file without downloading it
+
+    Only the start of a csv (up to the end of the header) or json file (up
+    to the end of the first record), or the footer of a parquet file, is
+    fetched, with ranged GET requests that start at SNIFF_BYTES and double
+    as needed. Compressed csv and json files (such as file.csv.gz) are
+    streamed and only their start is decompressed. csv columns have no
+    type until parsed, so they are reported as "string". json columns are
+    the keys of the first SNIFF_RECORDS records (or lines of newline
+    delimited json) held in the bytes fetched, each typed by its first
+    value that is not null.
+
+    Args:
+        bucket_path: path containing file
+        session: boto3 session
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: a dictionary of format, compression, size (in bytes),
+                columns, types (column -> type name) and sampled (if
+                successful). columns and types are None for json files
+                holding a single object, whose columns cannot be found
+                without reading the whole file. sampled is True when they
+                come from only some of a json file's records, so later
+                records may hold other keys
+            message: a relevant error message (if unsuccessful)
+    """
+
+    file_extension, compression = split_extension(bucket_path)
+
+    try:
+        sampled = False
+        if file_extension == ".csv":
+            size, types = _sniff_csv(bucket_path, session, compression)
+        elif file_extension == ".json":
+            size, types, sampled = _sniff_json(bucket_path, session, compression)
+        elif file_extension in JSON_LINES_EXTENSIONS:
+            size, types, sampled = _sniff_json(bucket_path, session, compression, lines=True)
+        elif file_extension == ".parquet" and compression is not None:
+            return {
+                "status": "failure",
+                "message": "Compressed parquet files are not supported, parquet is compressed internally",
+            }
+        elif file_extension == ".parquet":
+            size, types = _sniff_parquet(bucket_path, session)
+        else:
+            return {
+                "status": "failure",
+                "message": "Unsuported data type. Can only process csv, json, and parquet file types",
+            }
+    except ClientError as ce:
+        return {"status": "failure", "message": ce.response}
+    except ValueError as ve:
+        return {"status": "failure", "message": str(ve)}
+    except FileNotFoundError as fnf:
+        return {"status": "failure", "message": str(fnf)}
+
+    return {
+        "status": "success",
+        "data": {
+            "format": file_extension,
+            "compression": compression,
+            "size": size,
+            "columns": None if types is None else list(types),
+            "types": types,
+            "sampled": sampled,
+        },
+    }
+
+
+def preflight_check(
+    bucket_path: str,
+    pii_fields: list,
+    session: boto3.session.Session,
+    masking: dict = None,
+) -> dict:
+    """Checks a job against the file's schema before any bulk transfer
+
+    The schema is read with sniff_schema. The check fails if a PII field is
+    not in the file, if a masking strategy is unknown, or if a field to be
+    hashed holds nested values. For json, a nested path such as
+    customer.contact.email only needs its top-level key to be in the file,
+    as the records sampled may not hold the rest of it, and a field missing
+    from a sample of the records is only a warning, as later records may
+    hold it.
+
+    Args:
+        bucket_path: path containing file
+        pii_fields: list containing personally identifiable information fields
+        session: boto3 session
+        masking: optional dictionary of field -> "mask" or "hash"
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: the plan for the file (if successful): the sniff_schema
+                data plus the columns that will be masked, hashed and passed
+                through unchanged, and a list of warnings
+            message: a relevant error message (if unsuccessful)
+    """
+
+    try:
+        strategies = masking_strategies(pii_fields, masking)
+    except ValueError as ve:
+        return {"status": "failure", "message": str(ve)}
+
+    response = sniff_schema(bucket_path, session)
+    if response["status"] == "failure":
+        return response
+    plan = response["data"]
+    types = plan["types"]
+    warnings = []
+
+    if types is not None:
+        is_json = plan["format"] != ".csv" and plan["format"] != ".parquet"
+        columns = {
+            field: split_json_path(field)[0] if is_json and field not in types else field
+            for field in strategies
+        }
+        missing = [field for field in strategies if columns[field] not in types]
+        if missing and plan["sampled"]:
+            warnings.append(
+                f"{', '.join(missing)} not in the first {SNIFF_RECORDS} records"
+            )
+        elif missing:
+            return {
+                "status": "failure",
+                "message": f"{', '.join(missing)} not in data set",
+            }
+        nested = [
+            field
+            for field, strategy in strategies.items()
+            if strategy == "hash"
+            and field not in missing
+            and (columns[field] != field or types[field].startswith(NESTED_TYPES))
+        ]
+        if nested:
+            return {
+                "status": "failure",
+                "message": f"{', '.join(nested)} cannot be hashed, nested values are not supported",
+            }
+
+    plan["masked"] = [field for field, strategy in strategies.items() if strategy == "mask"]
+    plan["hashed"] = [field for field, strategy in strategies.items() if strategy == "hash"]
+    plan["passed_through"] = (
+        None
+        if types is None
+        else [column for column in types if column not in columns.values()]
+    )
+    plan["warnings"] = warnings
+    return {"status": "success", "data": plan}
+
+
+def csv_header_end(data: bytes):
+    """Returns the position of the newline ending the csv header in data, or None
+
+    The header ends at the first newline outside quotes.
+    """
+
+    position = data.find(b"\n")
+    while position != -1:
+        if data.count(b'"', 0, position) % 2 == 0:
+            return position
+        position = data.find(b"\n", position + 1)
+    return None
+
+
+def _read_prefix(
+    bucket_path: str, session: boto3.session.Session, length: int, compression: str = None
+) -> tuple:
+    """Returns (first length bytes, object size, whether that is the whole file)
+
+    Uses one ranged GET, or for compressed files one GET whose body is
+    decompressed until length bytes are available and then closed. Local
+    and in-memory files are simply read from the start.
+    """
+
+    if not is_s3_path(bucket_path):
+        size = get_file_size(bucket_path, session)
+        with open_object_stream(bucket_path, session) as body:
+            stream = body if compression is None else open_decompressed(body, compression)
+            prefix = stream.read(length)
+            return prefix, size, not stream.read(1)
+    bucket, key = split_s3_path(bucket_path)
+    if compression is not None:
+        response = get_s3_client(session).get_object(Bucket=bucket, Key=key)
+        body = response["Body"]
+        try:
+            with open_decompressed(body, compression) as stream:
+                prefix = b""
+                while len(prefix) < length:
+                    data = stream.read(length - len(prefix))
+                    if not data:
+                        return prefix, response["ContentLength"], True
+                    prefix += data
+        finally:
+            body.close()
+        return prefix, response["ContentLength"], False
+    try:
+        response = get_s3_client(session).get_object(
+            Bucket=bucket, Key=key, Range=f"bytes=0-{length - 1}"
+        )
+    except ClientError as ce:
+        # S3 refuses any range of an empty object
+        if ce.response["Error"]["Code"] == "InvalidRange":
+            return b"", 0, True
+        raise
+    size = int(response["ContentRange"].rpartition("/")[2])
+    prefix = response["Body"].read()
+    return prefix, size, len(prefix) == size
+
+
+def _sniff_csv(bucket_path: str, session: boto3.session.Session, compression: str = None) -> tuple:
+    length = SNIFF_BYTES
+    while True:
+        prefix, size, complete = _read_prefix(bucket_path, session, length, compression)
+        end = csv_header_end(prefix)
+        if end is not None or complete:
+            break
+        if length >= MAX_SNIFF_BYTES:
+            raise ValueError(f"csv header is longer than {MAX_SNIFF_BYTES} bytes")
+        length *= 2
+    header = prefix[:end].decode("utf-8-sig")
+    names = next(csv.reader(io.StringIO(header)), [])
+    return size, {name: "string" for name in names}
+
+
+def _sniff_json(
+    bucket_path: str,
+    session: boto3.session.Session,
+    compression: str = None,
+    lines: bool = False,
+) -> tuple:
+    length = SNIFF_BYTES
+    decoder = json.JSONDecoder()
+    while True:
+        prefix, size, complete = _read_prefix(bucket_path, session, length, compression)
+        # a multi-byte character may be cut off at the end of the range
+        text = prefix.decode("utf-8-sig", errors="ignore").lstrip()
+        if lines:
+            body = text
+            if not body:
+                return size, {}, False
+        elif text.startswith("{"):
+            return size, None, False
+        elif not text.startswith("["):
+            raise ValueError(f"{bucket_path} does not hold a list of json records")
+        else:
+            body = text[1:].lstrip()
+            if body.startswith("]"):
+                return size, {}, False
+        try:
+            record, end = decoder.raw_decode(body)
+            break
+        except json.JSONDecodeError:
+            if complete:
+                raise ValueError(f"{bucket_path} is not valid json")
+            if length >= MAX_SNIFF_BYTES:
+                raise ValueError(f"first json record is longer than {MAX_SNIFF_BYTES} bytes")
+            length *= 2
+    records = [record]
+    separator = re.compile(r"\s*" if lines else r"\s*,?\s*")
+    read_all = False
+    while len(records) < SNIFF_RECORDS:
+        end = separator.match(body, end).end()
+        if end == len(body) or body[end] == "]":
+            # the list was closed, or the last line was read
+            read_all = body[end : end + 1] == "]" or complete
+            break
+        try:
+            record, end = decoder.raw_decode(body, end)
+        except json.JSONDecodeError:
+            # cut off at the end of the range
+            break
+        records.append(record)
+    if not all(isinstance(record, dict) for record in records):
+        raise ValueError(f"{bucket_path} does not hold a list of json records")
+    types = {}
+    for record in records:
+        for name, value in record.items():
+            if types.get(name, "null") == "null":
+                types[name] = _json_type(value)
+    return size, types, not read_all
+
+
+def _json_type(value) -> str:
+    if isinstance(value, dict):
+        return "struct"
+    if isinstance(value, list):
+        return "list"
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int64"
+    if isinstance(value, float):
+        return "double"
+    if value is None:
+        return "null"
+    return "string"
+
+
+def _sniff_parquet(bucket_path: str, session: boto3.session.Session) -> tuple:
+    # imported here so csv and json checks stay free of pyarrow
+    parquet = importlib.import_module("pyarrow.parquet")
+
+    size = get_file_size(bucket_path, session)
+    try:
+        schema = parquet.read_schema(open_object_reader(bucket_path, session))
+    except FileNotFoundError:
+        raise
+    except OSError as oe:
+        raise ValueError(f"{bucket_path} is not a valid parquet file: {oe}")
+    return size, {field.name: str(field.type) for field in schema}
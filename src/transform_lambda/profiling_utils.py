@@ -0,0 +1,204 @@
+import boto3
+import contextlib
+import cProfile
+import json
+import marshal
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from botocore.exceptions import ClientError
+from src.transform_lambda.storage_utils import open_object_writer
+
+PROFILE_DESTINATION_ENV = "OBFUSCATOR_PROFILE_DESTINATION"
+PROFILERS = ["cprofile", "tracemalloc"]
+DEFAULT_TOP_ALLOCATIONS = 25
+
+# tracemalloc is process wide, so stages running on other threads share one
+# trace; it is only stopped once the last of them has finished with it
+_tracing_lock = threading.Lock()
+_tracing_stages = 0
+_started_tracing = False
+
+
+class StageProfiler:
+    """Profiles each pipeline stage with cProfile and/or tracemalloc
+
+    Passed to StageMetrics, which wraps every stage in stage(). cProfile
+    gives a <stage>.pstats file per stage, which pstats.Stats or snakeviz
+    can open. tracemalloc gives a <stage>.allocations.json file per stage,
+    holding the stage's peak traced memory and the source lines that
+    allocated the most memory still held when the stage ended.
+
+    cProfile only sees the thread that runs the stage. tracemalloc traces
+    the whole process, so stages of other files in the same batch can show
+    up in its allocations and peak; tracing is started by the first stage
+    to need it and stopped when no stage needs it any more. Both slow the
+    stage down, tracemalloc by several times, so the wall times recorded
+    alongside are inflated.
+    """
+
+    def __init__(self, cprofile: bool = True, trace_allocations: bool = True, top: int = DEFAULT_TOP_ALLOCATIONS):
+        self.cprofile = cprofile
+        self.trace_allocations = trace_allocations
+        self.top = top
+        # artifact filename -> bytes
+        self.artifacts = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        if self.trace_allocations:
+            started = _start_tracing()
+            tracemalloc.reset_peak()
+            before = None if started else tracemalloc.take_snapshot()
+        profile = cProfile.Profile() if self.cprofile else None
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.create_stats()
+                # the format pstats.Stats.dump_stats writes
+                self.artifacts[f"{name}.pstats"] = marshal.dumps(profile.stats)
+            if self.trace_allocations:
+                peak = tracemalloc.get_traced_memory()[1]
+                after = tracemalloc.take_snapshot()
+                _stop_tracing()
+                self.artifacts[f"{name}.allocations.json"] = json.dumps(
+                    {
+                        "stage": name,
+                        "peak_traced_bytes": peak,
+                        "top_allocations": self._top_allocations(after, before),
+                    },
+                    indent=2,
+                ).encode("utf-8")
+
+    def _top_allocations(self, after, before) -> list:
+        ignored = tracemalloc.Filter(False, tracemalloc.__file__)
+        after = after.filter_traces([ignored])
+        if before is None:
+            statistics = after.statistics("lineno")
+        else:
+            statistics = after.compare_to(before.filter_traces([ignored]), "lineno")
+        return [
+            {
+                "file": statistic.traceback[0].filename,
+                "line": statistic.traceback[0].lineno,
+                "size_bytes": statistic.size,
+                "count": statistic.count,
+            }
+            for statistic in statistics[: self.top]
+        ]
+
+    def write(self, prefix: str, session: boto3.session.Session) -> list:
+        """Writes every artifact under prefix, see write_profile"""
+
+        paths = []
+        for filename, data in self.artifacts.items():
+            path = f"{prefix.rstrip('/')}/{filename}"
+            with open_object_writer(path, session) as writer:
+                writer.write(data)
+            paths.append(path)
+        return paths
+
+
+def _start_tracing() -> bool:
+    """Registers a stage as using tracemalloc, starting it if nothing is tracing
+
+    Returns:
+        Whether tracing was started for this stage, in which case nothing
+        allocated before it is traced
+    """
+
+    global _tracing_stages, _started_tracing
+    with _tracing_lock:
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+            _started_tracing = True
+        _tracing_stages += 1
+        return started
+
+
+def _stop_tracing():
+    """Unregisters a stage, stopping tracemalloc if the last stage using it started it"""
+
+    global _tracing_stages, _started_tracing
+    with _tracing_lock:
+        _tracing_stages -= 1
+        if _tracing_stages == 0 and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+def get_profiler(config) -> StageProfiler:
+    """Returns the profiler described by a job's profile setting
+
+    Args:
+        config: None or False, True for both profilers, or a dictionary
+            with the optional profilers (a list of PROFILERS), top (number
+            of allocations kept per stage) and destination
+
+    Returns:
+        A StageProfiler, or None if config is empty
+    """
+
+    if not config:
+        return None
+    if config is True:
+        config = {}
+    if not isinstance(config, dict):
+        raise ValueError("profile must be true or a dictionary of profilers, top and destination")
+    profilers = config.get("profilers", PROFILERS)
+    if not isinstance(profilers, list) or not profilers:
+        raise ValueError(f"profile profilers must be a list of {PROFILERS}")
+    unknown = [profiler for profiler in profilers if profiler not in PROFILERS]
+    if unknown:
+        raise ValueError(f"Unknown profilers {unknown}. Can only use {PROFILERS}")
+    top = config.get("top", DEFAULT_TOP_ALLOCATIONS)
+    if not isinstance(top, int) or isinstance(top, bool) or top <= 0:
+        raise ValueError("profile top must be a positive number of allocations")
+    return StageProfiler("cprofile" in profilers, "tracemalloc" in profilers, top)
+
+
+def profile_destination(config, bucket_path: str) -> str:
+    """Returns the prefix a job's profile is written under
+
+    The job's profile destination, or the OBFUSCATOR_PROFILE_DESTINATION
+    environment variable, followed by the file's name, a timestamp and a
+    random suffix so repeated runs of the same file are kept apart.
+    """
+
+    destination = (config if isinstance(config, dict) else {}).get(
+        "destination", os.environ.get(PROFILE_DESTINATION_ENV)
+    )
+    if not destination:
+        raise ValueError(
+            f"profile needs a destination, set it in the event or in {PROFILE_DESTINATION_ENV}"
+        )
+    run = f"{os.path.basename(bucket_path)}-{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    return f"{destination.rstrip('/')}/{run}"
+
+
+def write_profile(profiler: StageProfiler, prefix: str, session: boto3.session.Session) -> dict:
+    """Writes a job's profile artifacts through the same storage as its output
+
+    Args:
+        profiler: the StageProfiler the job's stages ran under
+        prefix: an s3://, file:// or memory:// prefix, see profile_destination
+        session: boto3 session
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: the paths of the artifacts written (if successful)
+            message: a relevant error message (if unsuccessful)
+    """
+
+    try:
+        return {"status": "success", "data": profiler.write(prefix, session)}
+    except (ClientError, ValueError, OSError) as e:
+        return {"status": "failure", "message": f"profile could not be written to {prefix}: {e}"}
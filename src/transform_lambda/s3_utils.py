@@ -0,0 +1,414 @@
+import boto3
+import botocore.config
+import contextlib
+import io
+import logging
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("ftpuploader")
+
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_DOWNLOAD_CONCURRENCY = 10
+# botocore, and so awswrangler, pools this many connections per client
+DEFAULT_POOL_CONNECTIONS = 10
+
+# session -> {max_pool_connections: client}, dropped with the session
+_clients = weakref.WeakKeyDictionary()
+# session -> pool size get_s3_client uses when none is given, see connection_pool
+_pool_sizes = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def split_s3_path(path: str) -> tuple:
+    """Splits an S3 path into its bucket and key
+
+    Args:
+        path: string of the form s3://<bucket>/<key>
+
+    Returns:
+        A tuple of (bucket, key)
+    """
+
+    if not path.startswith("s3://"):
+        raise ValueError(f"{path} is not an s3 path i.e s3://my-bucket/my-file.csv")
+    bucket, _, key = path[len("s3://") :].partition("/")
+    if not bucket or not key:
+        raise ValueError(f"{path} is not an s3 path i.e s3://my-bucket/my-file.csv")
+    return bucket, key
+
+
+def get_s3_client(session: boto3.session.Session, max_pool_connections: int = None):
+    """Returns an S3 client for the session, creating it on first use
+
+    Building a client loads its service model and resolves credentials,
+    which takes tens of milliseconds, so one client is kept per session
+    (and connection pool size) and shared between calls and threads. A
+    session held at module level therefore keeps its clients, and their
+    open connections, across warm Lambda invocations.
+
+    Args:
+        session: Boto3 session
+        max_pool_connections: optional size of the client's connection pool.
+            Defaults to the size set by connection_pool, if any
+
+    Returns:
+        A boto3 S3 client
+    """
+
+    with _clients_lock:
+        if max_pool_connections is None:
+            max_pool_connections = _pool_sizes.get(session)
+        clients = _clients.setdefault(session, {})
+        if max_pool_connections not in clients:
+            config = None
+            if max_pool_connections is not None:
+                config = botocore.config.Config(max_pool_connections=max_pool_connections)
+            clients[max_pool_connections] = session.client("s3", config=config)
+        return clients[max_pool_connections]
+
+
+@contextlib.contextmanager
+def connection_pool(session: boto3.session.Session, max_pool_connections: int):
+    """Sizes the S3 connection pools used with a session inside a with block
+
+    Threads sharing a session share its clients, and so their connection
+    pools. Inside the block get_s3_client(session) returns a client pooling
+    max_pool_connections connections, and awswrangler's botocore config is
+    raised to the same size. Both are put back when the block exits. Pools
+    are never made smaller than botocore's DEFAULT_POOL_CONNECTIONS.
+
+    Args:
+        session: Boto3 session
+        max_pool_connections: number of connections, such as the number of
+            threads sharing the session
+    """
+
+    if max_pool_connections <= DEFAULT_POOL_CONNECTIONS:
+        yield
+        return
+    # imported here so batches that never read with awswrangler do not load it
+    import awswrangler as wr
+
+    with _clients_lock:
+        previous_size = _pool_sizes.get(session)
+        _pool_sizes[session] = max_pool_connections
+    previous_config = wr.config.botocore_config
+    pool_config = botocore.config.Config(max_pool_connections=max_pool_connections)
+    wr.config.botocore_config = (
+        pool_config if previous_config is None else previous_config.merge(pool_config)
+    )
+    try:
+        yield
+    finally:
+        wr.config.botocore_config = previous_config
+        with _clients_lock:
+            if previous_size is None:
+                _pool_sizes.pop(session, None)
+            else:
+                _pool_sizes[session] = previous_size
+
+
+def get_object_bytes(path: str, session: boto3.session.Session) -> bytes:
+    """Downloads a whole S3 object with a single GET request"""
+
+    bucket, key = split_s3_path(path)
+    return get_s3_client(session).get_object(Bucket=bucket, Key=key)["Body"].read()
+
+
+def get_object_stream(path: str, session: boto3.session.Session):
+    """Opens an S3 object for reading with a single GET request
+
+    Returns:
+        The response's StreamingBody, which reads the object as it arrives
+    """
+
+    bucket, key = split_s3_path(path)
+    return get_s3_client(session).get_object(Bucket=bucket, Key=key)["Body"]
+
+
+def get_object_etag(path: str, session: boto3.session.Session) -> str:
+    """Returns the ETag of an S3 object using a HEAD request"""
+
+    bucket, key = split_s3_path(path)
+    return get_s3_client(session).head_object(Bucket=bucket, Key=key)["ETag"]
+
+
+def get_object_size(path: str, session: boto3.session.Session) -> int:
+    """Returns the size in bytes of an S3 object using a HEAD request"""
+
+    bucket, key = split_s3_path(path)
+    return get_s3_client(session).head_object(Bucket=bucket, Key=key)["ContentLength"]
+
+
+def download_s3_object(
+    path: str,
+    session: boto3.session.Session,
+    part_size: int = DEFAULT_PART_SIZE,
+    max_concurrency: int = DEFAULT_DOWNLOAD_CONCURRENCY,
+    local_path: str = None,
+):
+    """Downloads an S3 object with parallel ranged GET requests
+
+    The object is HEADed for its size and ETag, then split into part_size
+    ranges that are fetched by max_concurrency threads straight into their
+    place in a preallocated buffer, or in a local file when local_path is
+    given (use /tmp on Lambda). Every range is requested with the ETag from
+    the HEAD so an object replaced mid-download fails rather than mixing
+    two versions. A local file is removed if the download fails.
+
+    Args:
+        path: string representing S3 object to be downloaded
+        session: Boto3 session
+        part_size: size in bytes of each ranged request
+        max_concurrency: number of ranges fetched at the same time
+        local_path: optional path of a local file to download into
+
+    Returns:
+        local_path if given, otherwise a bytearray holding the object
+    """
+
+    bucket, key = split_s3_path(path)
+    client = get_s3_client(session, max_concurrency)
+    head = client.head_object(Bucket=bucket, Key=key)
+    size = head["ContentLength"]
+    ranges = [(start, min(start + part_size, size)) for start in range(0, size, part_size)]
+
+    def fetch(start: int, end: int) -> bytes:
+        response = client.get_object(
+            Bucket=bucket,
+            Key=key,
+            Range=f"bytes={start}-{end - 1}",
+            IfMatch=head["ETag"],
+        )
+        return response["Body"].read()
+
+    if local_path is not None:
+        fd = os.open(local_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        downloaded = False
+        try:
+            os.ftruncate(fd, size)
+
+            def download(byte_range: tuple):
+                os.pwrite(fd, fetch(*byte_range), byte_range[0])
+
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                list(executor.map(download, ranges))
+            downloaded = True
+        finally:
+            os.close(fd)
+            if not downloaded:
+                # a partial copy is of no use and would fill /tmp
+                os.remove(local_path)
+        return local_path
+
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+
+    def download(byte_range: tuple):
+        start, end = byte_range
+        view[start:end] = fetch(start, end)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        list(executor.map(download, ranges))
+    return buffer
+
+
+def read_downloaded_object(
+    path: str, session: boto3.session.Session, parser, **download_options
+):
+    """Downloads an S3 object with download_s3_object and parses the local copy
+
+    A local_path is removed once it is parsed, or if the download or the
+    parse fails.
+
+    Args:
+        path: string representing S3 object to be downloaded
+        session: Boto3 session
+        parser: function taking a local path or binary file object, such as
+            pd.read_csv
+        download_options: keyword arguments passed to download_s3_object
+
+    Returns:
+        Whatever parser returns
+    """
+
+    source = download_s3_object(path, session, **download_options)
+    if isinstance(source, str):
+        try:
+            return parser(source)
+        finally:
+            os.remove(source)
+    # imported here so jobs that never use ranged downloads do not load pyarrow
+    import pyarrow as pa
+
+    return parser(pa.BufferReader(pa.py_buffer(source)))
+
+
+class S3RangeReader(io.RawIOBase):
+    """Seekable binary file-like object backed by ranged GET requests
+
+    Nothing is downloaded up front; each read fetches only the requested
+    byte range, so a reader such as pyarrow can pull a file footer or a
+    single column chunk without transferring the rest of the object. Every
+    range is requested with the ETag the object had when it was opened, so
+    an object overwritten mid-read raises a ClientError.
+    """
+
+    def __init__(self, path: str, session: boto3.session.Session):
+        self.bucket, self.key = split_s3_path(path)
+        self.client = get_s3_client(session)
+        head = self.client.head_object(Bucket=self.bucket, Key=self.key)
+        self.size = head["ContentLength"]
+        self.etag = head["ETag"]
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        else:
+            raise ValueError(f"invalid whence ({whence})")
+        self.position = max(self.position, 0)
+        return self.position
+
+    def read(self, size: int = -1) -> bytes:
+        end = self.size if size is None or size < 0 else min(self.size, self.position + size)
+        if end <= self.position:
+            return b""
+        response = self.client.get_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Range=f"bytes={self.position}-{end - 1}",
+            # fails with PreconditionFailed rather than mixing two versions
+            IfMatch=self.etag,
+        )
+        data = response["Body"].read()
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+class S3MultipartWriter:
+    """Binary file-like object that streams its contents to S3
+
+    Writes are buffered until a full part is available, which is then sent
+    with upload_part, so memory use is bounded by part_size rather than by
+    the size of the object. Objects smaller than one part are sent with a
+    single put_object call. The upload is only completed by close(); abort()
+    (or an exception inside a with block) discards any uploaded parts.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        session: boto3.session.Session,
+        part_size: int = DEFAULT_PART_SIZE,
+    ):
+        self.bucket, self.key = split_s3_path(path)
+        self.client = get_s3_client(session)
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = None
+        self.bytes_written = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.bytes_written
+
+    def flush(self):
+        pass
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to closed S3MultipartWriter")
+        self.buffer += data
+        self.bytes_written += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(self.part_size)
+        return len(data)
+
+    def _upload_part(self, size: int):
+        if self.upload_id is None:
+            response = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key
+            )
+            self.upload_id = response["UploadId"]
+        part_number = len(self.parts) + 1
+        body = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=body,
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                self.client.put_object(
+                    Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer)
+                )
+            else:
+                if self.buffer:
+                    self._upload_part(len(self.buffer))
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=self.upload_id,
+                    MultipartUpload={"Parts": self.parts},
+                )
+        except Exception:
+            self.abort()
+            raise
+        self.buffer = bytearray()
+        self.closed = True
+
+    def abort(self):
+        if self.upload_id is not None:
+            try:
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+                )
+            except Exception as e:
+                logger.error("Failed to abort multipart upload: %s", repr(e))
+            self.upload_id = None
+        self.buffer = bytearray()
+        self.closed = True
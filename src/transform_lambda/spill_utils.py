@@ -0,0 +1,148 @@
+import boto3
+import contextlib
+import os
+import tempfile
+import pyarrow as pa
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+from src.transform_lambda.storage_utils import open_object_stream, open_object_reader
+from src.transform_lambda.compression_utils import split_extension, open_decompressed
+from src.transform_lambda.csv_utils import open_csv_table_stream
+from src.transform_lambda.json_splice_utils import JsonRecordSplitter
+from src.transform_lambda.json_utils import read_json_records
+from src.transform_lambda.planner_utils import SPILL_DIRECTORY, SPILL_FORMATS
+
+# rows per record batch decoded from parquet and json; csv batches are one
+# block of the file
+SPILL_BATCH_ROWS = 64 * 1024
+SPILL_READ_SIZE = 8 * 1024 * 1024
+
+
+def spill_to_disk(
+    path: str,
+    session: boto3.session.Session,
+    directory: str = SPILL_DIRECTORY,
+) -> dict:
+    """Decodes a file into an Arrow IPC file on local disk, one record batch at a time
+
+    The source is never held in memory whole: parquet is read with ranged
+    requests and decoded SPILL_BATCH_ROWS rows at a time (so a huge row
+    group only costs its compressed column chunks and one batch), csv is
+    parsed a block at a time with every column as a string, and json
+    records are split out of the stream with JsonRecordSplitter and parsed
+    SPILL_BATCH_ROWS at a time with json_utils.read_json_records.
+    Compressed csv and json are decompressed as they are read. Each batch
+    is appended to the IPC file as soon as it is decoded.
+
+    Args:
+        path: string representing S3 object to be spilled
+        session: Boto3 session
+        directory: where the IPC file is written, /tmp on Lambda
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: the path of the IPC file, which the caller removes (if
+                successful)
+            message: a relevant error message (if unsuccessful)
+    """
+
+    file_extension, compression = split_extension(path)
+    if file_extension not in SPILL_FORMATS or (file_extension == ".parquet" and compression):
+        return {
+            "status": "failure",
+            "message": "Unsuported data type. Can only spill csv, json, and parquet file types",
+        }
+    fd, local_path = tempfile.mkstemp(suffix=".arrow", dir=directory)
+    os.close(fd)
+    try:
+        with contextlib.ExitStack() as stack:
+            schema, batches = _open_batches(path, session, file_extension, compression, stack)
+            with pa.OSFile(local_path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+                for batch in batches:
+                    writer.write_batch(batch)
+        return {"status": "success", "data": local_path}
+    except ClientError as ce:
+        os.remove(local_path)
+        return {"status": "failure", "message": ce.response}
+    except (ValueError, pa.ArrowException) as e:
+        os.remove(local_path)
+        return {"status": "failure", "message": f"{path} could not be spilled: {e}"}
+    except (OSError, EOFError) as e:
+        os.remove(local_path)
+        return {"status": "failure", "message": f"{path} could not be decompressed: {e}"}
+
+
+def open_spilled_table(local_path: str) -> pa.Table:
+    """Memory maps an IPC file written by spill_to_disk as an Arrow table
+
+    The table's buffers point into the mapped file, so reading it copies
+    nothing into memory; pages are loaded as they are touched and can be
+    dropped again by the kernel, which lets a table larger than memory be
+    censored and written.
+    """
+
+    with pa.memory_map(local_path) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def _open_batches(
+    path: str,
+    session: boto3.session.Session,
+    file_extension: str,
+    compression: str,
+    stack: contextlib.ExitStack,
+) -> tuple:
+    # (schema, iterator of record batches) for the source
+    if file_extension == ".parquet":
+        parquet_file = pq.ParquetFile(open_object_reader(path, session))
+        return parquet_file.schema_arrow, parquet_file.iter_batches(batch_size=SPILL_BATCH_ROWS)
+
+    stream = stack.enter_context(open_object_stream(path, session))
+    if compression is not None:
+        stream = stack.enter_context(open_decompressed(stream, compression))
+    if file_extension == ".csv":
+        reader = open_csv_table_stream(stream)
+        if reader is None:
+            return pa.schema([]), iter([])
+        return reader.schema, reader
+
+    batches = _iter_json_batches(stream)
+    first = next(batches, None)
+    if first is None:
+        return pa.schema([]), iter([])
+    return first.schema, _chain(first, batches)
+
+
+def _iter_json_batches(stream):
+    # each batch is parsed as read_json_records parses a whole file, so a
+    # spilled file has the columns and types of one read in memory
+    splitter = JsonRecordSplitter()
+    schema = None
+    records = []
+
+    def batch(records: list) -> pa.RecordBatch:
+        table = read_json_records(b"[" + b",".join(records) + b"]", schema)
+        new = [] if schema is None else [name for name in table.column_names if name not in schema.names]
+        if new:
+            raise ValueError(f"{', '.join(new)} first appear after the first {SPILL_BATCH_ROWS} records")
+        return table.combine_chunks().to_batches()[0]
+
+    for chunk in iter(lambda: stream.read(SPILL_READ_SIZE), b""):
+        for record in splitter.feed(chunk):
+            if splitter.record_depth == 0:
+                raise ValueError("column oriented json has to be read whole")
+            records.append(record)
+        while len(records) >= SPILL_BATCH_ROWS:
+            output = batch(records[:SPILL_BATCH_ROWS])
+            schema = schema or output.schema
+            del records[:SPILL_BATCH_ROWS]
+            yield output
+    splitter.finish()
+    if records:
+        yield batch(records)
+
+
+def _chain(first: pa.RecordBatch, rest):
+    yield first
+    yield from rest
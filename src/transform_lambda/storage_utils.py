@@ -0,0 +1,331 @@
+import abc
+import boto3
+import io
+import os
+import tempfile
+import threading
+from botocore.exceptions import ClientError
+from src.transform_lambda.s3_utils import (
+    get_object_bytes,
+    get_object_stream,
+    get_object_size,
+    S3RangeReader,
+    S3MultipartWriter,
+    DEFAULT_PART_SIZE,
+)
+
+STORAGE_SCHEMES = ["s3", "file", "memory"]
+
+
+def split_uri(path: str) -> tuple:
+    """Splits a path into its scheme and the location within that storage
+
+    Args:
+        path: string such as s3://my-bucket/my-file.csv,
+            file:///tmp/my-file.csv or memory://my-bucket/my-file.csv
+
+    Returns:
+        A tuple of (scheme, location), e.g. ("file", "/tmp/my-file.csv")
+    """
+
+    scheme, separator, location = path.partition("://")
+    if not separator or scheme not in STORAGE_SCHEMES or not location:
+        raise ValueError(
+            f"{path} is not a supported path i.e s3://my-bucket/my-file.csv, "
+            "file:///tmp/my-file.csv or memory://my-bucket/my-file.csv"
+        )
+    return scheme, location
+
+
+def is_s3_path(path: str) -> bool:
+    """Returns whether a path is an S3 object rather than a local or in-memory one"""
+
+    return path.startswith("s3://")
+
+
+class ObjectStorage(abc.ABC):
+    """Interface of the places files are read from and written to
+
+    Every backend reads through the same forward-only streams and seekable
+    readers and writes through the same writers, which only make the file
+    visible when they are closed and discard it when aborted (or when a
+    with block exits with an exception), as S3MultipartWriter does. A
+    backend missing any of the abstract methods cannot be created.
+    """
+
+    @abc.abstractmethod
+    def exists(self, path: str) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def size(self, path: str) -> int:
+        pass
+
+    @abc.abstractmethod
+    def open_stream(self, path: str):
+        """Opens a file for reading from start to end"""
+
+    @abc.abstractmethod
+    def open_reader(self, path: str):
+        """Opens a file for reading at any position, such as a parquet footer"""
+
+    @abc.abstractmethod
+    def open_writer(self, path: str, part_size: int = DEFAULT_PART_SIZE):
+        pass
+
+    def read_bytes(self, path: str) -> bytes:
+        with self.open_stream(path) as stream:
+            return stream.read()
+
+
+class S3Storage(ObjectStorage):
+    """Storage in S3, through the functions of s3_utils"""
+
+    def __init__(self, session: boto3.session.Session):
+        self.session = session
+
+    def exists(self, path: str) -> bool:
+        try:
+            get_object_size(path, self.session)
+            return True
+        except ClientError as ce:
+            if ce.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
+            raise
+
+    def size(self, path: str) -> int:
+        return get_object_size(path, self.session)
+
+    def open_stream(self, path: str):
+        return get_object_stream(path, self.session)
+
+    def open_reader(self, path: str):
+        return S3RangeReader(path, self.session)
+
+    def open_writer(self, path: str, part_size: int = DEFAULT_PART_SIZE):
+        return S3MultipartWriter(path, self.session, part_size)
+
+    def read_bytes(self, path: str) -> bytes:
+        return get_object_bytes(path, self.session)
+
+
+class LocalStorage(ObjectStorage):
+    """Storage on the local file system, for paths such as file:///tmp/my-file.csv
+
+    Files are written to a temporary file next to the destination and
+    renamed over it when the writer is closed, so a failed job never
+    leaves half a file behind. As with object storage, missing parent
+    directories are created.
+    """
+
+    def exists(self, path: str) -> bool:
+        return os.path.isfile(split_uri(path)[1])
+
+    def size(self, path: str) -> int:
+        return os.path.getsize(split_uri(path)[1])
+
+    def open_stream(self, path: str):
+        return open(split_uri(path)[1], "rb")
+
+    def open_reader(self, path: str):
+        return open(split_uri(path)[1], "rb")
+
+    def open_writer(self, path: str, part_size: int = DEFAULT_PART_SIZE):
+        location = split_uri(path)[1]
+        os.makedirs(os.path.dirname(os.path.abspath(location)), exist_ok=True)
+        return LocalFileWriter(location)
+
+
+class MemoryStorage(ObjectStorage):
+    """Storage in a dictionary shared by the whole process, for paths such
+    as memory://my-bucket/my-file.csv
+
+    Nothing leaves the process, so local runs and benchmarks measure the
+    obfuscation itself rather than S3 or its emulation.
+    """
+
+    objects = {}
+    lock = threading.Lock()
+
+    def exists(self, path: str) -> bool:
+        return split_uri(path)[1] in self.objects
+
+    def size(self, path: str) -> int:
+        return len(self._get(path))
+
+    def open_stream(self, path: str):
+        return io.BytesIO(self._get(path))
+
+    def open_reader(self, path: str):
+        return io.BytesIO(self._get(path))
+
+    def open_writer(self, path: str, part_size: int = DEFAULT_PART_SIZE):
+        return MemoryWriter(split_uri(path)[1], self)
+
+    def put(self, path: str, data: bytes):
+        with self.lock:
+            self.objects[split_uri(path)[1]] = bytes(data)
+
+    def delete(self, path: str):
+        with self.lock:
+            self.objects.pop(split_uri(path)[1], None)
+
+    def _get(self, path: str) -> bytes:
+        location = split_uri(path)[1]
+        with self.lock:
+            if location not in self.objects:
+                raise FileNotFoundError(f"{path} does not exist")
+            return self.objects[location]
+
+
+class LocalFileWriter:
+    """Binary file object that replaces a local file with what is written when closed"""
+
+    # tells pandas to write bytes rather than text
+    mode = "wb"
+
+    def __init__(self, path: str):
+        fd, self.temporary_path = tempfile.mkstemp(
+            prefix=".", suffix=".part", dir=os.path.dirname(os.path.abspath(path))
+        )
+        self.file = os.fdopen(fd, "wb")
+        self.path = path
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+    def flush(self):
+        pass
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to closed LocalFileWriter")
+        return self.file.write(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.file.close()
+        os.replace(self.temporary_path, self.path)
+
+    def abort(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.file.close()
+        os.remove(self.temporary_path)
+
+
+class MemoryWriter:
+    """Binary file object that stores what is written in a MemoryStorage when closed"""
+
+    # tells pandas to write bytes rather than text
+    mode = "wb"
+
+    def __init__(self, location: str, storage: MemoryStorage):
+        self.buffer = io.BytesIO()
+        self.location = location
+        self.storage = storage
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.buffer.tell()
+
+    def flush(self):
+        pass
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to closed MemoryWriter")
+        return self.buffer.write(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        with self.storage.lock:
+            self.storage.objects[self.location] = self.buffer.getvalue()
+
+    def abort(self):
+        self.closed = True
+
+
+_local_storage = LocalStorage()
+_memory_storage = MemoryStorage()
+
+
+def get_storage(path: str, session: boto3.session.Session = None) -> ObjectStorage:
+    """Returns the storage backend for a path's scheme
+
+    Args:
+        path: an s3://, file:// or memory:// path, see split_uri
+        session: boto3 session, only used by S3
+
+    Returns:
+        An ObjectStorage
+    """
+
+    scheme = split_uri(path)[0]
+    if scheme == "s3":
+        return S3Storage(session)
+    if scheme == "file":
+        return _local_storage
+    return _memory_storage
+
+
+def read_object_bytes(path: str, session: boto3.session.Session = None) -> bytes:
+    """Reads a whole file from any storage, with a single GET for S3"""
+
+    return get_storage(path, session).read_bytes(path)
+
+
+def open_object_stream(path: str, session: boto3.session.Session = None):
+    """Opens a file in any storage for reading from start to end"""
+
+    return get_storage(path, session).open_stream(path)
+
+
+def open_object_reader(path: str, session: boto3.session.Session = None):
+    """Opens a file in any storage for reading at any position"""
+
+    return get_storage(path, session).open_reader(path)
+
+
+def open_object_writer(
+    path: str, session: boto3.session.Session = None, part_size: int = DEFAULT_PART_SIZE
+):
+    """Opens a writer for a file in any storage, see ObjectStorage"""
+
+    return get_storage(path, session).open_writer(path, part_size)
+
+
+def get_file_size(path: str, session: boto3.session.Session = None) -> int:
+    """Returns the size in bytes of a file in any storage"""
+
+    return get_storage(path, session).size(path)
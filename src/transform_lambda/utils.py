@@ -1,69 +1,201 @@
 import boto3
+import importlib
+import os
+import sys
 from botocore.exceptions import ClientError
-from src.transform_lambda.csv_utils import (
-    get_csv_data_from_ingestion_bucket,
-    write_csv_data,
-)
-from src.transform_lambda.parquet_utils import (
-    get_parquet_data_from_ingestion_bucket,
-    write_parquet_data,
+from src.transform_lambda.compression_utils import split_extension
+from src.transform_lambda.storage_utils import get_storage, is_s3_path
+from src.transform_lambda.json_splice_utils import (
+    JSON_LINES_EXTENSIONS,
+    split_json_path,
+    mask_json_path,
 )
-from src.transform_lambda.json_utils import (
-    get_json_data_from_ingestion_bucket,
-    write_json_data,
+
+# file extension -> module implementing it, imported on first use so a job
+# only pays for the libraries its own format needs (pandas and awswrangler
+# alone take around a second to import on a Lambda cold start)
+FORMAT_BACKENDS = {
+    ".csv": "src.transform_lambda.csv_utils",
+    ".parquet": "src.transform_lambda.parquet_utils",
+    ".json": "src.transform_lambda.json_utils",
+}
+# the splice engines only need numpy (csv) or the standard library (json),
+# so they are kept apart from csv_utils and json_utils
+SPLICE_BACKENDS = {
+    ".csv": "src.transform_lambda.csv_splice_utils",
+    ".json": "src.transform_lambda.json_splice_utils",
+    ".jsonl": "src.transform_lambda.json_splice_utils",
+    ".ndjson": "src.transform_lambda.json_splice_utils",
+}
+MASKING_BACKEND = "src.transform_lambda.masking_utils"
+SPILL_BACKEND = "src.transform_lambda.spill_utils"
+DETECTION_BACKEND = "src.transform_lambda.detection_utils"
+COMPRESSED_PARQUET_MESSAGE = (
+    "Compressed parquet files are not supported, parquet is compressed internally"
 )
-import os
+JSON_LINES_MESSAGE = "Newline delimited json can only be streamed, set streaming to true"
+JSON_SPLICE_HASH_MESSAGE = "Streamed json can only mask fields, hash them without streaming"
+PIPELINE_MESSAGE = "Only the splice engines can be pipelined, use the splice engine for csv"
+READERS = ["pandas", "pyarrow"]
+READER_MESSAGE = "reader must be pandas or pyarrow"
+
+
+def load_backend(file_extension: str, engine: str = "pandas"):
+    """Imports and returns the module handling a file format
+
+    Args:
+        file_extension: one of the keys of FORMAT_BACKENDS or SPLICE_BACKENDS
+        engine: "splice" selects the byte-level engine, the only one for
+            newline delimited json
+
+    Returns:
+        The backend module, already imported after its first use
+    """
+
+    if file_extension in JSON_LINES_EXTENSIONS or (
+        file_extension in SPLICE_BACKENDS and engine == "splice"
+    ):
+        return importlib.import_module(SPLICE_BACKENDS[file_extension])
+    return importlib.import_module(FORMAT_BACKENDS[file_extension])
 
 
-def censor_sensitive_data(data: dict, pii_fields: list) -> dict:
+def censor_sensitive_data(data: dict, pii_fields: list, masking: dict = None) -> dict:
     """Reads a data frame and censors the given fields
 
     Args:
         data: dataframe containing sensitive information
         pii_fields: list containing personally identifiable information fields
+        masking: optional dictionary of field -> "mask" or "hash". Masked
+            fields are replaced with "***"; hashed fields are replaced with a
+            keyed HMAC of each value so they can still be joined on. Fields
+            not listed are masked. Nested json fields are given as paths
+            such as customer.contact.email or orders[].card_number, and can
+            only be masked
 
     Returns:
         A dictionary containing the following:
             status: shows whether the function ran successfully
-            data: a pandas dataframe containing censored data (if successful)
+            data: a pandas dataframe (or pyarrow table, if given one)
+                containing censored data (if successful)
             message: a relevant error message (if unsuccessful)
     """
 
     try:
         df = data["data"]
         format = data["format"]
-        for field in pii_fields:
-            if field in df:
-                df[field] = "***"
-            else:
+        if _is_arrow_table(df):
+            masking_utils = importlib.import_module(MASKING_BACKEND)
+            table = masking_utils.censor_table(df, pii_fields, masking)
+            return {"status": "success", "data": table, "format": format}
+        strategies = {field: "mask" for field in pii_fields}
+        if masking:
+            masking_utils = importlib.import_module(MASKING_BACKEND)
+            strategies = masking_utils.masking_strategies(pii_fields, masking)
+        for field, strategy in strategies.items():
+            segments = split_json_path(field)
+            if field not in df and len(segments) > 1 and segments[0] in df:
+                if strategy == "hash":
+                    raise ValueError(f"{field} cannot be hashed, nested values are not supported")
+                df[segments[0]] = df[segments[0]].map(
+                    lambda value: mask_json_path(value, segments[1:])
+                )
+            elif field not in df:
                 print(f"{field} not in data set")
+            elif strategy == "hash":
+                df[field] = masking_utils.pseudonymize_series(
+                    df[field], masking_utils.get_hmac_key()
+                )
+            else:
+                df[field] = "***"
         return {"status": "success", "data": df, "format": format}
     except ClientError as ce:
         return {"status": "failure", "message": ce.response}
+    except ValueError as ve:
+        return {"status": "failure", "message": str(ve)}
 
 
-def get_data_from_bucket(bucket_path: str, session: boto3.session.Session) -> dict:
+def get_data_from_bucket(
+    bucket_path: str,
+    session: boto3.session.Session,
+    ranged_download: dict = None,
+    use_arrow: bool = False,
+    reader: str = "pandas",
+    column_types: dict = None,
+) -> dict:
     """Reads a data file from a given path
 
     Args:
         bucket_path: path containing file
         session: boto3 session
+        ranged_download: optional settings for downloading the file with
+            parallel ranged requests (part_size, max_concurrency, local_path)
+        use_arrow: read the file into a pyarrow table instead of a pandas
+            dataframe. censor_sensitive_data and write_sensitive_data accept
+            either
+        reader: "pandas" parses csv and json with pandas' parsers, "pyarrow"
+            with Arrow's, which for csv use every core, see
+            csv_utils.read_csv_arrow. Either way the data is returned as a
+            pandas dataframe, unless use_arrow is set
+        column_types: optional dictionary of column -> Arrow type name
+            (such as "string"). The pandas readers only apply the text
+            types, as they read every csv field as text already
+
+    bucket_path can be an S3 path, a local file:///path or an in-memory
+    memory://bucket/key path, see storage_utils. Local and in-memory files
+    are read whole, as ranged downloads only help over the network.
+
+    csv and json files compressed with gzip, bz2 or zstd (such as
+    file.csv.gz) are decompressed as they are parsed.
 
     Returns:
         A dictionary containing the following:
             status: shows whether the function ran successfully
-            data: a pandas dataframe (if successful)
+            data: a pandas dataframe or pyarrow table (if successful)
             message: a relevant error message (if unsuccessful)
     """
 
-    filename, file_extension = os.path.splitext(bucket_path)
+    file_extension, compression = split_extension(bucket_path)
 
-    if file_extension == ".csv":
-        response = get_csv_data_from_ingestion_bucket(bucket_path, session)
+    if file_extension == ".parquet" and compression is not None:
+        return {"status": "failure", "message": COMPRESSED_PARQUET_MESSAGE}
+    elif file_extension in JSON_LINES_EXTENSIONS:
+        return {"status": "failure", "message": JSON_LINES_MESSAGE}
+    elif reader not in READERS:
+        return {"status": "failure", "message": READER_MESSAGE}
+
+    try:
+        storage = get_storage(bucket_path, session)
+    except ValueError as ve:
+        return {"status": "failure", "message": str(ve)}
+    if not is_s3_path(bucket_path):
+        if not storage.exists(bucket_path):
+            return {"status": "failure", "message": f"{bucket_path} does not exist"}
+        ranged_download = None
+
+    if file_extension == ".csv" and use_arrow:
+        response = load_backend(".csv").get_csv_table_from_ingestion_bucket(
+            bucket_path, session, ranged_download, compression
+        )
+    elif file_extension == ".parquet" and use_arrow:
+        response = load_backend(".parquet").get_parquet_table_from_ingestion_bucket(
+            bucket_path, session, ranged_download
+        )
+    elif file_extension == ".json" and use_arrow:
+        response = load_backend(".json").get_json_table_from_ingestion_bucket(
+            bucket_path, session, ranged_download, compression
+        )
+    elif file_extension == ".csv":
+        response = load_backend(".csv").get_csv_data_from_ingestion_bucket(
+            bucket_path, session, ranged_download, compression, reader, column_types
+        )
     elif file_extension == ".parquet":
-        response = get_parquet_data_from_ingestion_bucket(bucket_path, session)
+        response = load_backend(".parquet").get_parquet_data_from_ingestion_bucket(
+            bucket_path, session, ranged_download
+        )
     elif file_extension == ".json":
-        response = get_json_data_from_ingestion_bucket(bucket_path, session)
+        response = load_backend(".json").get_json_data_from_ingestion_bucket(
+            bucket_path, session, ranged_download, compression, reader, column_types
+        )
     else:
         return {
             "status": "failure",
@@ -74,13 +206,24 @@ def get_data_from_bucket(bucket_path: str, session: boto3.session.Session) -> di
 
 
 def write_sensitive_data(
-    response_dict: dict, destination_bucket: str, session: boto3.session.Session
+    response_dict: dict,
+    destination_bucket: str,
+    session: boto3.session.Session,
+    compression_level: int = None,
+    parquet_compression: str = "snappy",
 ) -> dict:
     """Reads a data frame into a file in the given bucket
 
+    csv and json files are compressed as they are uploaded when the
+    destination ends in .gz, .bz2 or .zst. The destination can be an S3,
+    file:// or memory:// path, see get_data_from_bucket.
+
     Args:
         response_dict: A dictionary of the form: {"status": "success", "data": df, "format": ".csv"} or
         if the response failed the dictionary will be :{"status": "failed", "message": "error message"}
+        compression_level: optional level for the destination's codec
+        parquet_compression: codec parquet files are written with, one of
+            parquet_utils.PARQUET_CODECS
 
     Returns:
         A dictionary containing the following:
@@ -92,13 +235,34 @@ def write_sensitive_data(
     try:
         file_extension = response_dict["format"]
         df = response_dict["data"]
+        compression = split_extension(destination_bucket)[1]
 
-        if file_extension == ".csv":
-            response = write_csv_data(df, destination_bucket, session)
+        if file_extension == ".parquet" and compression is not None:
+            return {"status": "failure", "message": COMPRESSED_PARQUET_MESSAGE}
+        elif file_extension == ".csv" and _is_arrow_table(df):
+            response = load_backend(".csv").write_csv_table(
+                df, destination_bucket, session, compression, compression_level
+            )
+        elif file_extension == ".parquet" and _is_arrow_table(df):
+            response = load_backend(".parquet").write_parquet_table(
+                df, destination_bucket, session, parquet_compression, compression_level
+            )
+        elif file_extension == ".json" and _is_arrow_table(df):
+            response = load_backend(".json").write_json_table(
+                df, destination_bucket, session, compression, compression_level
+            )
+        elif file_extension == ".csv":
+            response = load_backend(".csv").write_csv_data(
+                df, destination_bucket, session, compression, compression_level
+            )
         elif file_extension == ".parquet":
-            response = write_parquet_data(df, destination_bucket, session)
+            response = load_backend(".parquet").write_parquet_data(
+                df, destination_bucket, session, parquet_compression, compression_level
+            )
         elif file_extension == ".json":
-            response = write_json_data(df, destination_bucket, session)
+            response = load_backend(".json").write_json_data(
+                df, destination_bucket, session, compression, compression_level
+            )
         else:
             return {
                 "status": "failure",
@@ -112,3 +276,393 @@ def write_sensitive_data(
         }
 
     return response
+
+
+def stream_sensitive_data(
+    bucket_path: str,
+    pii_fields: list,
+    destination_bucket: str,
+    session: boto3.session.Session,
+    engine: str = "pandas",
+    masking: dict = None,
+    compression_level: int = None,
+    parquet_compression: str = "snappy",
+    pipelined: bool = False,
+) -> dict:
+    """Censors a file in chunks and streams the result to the destination
+
+    Compressed csv and json sources are decompressed as they are read, and
+    csv and json output is compressed as it is uploaded when the destination
+    ends in .gz, .bz2 or .zst, so neither side is ever held in memory in
+    full. json, including newline delimited .jsonl and .ndjson files, is
+    always streamed with the json splice engine, which rewrites only the
+    values at the PII paths.
+
+    Args:
+        bucket_path: path containing file
+        pii_fields: list containing personally identifiable information fields
+        destination_bucket: path the censored file is written to
+        session: boto3 session
+        engine: "pandas" to censor csv in dataframe chunks or "splice" to
+            censor csv at byte level, leaving all other fields untouched
+        masking: optional dictionary of field -> "mask" or "hash", see
+            censor_sensitive_data. The splice engines can only mask
+        compression_level: optional level for the destination's codec
+        parquet_compression: codec parquet files are written with, see
+            write_sensitive_data
+        pipelined: with the splice engines, download the next chunk and
+            upload the last one while the current one is censored, see
+            pipeline_utils.pipeline_splice_data
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            message: a relevant success/failure message
+    """
+
+    file_extension, compression = split_extension(bucket_path)
+    output_compression = split_extension(destination_bucket)[1]
+    spliced = file_extension in SPLICE_BACKENDS and (
+        engine == "splice" or file_extension != ".csv"
+    )
+
+    if file_extension == ".parquet" and (compression or output_compression):
+        return {"status": "failure", "message": COMPRESSED_PARQUET_MESSAGE}
+    elif pipelined and not spliced:
+        return {"status": "failure", "message": PIPELINE_MESSAGE}
+    elif file_extension == ".csv" and engine == "splice" and _uses_hashing(masking):
+        return {
+            "status": "failure",
+            "message": "The splice engine can only mask fields, use the pandas engine to hash them",
+        }
+    elif file_extension == ".csv" and engine == "splice":
+        response = load_backend(".csv", engine).splice_csv_data(
+            bucket_path,
+            destination_bucket,
+            pii_fields,
+            session,
+            compression=compression,
+            output_compression=output_compression,
+            compression_level=compression_level,
+            pipelined=pipelined,
+        )
+    elif file_extension == ".csv":
+        response = load_backend(".csv").stream_csv_data(
+            bucket_path,
+            destination_bucket,
+            pii_fields,
+            session,
+            masking=masking,
+            compression=compression,
+            output_compression=output_compression,
+            compression_level=compression_level,
+        )
+    elif file_extension in SPLICE_BACKENDS and _uses_hashing(masking):
+        return {"status": "failure", "message": JSON_SPLICE_HASH_MESSAGE}
+    elif file_extension in SPLICE_BACKENDS:
+        response = load_backend(file_extension, "splice").splice_json_data(
+            bucket_path,
+            destination_bucket,
+            pii_fields,
+            session,
+            compression=compression,
+            output_compression=output_compression,
+            compression_level=compression_level,
+            pipelined=pipelined,
+        )
+    elif file_extension == ".parquet":
+        response = load_backend(".parquet").stream_parquet_data(
+            bucket_path,
+            destination_bucket,
+            pii_fields,
+            session,
+            masking=masking,
+            compression=parquet_compression,
+            compression_level=compression_level,
+        )
+    else:
+        return {
+            "status": "failure",
+            "message": "Unsuported data type. Can only stream csv, json, and parquet file types",
+        }
+
+    return response
+
+
+def spill_sensitive_data(
+    bucket_path: str,
+    pii_fields: list,
+    destination_bucket: str,
+    session: boto3.session.Session,
+    masking: dict = None,
+    compression_level: int = None,
+    parquet_compression: str = "snappy",
+    directory: str = None,
+) -> dict:
+    """Censors a file larger than memory by spilling it to local disk
+
+    The file is decoded into an Arrow IPC file in /tmp, which is memory
+    mapped (see spill_utils), censored with censor_sensitive_data batch by
+    batch through zero-copy slices, and written with write_sensitive_data,
+    whose Arrow writers read it back from the mapped file. Memory use is
+    about one batch, so a file can be several times larger than memory as
+    long as its decoded form fits on disk. The IPC file is removed
+    afterwards.
+
+    Args:
+        bucket_path: path containing file
+        pii_fields: list containing personally identifiable information fields
+        destination_bucket: path the censored file is written to
+        session: boto3 session
+        masking: optional dictionary of field -> "mask" or "hash", see
+            censor_sensitive_data. Hashed tokens are held in memory
+        compression_level: optional level for the destination's codec
+        parquet_compression: codec parquet files are written with, see
+            write_sensitive_data
+        directory: optional directory for the IPC file, /tmp by default
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            message: a relevant success/failure message
+    """
+
+    file_extension, compression = split_extension(bucket_path)
+    if file_extension == ".parquet" and compression is not None:
+        return {"status": "failure", "message": COMPRESSED_PARQUET_MESSAGE}
+
+    spill_utils = importlib.import_module(SPILL_BACKEND)
+    options = {} if directory is None else {"directory": directory}
+    response = spill_utils.spill_to_disk(bucket_path, session, **options)
+    if response["status"] == "failure":
+        return response
+    local_path = response["data"]
+    try:
+        response = censor_sensitive_data(
+            {
+                "status": "success",
+                "data": spill_utils.open_spilled_table(local_path),
+                "format": file_extension,
+            },
+            pii_fields,
+            masking,
+        )
+        if response["status"] == "failure":
+            return response
+        return write_sensitive_data(
+            response, destination_bucket, session, compression_level, parquet_compression
+        )
+    finally:
+        os.remove(local_path)
+
+
+def detect_sensitive_data(
+    bucket_path: str, session: boto3.session.Session, sample_rows: int = None
+) -> dict:
+    """Detects the PII columns of a file from a sample of its first rows
+
+    The sample is matched against email, phone number, card number,
+    national ID and postcode patterns, see detection_utils. Only the
+    sample is read, so detection costs the same for any size of file.
+
+    Args:
+        bucket_path: path containing file
+        session: boto3 session
+        sample_rows: optional number of rows sampled,
+            detection_utils.DEFAULT_SAMPLE_ROWS by default
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: the detected fields, the kind of PII in each and the
+                share of sampled values that matched (if successful)
+            message: a relevant error message (if unsuccessful)
+    """
+
+    detection_utils = importlib.import_module(DETECTION_BACKEND)
+    options = {} if sample_rows is None else {"rows": sample_rows}
+    return detection_utils.detect_pii_fields(bucket_path, session, **options)
+
+
+def sensitive_data_to_bytes(response_dict: dict) -> dict:
+    """Encodes a data frame as the bytes of a file in its original format
+
+    The bytes are what write_sensitive_data would upload, so a caller can
+    pass them to put_object (or any other upload path) themselves.
+
+    Args:
+        response_dict: A dictionary of the form: {"status": "success", "data": df, "format": ".csv"}
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: a BytesIO holding the file (if successful)
+            format: the file extension of the data (if successful)
+            message: a relevant error message (if unsuccessful)
+    """
+
+    try:
+        file_extension = response_dict["format"]
+        df = response_dict["data"]
+
+        if file_extension == ".csv" and _is_arrow_table(df):
+            return load_backend(".csv").csv_table_to_bytes(df)
+        elif file_extension == ".parquet" and _is_arrow_table(df):
+            return load_backend(".parquet").parquet_table_to_bytes(df)
+        elif file_extension == ".json" and _is_arrow_table(df):
+            return load_backend(".json").json_table_to_bytes(df)
+        elif file_extension == ".csv":
+            return load_backend(".csv").csv_data_to_bytes(df)
+        elif file_extension == ".parquet":
+            return load_backend(".parquet").parquet_data_to_bytes(df)
+        elif file_extension == ".json":
+            return load_backend(".json").json_data_to_bytes(df)
+        else:
+            return {
+                "status": "failure",
+                "message": "Unsuported data type. Can only process csv, json, and parquet file types",
+            }
+    except:
+        return {
+            "status": "failure",
+            "source of error": response_dict,
+            "message": "unexpected error",
+        }
+
+
+def get_obfuscated_bytes(
+    bucket_path: str,
+    pii_fields: list,
+    session: boto3.session.Session,
+    masking: dict = None,
+    use_arrow: bool = False,
+) -> dict:
+    """Obfuscates a file and returns it as bytes instead of writing it to S3
+
+    Args:
+        bucket_path: path containing file
+        pii_fields: list containing personally identifiable information fields
+        session: boto3 session
+        masking: optional dictionary of field -> "mask" or "hash", see
+            censor_sensitive_data
+        use_arrow: censor the file as a pyarrow table, see get_data_from_bucket
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: a BytesIO holding the obfuscated file (if successful)
+            format: the file extension of the data (if successful)
+            message: a relevant error message (if unsuccessful)
+
+    Example:
+        response = get_obfuscated_bytes("s3://bucket/file.csv", ["email"], session)
+        s3_client.put_object(Bucket="other-bucket", Key="file.csv", Body=response["data"])
+    """
+
+    response = get_data_from_bucket(
+        bucket_path,
+        session,
+        use_arrow=use_arrow,
+        column_types=dict.fromkeys(pii_fields, "string"),
+    )
+    if response["status"] == "failure":
+        return response
+    response = censor_sensitive_data(response, pii_fields, masking)
+    if response["status"] == "failure":
+        return response
+    return sensitive_data_to_bytes(response)
+
+
+def iter_obfuscated_chunks(
+    bucket_path: str,
+    pii_fields: list,
+    session: boto3.session.Session,
+    engine: str = "pandas",
+    masking: dict = None,
+) -> dict:
+    """Obfuscates a file in a streaming fashion and returns an iterator of byte chunks
+
+    csv and parquet files are read and censored lazily as the iterator is
+    consumed, so memory use is bounded in the same way as
+    stream_sensitive_data. json files are censored in memory and returned as
+    a single chunk, unless engine is "splice"; newline delimited json is
+    always spliced. Compressed sources are decompressed as they are read;
+    the chunks themselves are not compressed. Because the work is lazy, S3
+    errors are raised while iterating rather than reported in the returned
+    dictionary.
+
+    Args:
+        bucket_path: path containing file
+        pii_fields: list containing personally identifiable information fields
+        session: boto3 session
+        engine: "pandas" or "splice", see stream_sensitive_data
+        masking: optional dictionary of field -> "mask" or "hash", see
+            censor_sensitive_data. The splice engines can only mask
+
+    Returns:
+        A dictionary containing the following:
+            status: shows whether the function ran successfully
+            data: an iterator of bytes making up the obfuscated file (if successful)
+            format: the file extension of the data (if successful)
+            message: a relevant error message (if unsuccessful)
+    """
+
+    file_extension, compression = split_extension(bucket_path)
+
+    if file_extension == ".parquet" and compression is not None:
+        return {"status": "failure", "message": COMPRESSED_PARQUET_MESSAGE}
+    elif file_extension == ".csv" and engine == "splice" and _uses_hashing(masking):
+        return {
+            "status": "failure",
+            "message": "The splice engine can only mask fields, use the pandas engine to hash them",
+        }
+    elif file_extension == ".csv" and engine == "splice":
+        chunks = load_backend(".csv", engine).iter_spliced_csv_chunks(
+            bucket_path, pii_fields, session, compression=compression
+        )
+    elif file_extension == ".csv":
+        chunks = load_backend(".csv").iter_censored_csv_chunks(
+            bucket_path, pii_fields, session, masking=masking, compression=compression
+        )
+    elif file_extension in JSON_LINES_EXTENSIONS or (
+        file_extension == ".json" and engine == "splice"
+    ):
+        if _uses_hashing(masking):
+            return {"status": "failure", "message": JSON_SPLICE_HASH_MESSAGE}
+        chunks = load_backend(file_extension, "splice").iter_spliced_json_chunks(
+            bucket_path, pii_fields, session, compression=compression
+        )
+    elif file_extension == ".parquet":
+        chunks = load_backend(".parquet").iter_censored_parquet_chunks(
+            bucket_path, pii_fields, session, masking=masking
+        )
+    elif file_extension == ".json":
+        chunks = _iter_in_memory_chunks(bucket_path, pii_fields, session, masking)
+    else:
+        return {
+            "status": "failure",
+            "message": "Unsuported data type. Can only process csv, json, and parquet file types",
+        }
+
+    return {"status": "success", "data": chunks, "format": file_extension}
+
+
+def _iter_in_memory_chunks(
+    bucket_path: str,
+    pii_fields: list,
+    session: boto3.session.Session,
+    masking: dict = None,
+):
+    response = get_obfuscated_bytes(bucket_path, pii_fields, session, masking)
+    if response["status"] == "failure":
+        raise ValueError(response["message"])
+    yield response["data"].getvalue()
+
+
+def _uses_hashing(masking: dict) -> bool:
+    return any(strategy != "mask" for strategy in (masking or {}).values())
+
+
+def _is_arrow_table(data) -> bool:
+    # checked through sys.modules so pandas-only jobs never import pyarrow here
+    return "pyarrow" in sys.modules and isinstance(data, sys.modules["pyarrow"].Table)
@@ -18,7 +18,20 @@ data "archive_file" "transform_lambda_dir_zip" {
 }
 
 locals {
-  source_files_transform = ["${path.module}/../src/transform_lambda/csv_utils.py", "${path.module}/../src/transform_lambda/utils.py", "${path.module}/../src/transform_lambda/json_utils.py", "${path.module}/../src/transform_lambda/parquet_utils.py"]
+  source_files_transform = ["${path.module}/../src/transform_lambda/csv_utils.py", "${path.module}/../src/transform_lambda/utils.py", "${path.module}/../src/transform_lambda/json_utils.py", "${path.module}/../src/transform_lambda/parquet_utils.py", "${path.module}/../src/transform_lambda/s3_utils.py", "${path.module}/../src/transform_lambda/metrics_utils.py", "${path.module}/../src/transform_lambda/csv_splice_utils.py", "${path.module}/../src/transform_lambda/masking_utils.py", "${path.module}/../src/transform_lambda/preflight_utils.py", "${path.module}/../src/transform_lambda/prefix_utils.py", "${path.module}/../src/transform_lambda/idempotency_utils.py", "${path.module}/../src/transform_lambda/compression_utils.py", "${path.module}/../src/transform_lambda/json_splice_utils.py", "${path.module}/../src/transform_lambda/pipeline_utils.py", "${path.module}/../src/transform_lambda/planner_utils.py", "${path.module}/../src/transform_lambda/spill_utils.py", "${path.module}/../src/transform_lambda/storage_utils.py", "${path.module}/../src/transform_lambda/detection_utils.py", "${path.module}/../src/transform_lambda/cache_utils.py", "${path.module}/../src/transform_lambda/profiling_utils.py"]
+}
+
+# packages the AWS SDK for pandas layer does not provide, pinned as in requirements.txt
+locals {
+  layer_packages_transform = ["zstandard==0.23.0"]
+}
+
+resource "terraform_data" "layer_packages_transform" {
+  triggers_replace = local.layer_packages_transform
+
+  provisioner "local-exec" {
+    command = "pip install --target ${path.module}/temp_transform/python --platform manylinux2014_x86_64 --python-version 3.11 --only-binary=:all: --upgrade ${join(" ", local.layer_packages_transform)}"
+  }
 }
 
 data "template_file" "t_file_transform" {
@@ -39,6 +52,7 @@ data "archive_file" "archive_transform" {
 
   depends_on = [
     local_file.to_temp_dir_transform,
+    terraform_data.layer_packages_transform,
   ]
 }
 
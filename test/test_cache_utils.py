@@ -0,0 +1,131 @@
+import pytest
+import boto3
+import io
+import os
+from moto import mock_aws
+from src.transform_lambda.cache_utils import (
+    ResultCache,
+    get_result_cache,
+    cache_filename,
+    upload_cached_file,
+)
+
+
+@pytest.fixture(scope="function")
+def aws_creds():
+    os.environ["AWS_ACCESS_KEY_ID"] = "test"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "test"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture(scope="function")
+def s3_client(aws_creds):
+    with mock_aws():
+        yield boto3.client("s3")
+
+
+@pytest.fixture(scope="function")
+def bucket(s3_client):
+    s3_client.create_bucket(
+        Bucket="ingested-data",
+        CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+    )
+    s3_client.upload_file(Filename="data/dummy_csv.csv", Bucket="ingested-data", Key="dummy.csv")
+    return s3_client
+
+
+def add(cache, filename, size):
+    with open(os.path.join(cache.directory, filename), "wb") as file:
+        file.write(b"x" * size)
+    cache.put(filename)
+
+
+class TestResultCache:
+    def test_hits_and_misses_are_counted(self, tmp_path):
+        cache = ResultCache(str(tmp_path), max_bytes=100)
+        assert cache.open("a.csv") is None
+        add(cache, "a.csv", 10)
+        with cache.open("a.csv") as stream:
+            assert stream.read() == b"x" * 10
+        assert cache.counts() == {"hits": 1, "misses": 1}
+
+    def test_least_recently_used_files_are_evicted(self, tmp_path):
+        cache = ResultCache(str(tmp_path), max_bytes=100)
+        add(cache, "a.csv", 40)
+        add(cache, "b.csv", 40)
+        cache.open("a.csv").close()
+        add(cache, "c.csv", 40)
+        assert list(cache.entries) == ["a.csv", "c.csv"]
+        assert sorted(os.listdir(tmp_path)) == ["a.csv", "c.csv"]
+        assert cache.size() == 80
+
+    def test_file_larger_than_the_cache_is_not_kept(self, tmp_path):
+        cache = ResultCache(str(tmp_path), max_bytes=100)
+        add(cache, "a.csv", 40)
+        add(cache, "b.csv", 101)
+        assert cache.entries == {}
+        assert os.listdir(tmp_path) == []
+
+    def test_evicted_file_can_still_be_read_once_open(self, tmp_path):
+        cache = ResultCache(str(tmp_path), max_bytes=100)
+        add(cache, "a.csv", 60)
+        stream = cache.open("a.csv")
+        add(cache, "b.csv", 60)
+        assert stream.read() == b"x" * 60
+        stream.close()
+
+    def test_discard_only_removes_unregistered_files(self, tmp_path):
+        cache = ResultCache(str(tmp_path), max_bytes=100)
+        add(cache, "a.csv", 10)
+        (tmp_path / "b.csv").write_bytes(b"x")
+        cache.discard("a.csv")
+        cache.discard("b.csv")
+        assert os.listdir(tmp_path) == ["a.csv"]
+
+    def test_existing_files_are_picked_up_oldest_first(self, tmp_path):
+        for age, name in enumerate(["new.csv", "old.csv"]):
+            (tmp_path / name).write_bytes(b"x" * 10)
+            os.utime(tmp_path / name, (1000 - age, 1000 - age))
+        (tmp_path / ".partial.part").write_bytes(b"x")
+        cache = ResultCache(str(tmp_path), max_bytes=100)
+        assert list(cache.entries) == ["old.csv", "new.csv"]
+
+    def test_cache_is_shared_between_invocations(self, tmp_path):
+        config = {"path": str(tmp_path), "max_bytes": 1000}
+        assert get_result_cache(config) is get_result_cache(dict(config))
+        assert get_result_cache(None) is None
+        with pytest.raises(ValueError):
+            get_result_cache({"path": str(tmp_path), "max_bytes": 0})
+
+    def test_cached_file_is_uploaded(self, tmp_path):
+        destination = tmp_path / "output.csv"
+        assert upload_cached_file(io.BytesIO(b"a,b\n1,2\n"), f"file://{destination}", None) == 8
+        assert destination.read_bytes() == b"a,b\n1,2\n"
+
+
+class TestCacheFilename:
+    def job(self, **settings):
+        return {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.csv",
+            **settings,
+        }
+
+    def test_name_follows_source_masking_and_format(self, bucket, tmp_path):
+        cache = ResultCache(str(tmp_path))
+        session = boto3.session.Session()
+        name = cache_filename(self.job(), cache, session)
+        assert name.endswith(".csv")
+        assert cache_filename(self.job(destination="s3://other/copy.csv"), cache, session) == name
+        assert cache_filename(self.job(masking={"email_address": "hash"}), cache, session) != name
+        assert cache_filename(self.job(destination="s3://processed-data/dummy.csv.gz"), cache, session).endswith(".csv.gz")
+
+        bucket.put_object(Bucket="ingested-data", Key="dummy.csv", Body=b"staff_id,email_address\n1,a@b.com\n")
+        assert cache_filename(self.job(), cache, session) != name
+
+    def test_jobs_that_cannot_be_cached(self, bucket, tmp_path):
+        session = boto3.session.Session()
+        assert cache_filename(self.job(file_to_obfuscate="s3://ingested-data/missing.csv"), ResultCache(str(tmp_path)), session) is None
+        assert cache_filename(self.job(file_to_obfuscate="file:///tmp/dummy.csv"), ResultCache(str(tmp_path)), session) is None
+        assert cache_filename(self.job(), ResultCache(str(tmp_path), max_bytes=10), session) is None
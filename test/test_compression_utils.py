@@ -0,0 +1,145 @@
+import pytest
+import boto3
+import bz2
+import gzip
+import io
+import os
+import zstandard
+from moto import mock_aws
+from src.transform_lambda.compression_utils import (
+    split_extension,
+    open_decompressed,
+    open_compressed,
+    read_compressed_object,
+    open_compressed_writer,
+    PrefixedReader,
+)
+
+
+@pytest.fixture(scope="function")
+def aws_creds():
+    os.environ["AWS_ACCESS_KEY_ID"] = "test"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "test"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture(scope="function")
+def s3_client(aws_creds):
+    with mock_aws():
+        yield boto3.client("s3")
+
+
+@pytest.fixture(scope="function")
+def bucket(s3_client):
+    s3_client.create_bucket(
+        Bucket="ingested-data",
+        CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+    )
+    return "ingested-data"
+
+
+class TestSplitExtension:
+    @pytest.mark.parametrize(
+        "path, expected",
+        [
+            ("s3://b/file.csv", (".csv", None)),
+            ("s3://b/file.csv.gz", (".csv", "gzip")),
+            ("s3://b/file.json.bz2", (".json", "bz2")),
+            ("s3://b/dir.v2/file.csv.zst", (".csv", "zstd")),
+            ("s3://b/file.txt", (".txt", None)),
+        ],
+    )
+    def test_compound_extensions_are_split(self, path, expected):
+        assert split_extension(path) == expected
+
+
+class TestCodecs:
+    @pytest.mark.parametrize("codec", ["gzip", "bz2", "zstd"])
+    def test_round_trip(self, codec):
+        sink = io.BytesIO()
+        with open_compressed(sink, codec, level=1) as stream:
+            stream.write(b"a,b\n1,2\n" * 1000)
+        assert not sink.closed
+        sink.seek(0)
+        with open_decompressed(sink, codec) as stream:
+            assert stream.read() == b"a,b\n1,2\n" * 1000
+
+    def test_output_is_readable_by_standard_tools(self):
+        sink = io.BytesIO()
+        with open_compressed(sink, "gzip") as stream:
+            stream.write(b"data")
+        assert gzip.decompress(sink.getvalue()) == b"data"
+        sink = io.BytesIO()
+        with open_compressed(sink, "zstd") as stream:
+            stream.write(b"data")
+        assert zstandard.ZstdDecompressor().decompressobj().decompress(sink.getvalue()) == b"data"
+
+    def test_unknown_codec_raises_value_error(self):
+        with pytest.raises(ValueError):
+            open_compressed(io.BytesIO(), "lzma")
+
+    def test_zstd_needs_zstandard(self, monkeypatch):
+        import importlib
+
+        real_import = importlib.import_module
+
+        def fail_zstandard(name, *args):
+            if name == "zstandard":
+                raise ImportError(name)
+            return real_import(name, *args)
+
+        monkeypatch.setattr(importlib, "import_module", fail_zstandard)
+        with pytest.raises(ValueError, match="zstandard"):
+            open_compressed(io.BytesIO(), "zstd")
+
+
+class TestS3:
+    def test_object_is_parsed_while_decompressing(self, s3_client, bucket):
+        s3_client.put_object(Bucket=bucket, Key="file.csv.bz2", Body=bz2.compress(b"x" * 10_000))
+        session = boto3.session.Session()
+        result = read_compressed_object(
+            "s3://ingested-data/file.csv.bz2", session, lambda stream: len(stream.read()), "bz2"
+        )
+        assert result == 10_000
+
+    def test_zstd_object_is_parsed_while_decompressing(self, s3_client, bucket):
+        body = zstandard.ZstdCompressor().compress(b"x" * 10_000)
+        s3_client.put_object(Bucket=bucket, Key="file.csv.zst", Body=body)
+        session = boto3.session.Session()
+        result = read_compressed_object(
+            "s3://ingested-data/file.csv.zst", session, lambda stream: stream.read(), "zstd"
+        )
+        assert result == b"x" * 10_000
+
+    def test_ranged_download_is_decompressed(self, s3_client, bucket):
+        s3_client.put_object(Bucket=bucket, Key="file.csv.gz", Body=gzip.compress(b"x" * 10_000))
+        session = boto3.session.Session()
+        result = read_compressed_object(
+            "s3://ingested-data/file.csv.gz",
+            session,
+            lambda stream: stream.read(),
+            "gzip",
+            {"part_size": 100},
+        )
+        assert result == b"x" * 10_000
+
+    def test_writer_compresses_upload(self, s3_client, bucket):
+        session = boto3.session.Session()
+        with open_compressed_writer("s3://ingested-data/out.csv.gz", session, "gzip") as writer:
+            writer.write(b"a,b\n")
+        body = s3_client.get_object(Bucket=bucket, Key="out.csv.gz")["Body"].read()
+        assert gzip.decompress(body) == b"a,b\n"
+
+    def test_failed_write_leaves_no_object(self, s3_client, bucket):
+        session = boto3.session.Session()
+        with pytest.raises(RuntimeError):
+            with open_compressed_writer("s3://ingested-data/out.csv.gz", session, "gzip") as writer:
+                writer.write(b"a,b\n")
+                raise RuntimeError("boom")
+        assert "Contents" not in s3_client.list_objects_v2(Bucket=bucket)
+
+
+class TestPrefixedReader:
+    def test_prefix_is_read_before_stream(self):
+        reader = io.BufferedReader(PrefixedReader(b"abc", io.BytesIO(b"def")))
+        assert reader.read() == b"abcdef"
@@ -0,0 +1,125 @@
+import pytest
+import boto3
+import os
+import pandas as pd
+import awswrangler as wr
+from moto import mock_aws
+from src.transform_lambda.csv_splice_utils import CsvSplicer, splice_csv_data
+
+
+@pytest.fixture(scope="function")
+def aws_creds():
+    os.environ["AWS_ACCESS_KEY_ID"] = "test"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "test"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture(scope="function")
+def s3_client(aws_creds):
+    with mock_aws():
+        yield boto3.client("s3")
+
+
+class TestCsvSplicer:
+    def test_splicer_censors_only_pii_fields(self):
+        splicer = CsvSplicer(["email"])
+        data = b"id,email,created_at\n1,a@b.com,2022-11-03 14:20:51.563\n2,c@d.com,1.50\n"
+        result = splicer.feed(data) + splicer.finish()
+        assert result == b"id,email,created_at\n1,***,2022-11-03 14:20:51.563\n2,***,1.50\n"
+
+    def test_splicer_handles_quoted_fields(self):
+        splicer = CsvSplicer(["email", "name, full"])
+        data = (
+            b'id,"name, full",email,notes\r\n'
+            b'1,"Smith, J",a@b.com,"said ""hi""\r\nthen left"\r\n'
+            b'2,Bob,"x@y.com",plain\r\n'
+        )
+        result = splicer.feed(data) + splicer.finish()
+        assert result == (
+            b'id,"name, full",email,notes\r\n'
+            b'1,***,***,"said ""hi""\r\nthen left"\r\n'
+            b"2,***,***,plain\r\n"
+        )
+
+    def test_splicer_output_does_not_depend_on_chunk_boundaries(self):
+        data = (
+            b"id,email,notes\n"
+            b'1,"a@b.com","multi\nline, quoted"\n'
+            b"2,c@d.com,plain\n"
+            b"3,,\n"
+            b'4,"e@f.com",last'
+        )
+        expected = b'id,email,notes\n1,***,"multi\nline, quoted"\n2,***,plain\n3,***,\n4,***,last'
+        for size in range(1, len(data) + 1):
+            splicer = CsvSplicer(["email"])
+            chunks = [data[i : i + size] for i in range(0, len(data), size)]
+            result = b"".join(splicer.feed(chunk) for chunk in chunks) + splicer.finish()
+            assert result == expected
+
+    def test_splicer_matches_pandas_censoring(self):
+        with open("data/dummy_csv.csv", "rb") as f:
+            data = f.read()
+        splicer = CsvSplicer(["first_name", "email_address"])
+        result = splicer.feed(data) + splicer.finish()
+        df = pd.read_csv("data/dummy_csv.csv")
+        df["first_name"] = "***"
+        df["email_address"] = "***"
+        # the source file has no trailing newline, which the splicer preserves
+        assert result == df.to_csv(index=False).encode().rstrip(b"\n")
+
+    def test_splicer_records_missing_fields(self):
+        splicer = CsvSplicer(["email", "phone"])
+        result = splicer.feed(b"id,email\n1,a@b.com\n") + splicer.finish()
+        assert result == b"id,email\n1,***\n"
+        assert splicer.missing_fields == ["phone"]
+
+    def test_unterminated_quote_raises_value_error(self):
+        splicer = CsvSplicer(["email"])
+        splicer.feed(b'id,email\n1,"a@b.com\n')
+        with pytest.raises(ValueError):
+            splicer.finish()
+
+
+class TestSpliceCsv:
+    def test_function_writes_censored_file(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "blackwater-processed-zone"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        s3_client.upload_file(
+            Filename="data/dummy_csv.csv", Bucket=bucket, Key="dummy.csv"
+        )
+        result = splice_csv_data(
+            f"s3://{bucket}/dummy.csv",
+            f"s3://{bucket}/spliced.csv",
+            ["email_address"],
+            session,
+            chunk_size=64,
+        )
+        assert result["status"] == "success"
+        output = wr.s3.read_csv(path=f"s3://{bucket}/spliced.csv")
+        source = pd.read_csv("data/dummy_csv.csv")
+        assert (output["email_address"] == "***").all()
+        assert output["created_at"].tolist() == source["created_at"].tolist()
+
+    def test_missing_source_returns_failure(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "blackwater-processed-zone"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        result = splice_csv_data(
+            f"s3://{bucket}/missing.csv",
+            f"s3://{bucket}/out.csv",
+            ["email"],
+            session,
+        )
+        assert result["status"] == "failure"
+        assert result["message"]["Error"]["Code"] == "NoSuchKey"
@@ -4,7 +4,11 @@ import os
 import pandas as pd
 import awswrangler as wr
 from moto import mock_aws
-from src.transform_lambda.csv_utils import write_csv_data
+from src.transform_lambda.csv_utils import (
+    get_csv_data_from_ingestion_bucket,
+    write_csv_data,
+    stream_csv_data,
+)
 from botocore.exceptions import ClientError
 
 
@@ -21,6 +25,27 @@ def s3_client(aws_creds):
         yield boto3.client("s3")
 
 
+class TestReadcsv:
+    @pytest.mark.parametrize("reader", ["pandas", "pyarrow"])
+    def test_fields_are_read_as_text(self, s3_client, reader):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "blackwater-ingested-zone"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        s3_client.put_object(Bucket=bucket, Key="amounts.csv", Body=b"amount,code,note\n1.50,007,\n")
+        result = get_csv_data_from_ingestion_bucket(
+            f"s3://{bucket}/amounts.csv", session, reader=reader
+        )
+        assert result["data"].to_dict(orient="records") == [
+            {"amount": "1.50", "code": "007", "note": ""}
+        ]
+        assert result["data"].to_csv(index=False) == "amount,code,note\n1.50,007,\n"
+
+
 class TestWritecsv:
     def test_function_writes_to_s3_bucket(self, s3_client):
         session = boto3.session.Session(
@@ -80,3 +105,86 @@ class TestWritecsv:
         result = write_csv_data(df, f"s3://fake_bucket/movie.csv", session)
         assert result["status"] == "failure"
         assert result["message"]["Error"]["Code"] == "NoSuchBucket"
+
+
+class TestStreamCsv:
+    def test_streamed_output_matches_in_memory_output(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "blackwater-processed-zone"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        s3_client.upload_file(
+            Filename="data/dummy_csv.csv", Bucket=bucket, Key="dummy.csv"
+        )
+        df = pd.read_csv("data/dummy_csv.csv")
+        df["email_address"] = "***"
+        write_csv_data(df, f"s3://{bucket}/in_memory.csv", session)
+        result = stream_csv_data(
+            f"s3://{bucket}/dummy.csv",
+            f"s3://{bucket}/streamed.csv",
+            ["email_address"],
+            session,
+            chunksize=3,
+        )
+        assert result["status"] == "success"
+        expected = s3_client.get_object(Bucket=bucket, Key="in_memory.csv")
+        streamed = s3_client.get_object(Bucket=bucket, Key="streamed.csv")
+        assert streamed["Body"].read() == expected["Body"].read()
+
+    def test_large_output_is_uploaded_in_parts(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "blackwater-processed-zone"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        rows = 200_000
+        df = pd.DataFrame(
+            {
+                "id": range(rows),
+                "email": ["someone@example.com"] * rows,
+                "notes": ["a fairly long free text field"] * rows,
+            }
+        )
+        s3_client.put_object(
+            Bucket=bucket, Key="big.csv", Body=df.to_csv(index=False).encode()
+        )
+        result = stream_csv_data(
+            f"s3://{bucket}/big.csv",
+            f"s3://{bucket}/big_out.csv",
+            ["email"],
+            session,
+            chunksize=50_000,
+            part_size=5 * 1024 * 1024,
+        )
+        assert result["status"] == "success"
+        head = s3_client.head_object(Bucket=bucket, Key="big_out.csv")
+        assert "-" in head["ETag"]
+        output = wr.s3.read_csv(path=f"s3://{bucket}/big_out.csv")
+        assert len(output) == rows
+        assert set(output["email"]) == {"***"}
+        assert output["id"].tolist() == list(range(rows))
+
+    def test_missing_source_returns_failure(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "blackwater-processed-zone"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        result = stream_csv_data(
+            f"s3://{bucket}/missing.csv",
+            f"s3://{bucket}/out.csv",
+            ["email"],
+            session,
+        )
+        assert result["status"] == "failure"
+        assert "Contents" not in s3_client.list_objects_v2(Bucket=bucket)
@@ -0,0 +1,161 @@
+import pytest
+import boto3
+import gzip
+import io
+import json
+import os
+import pandas as pd
+from moto import mock_aws
+import src.transform_lambda.detection_utils as detection_utils
+from src.transform_lambda.detection_utils import (
+    detect_pii_fields,
+    match_pii_kinds,
+    luhn_valid,
+    sample_rows,
+)
+from src.transform_lambda.storage_utils import open_object_writer, open_object_stream
+
+
+@pytest.fixture(scope="function")
+def aws_creds():
+    os.environ["AWS_ACCESS_KEY_ID"] = "test"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "test"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture(scope="function")
+def s3_client(aws_creds):
+    with mock_aws():
+        yield boto3.client("s3")
+
+
+@pytest.fixture(scope="function")
+def bucket(s3_client):
+    s3_client.create_bucket(
+        Bucket="ingested-data",
+        CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+    )
+    for filename, key in [
+        ("data/dummy_csv.csv", "dummy.csv"),
+        ("data/dummy_json.json", "dummy.json"),
+        ("data/dummy_parquet.parquet", "dummy.parquet"),
+    ]:
+        s3_client.upload_file(Filename=filename, Bucket="ingested-data", Key=key)
+    return s3_client
+
+
+SAMPLE = pd.DataFrame(
+    {
+        "email": ["jeremie.franey@terrifictotes.com", "a.b@example.co.uk", ""],
+        "card": ["4111 1111 1111 1111", "4242424242424242", "5555-5555-5555-4444"],
+        "not_a_card": ["4111111111111112", "4242424242424241", "5555555555554440"],
+        "national_insurance": ["AB123456C", "JG 10 37 26 A", "ce123456d"],
+        "postcode": ["SW1A 1AA", "M1 1AE", "ec1a1bb"],
+        "phone": ["07700 900123", "+44 7700 900123", "(020) 7946 0958"],
+        "created_at": ["2022-11-03 14:20:51.563"] * 3,
+        "staff_id": ["1", "2", "3"],
+        "first_name": ["Jeremie", "Deron", "Jeanette"],
+    }
+)
+
+
+class TestMatchPiiKinds:
+    def test_each_kind_is_detected(self):
+        assert {name: kind for name, (kind, _) in match_pii_kinds(SAMPLE).items()} == {
+            "email": "email",
+            "card": "card_number",
+            "national_insurance": "national_id",
+            "postcode": "postcode",
+            "phone": "phone_number",
+        }
+
+    def test_empty_values_are_ignored(self):
+        assert match_pii_kinds(SAMPLE)["email"] == ("email", 1.0)
+
+    def test_columns_below_threshold_are_not_detected(self):
+        sample = pd.DataFrame({"notes": ["a@b.com", "call me", "later", "never"]})
+        assert match_pii_kinds(sample) == {}
+        assert match_pii_kinds(sample, threshold=0.25) == {"notes": ("email", 0.25)}
+
+    def test_dates_and_numeric_ids_are_not_phone_numbers(self):
+        sample = pd.DataFrame(
+            {
+                "created": ["2024-01-15", "2023-12-31", "2022-06-01"],
+                "id": ["100001", "100002", "100003"],
+                "account": ["1234567890", "2345678901", "3456789012"],
+                "phone": ["+1 212-555-0187", "212-555-0187", "(212) 555 0187"],
+            }
+        )
+        assert match_pii_kinds(sample) == {"phone": ("phone_number", 1.0)}
+
+    def test_luhn_check_is_vectorized_over_a_column(self):
+        values = pd.Series(["4111 1111 1111 1111", "4111111111111112", "79927398713", ""])
+        assert luhn_valid(values).tolist() == [True, False, False, False]
+
+
+class TestSampleRows:
+    @pytest.mark.parametrize("key", ["dummy.csv", "dummy.json", "dummy.parquet"])
+    def test_sample_holds_first_rows_as_text(self, bucket, key):
+        sample = sample_rows(f"s3://ingested-data/{key}", boto3.session.Session(), rows=5)
+        assert len(sample) == 5
+        assert sample["email_address"].iloc[0] == "jeremie.franey@terrifictotes.com"
+        assert sample["staff_id"].tolist() == ["1", "2", "3", "4", "5"]
+
+    def test_only_the_start_of_a_large_file_is_read(self, monkeypatch):
+        rows = "".join(f"{i},user{i}@example.com\n" for i in range(200_000)).encode()
+        path = "memory://ingested-data/large.csv.gz"
+        with open_object_writer(path) as writer:
+            writer.write(gzip.compress(b"staff_id,email_address\n" + rows))
+        bytes_read = []
+
+        class CountingStream(io.BufferedReader):
+            def read(self, size=-1):
+                data = super().read(size)
+                bytes_read.append(len(data))
+                return data
+
+        monkeypatch.setattr(
+            detection_utils,
+            "open_object_stream",
+            lambda path, session=None: CountingStream(open_object_stream(path, session)),
+        )
+        result = detect_pii_fields(path, None, rows=100)
+        assert result["data"]["fields"] == ["email_address"]
+        assert result["data"]["rows"] == 100
+        assert sum(bytes_read) < len(gzip.compress(rows)) / 2
+
+    def test_newline_delimited_json_is_sampled(self):
+        path = "memory://ingested-data/records.jsonl"
+        with open_object_writer(path) as writer:
+            for i in range(10):
+                record = {"id": i, "contact": {"email": f"user{i}@example.com"}, "email": f"user{i}@example.com"}
+                writer.write(json.dumps(record).encode() + b"\n")
+        result = detect_pii_fields(path, None, rows=3)
+        assert result["data"]["fields"] == ["email"]
+        assert result["data"]["rows"] == 3
+
+    def test_column_oriented_json_fails(self):
+        path = "memory://ingested-data/columns.json"
+        with open_object_writer(path) as writer:
+            writer.write(pd.DataFrame({"email": ["a@b.com"]}).to_json().encode())
+        result = detect_pii_fields(path, None)
+        assert result["status"] == "failure"
+
+
+class TestDetectPiiFields:
+    @pytest.mark.parametrize("key", ["dummy.csv", "dummy.json", "dummy.parquet"])
+    def test_email_address_is_detected(self, bucket, key):
+        result = detect_pii_fields(f"s3://ingested-data/{key}", boto3.session.Session())
+        assert result == {
+            "status": "success",
+            "data": {
+                "fields": ["email_address"],
+                "kinds": {"email_address": "email"},
+                "match_rates": {"email_address": 1.0},
+                "rows": 20,
+            },
+        }
+
+    def test_missing_file_fails(self, bucket):
+        result = detect_pii_fields("s3://ingested-data/missing.csv", boto3.session.Session())
+        assert result["status"] == "failure"
@@ -0,0 +1,762 @@
+import pytest
+import boto3
+import gzip
+import os
+import json
+import subprocess
+import sys
+import tracemalloc
+import pandas as pd
+import awswrangler as wr
+from moto import mock_aws
+from src.transform_lambda.handler import lambda_handler, get_session
+import src.transform_lambda.handler as handler
+import src.transform_lambda.planner_utils as planner_utils
+
+
+@pytest.fixture(scope="function")
+def aws_creds():
+    os.environ["AWS_ACCESS_KEY_ID"] = "test"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "test"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture(scope="function")
+def s3_client(aws_creds):
+    with mock_aws():
+        yield boto3.client("s3")
+
+
+@pytest.fixture(scope="function")
+def buckets(s3_client):
+    for bucket in ["ingested-data", "processed-data"]:
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+    s3_client.upload_file(
+        Filename="data/dummy_csv.csv", Bucket="ingested-data", Key="dummy.csv"
+    )
+    s3_client.upload_file(
+        Filename="data/dummy_json.json", Bucket="ingested-data", Key="dummy.json"
+    )
+    s3_client.upload_file(
+        Filename="data/dummy_parquet.parquet",
+        Bucket="ingested-data",
+        Key="dummy.parquet",
+    )
+    return s3_client
+
+
+class TestSingleFile:
+    def test_handler_obfuscates_file(self, buckets):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.csv",
+        }
+        result = lambda_handler(event, None)
+        assert result["status"] == "success"
+        output = wr.s3.read_csv(path="s3://processed-data/dummy.csv")
+        assert (output["email_address"] == "***").all()
+
+    @pytest.mark.parametrize("streaming", [False, True])
+    def test_handler_obfuscates_compressed_file(self, buckets, streaming):
+        with open("data/dummy_csv.csv", "rb") as f:
+            buckets.put_object(Bucket="ingested-data", Key="dummy.csv.gz", Body=gzip.compress(f.read()))
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv.gz",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.csv.gz",
+            "streaming": streaming,
+            "compression_level": 9,
+        }
+        result = lambda_handler(event, None)
+        assert result["status"] == "success"
+        body = buckets.get_object(Bucket="processed-data", Key="dummy.csv.gz")["Body"].read()
+        assert b"@terrifictotes.com" not in gzip.decompress(body)
+        assert b"***" in gzip.decompress(body)
+
+    def test_handler_rejects_incorrect_input(self, buckets):
+        result = lambda_handler({"pii_fields": ["email_address"]}, None)
+        assert result == {"status": "failure", "message": "json input is incorrect"}
+
+    def test_missing_field_fails_before_download(self, buckets, s3_client):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address", "phone_number"],
+            "destination": "s3://processed-data/dummy.csv",
+        }
+        result = lambda_handler(event, None)
+        assert result == {"status": "failure", "message": "phone_number not in data set"}
+        assert "Contents" not in s3_client.list_objects_v2(Bucket="processed-data")
+
+    def test_preflight_can_be_turned_off(self, buckets):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address", "phone_number"],
+            "destination": "s3://processed-data/dummy.csv",
+            "preflight": False,
+        }
+        assert lambda_handler(event, None)["status"] == "success"
+
+    def test_handler_obfuscates_file_with_arrow(self, buckets):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.parquet",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.parquet",
+            "use_arrow": True,
+        }
+        result = lambda_handler(event, None)
+        assert result["status"] == "success"
+        output = wr.s3.read_parquet(path="s3://processed-data/dummy.parquet")
+        assert (output["email_address"] == "***").all()
+
+    def test_hashed_tokens_match_between_in_memory_and_streaming(self, buckets, monkeypatch):
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "test-key")
+        for streaming in [False, True]:
+            event = {
+                "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+                "pii_fields": ["email_address", "first_name"],
+                "destination": f"s3://processed-data/hashed_{streaming}.csv",
+                "masking": {"email_address": "hash"},
+                "streaming": streaming,
+            }
+            assert lambda_handler(event, None)["status"] == "success"
+        in_memory = wr.s3.read_csv(path="s3://processed-data/hashed_False.csv")
+        streamed = wr.s3.read_csv(path="s3://processed-data/hashed_True.csv")
+        source = wr.s3.read_csv(path="s3://ingested-data/dummy.csv")
+        assert in_memory["email_address"].equals(streamed["email_address"])
+        assert not in_memory["email_address"].isin(source["email_address"]).any()
+        assert (streamed["first_name"] == "***").all()
+
+
+    def test_pyarrow_reader_hashes_pii_fields_as_text(self, buckets, monkeypatch):
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "test-key")
+        for reader, streaming in [("pyarrow", False), ("pandas", True)]:
+            event = {
+                "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+                "pii_fields": ["staff_id"],
+                "destination": f"s3://processed-data/{reader}.csv",
+                "masking": {"staff_id": "hash"},
+                "reader": reader,
+                "streaming": streaming,
+            }
+            assert lambda_handler(event, None)["status"] == "success"
+        in_memory = wr.s3.read_csv(path="s3://processed-data/pyarrow.csv")
+        streamed = wr.s3.read_csv(path="s3://processed-data/pandas.csv")
+        assert in_memory.equals(streamed)
+
+    @pytest.mark.parametrize("source", ["data/dummy_csv.csv", "data/dummy_parquet.parquet"])
+    @pytest.mark.parametrize("streaming", [None, True])
+    def test_handler_obfuscates_local_file(self, aws_creds, tmp_path, source, streaming):
+        extension = os.path.splitext(source)[1]
+        event = {
+            "file_to_obfuscate": f"file://{os.path.abspath(source)}",
+            "pii_fields": ["email_address"],
+            "destination": f"file://{tmp_path}/output{extension}",
+            "streaming": streaming,
+            "metrics": True,
+        }
+        result = lambda_handler(event, None)
+        assert result["status"] == "success"
+        stage = "stream_sensitive_data" if streaming else "write_sensitive_data"
+        assert result["metrics"][stage]["bytes_out"] > 0
+        output = (pd.read_csv if extension == ".csv" else pd.read_parquet)(tmp_path / f"output{extension}")
+        assert (output["email_address"] == "***").all()
+
+class TestDetectPii:
+    def test_detected_fields_are_masked(self, buckets):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "destination": "s3://processed-data/dummy.csv",
+            "detect_pii": True,
+        }
+        result = lambda_handler(event, None)
+        assert result["status"] == "success"
+        assert result["detected_pii"]["fields"] == ["email_address"]
+        output = wr.s3.read_csv(path="s3://processed-data/dummy.csv")
+        assert (output["email_address"] == "***").all()
+
+    def test_detected_fields_are_added_to_pii_fields(self, buckets):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.json",
+            "pii_fields": ["first_name"],
+            "destination": "s3://processed-data/dummy.json",
+            "detect_pii": True,
+            "detect_pii_rows": 5,
+        }
+        result = lambda_handler(event, None)
+        assert result["status"] == "success"
+        assert result["detected_pii"]["rows"] == 5
+        output = wr.s3.read_json(path="s3://processed-data/dummy.json")
+        assert (output["email_address"] == "***").all()
+        assert (output["first_name"] == "***").all()
+
+    def test_report_writes_nothing(self, buckets, s3_client, tmp_path):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.parquet",
+            "destination": "s3://processed-data/dummy.parquet",
+            "detect_pii": "report",
+            "idempotency": {"path": str(tmp_path / "idempotency.db")},
+        }
+        result = lambda_handler(event, None)
+        assert result == {
+            "status": "success",
+            "message": "1 pii fields detected",
+            "detected_pii": {
+                "fields": ["email_address"],
+                "kinds": {"email_address": "email"},
+                "match_rates": {"email_address": 1.0},
+                "rows": 20,
+            },
+        }
+        assert "Contents" not in s3_client.list_objects_v2(Bucket="processed-data")
+
+
+class TestPlanning:
+    def test_small_file_is_processed_in_memory(self, buckets):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.csv",
+        }
+        result = lambda_handler(event, None)
+        assert result["status"] == "success"
+        assert result["plan"]["mode"] == "in_memory"
+        assert result["plan"]["size"] == os.path.getsize("data/dummy_csv.csv")
+
+    def test_file_too_large_for_memory_is_streamed(self, buckets, monkeypatch):
+        monkeypatch.setattr(planner_utils, "available_memory", lambda: 100 * 1024 * 1024)
+        monkeypatch.setattr(planner_utils, "PANDAS_EXPANSION", {".csv": 1_000_000.0})
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.csv",
+            "metrics": True,
+        }
+        result = lambda_handler(event, None)
+        assert result["status"] == "success"
+        assert result["plan"]["mode"] == "streaming"
+        assert "stream_sensitive_data" in result["metrics"]
+        output = wr.s3.read_csv(path="s3://processed-data/dummy.csv")
+        assert (output["email_address"] == "***").all()
+
+    def test_arrow_file_too_large_for_memory_is_spilled(self, buckets, monkeypatch):
+        monkeypatch.setattr(planner_utils, "available_memory", lambda: 100 * 1024 * 1024)
+        monkeypatch.setattr(planner_utils, "ARROW_EXPANSION", {".parquet": 1_000_000.0})
+        monkeypatch.setattr(planner_utils, "available_disk", lambda: 1 << 50)
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.parquet",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.parquet",
+            "use_arrow": True,
+            "metrics": True,
+        }
+        result = lambda_handler(event, None)
+        assert result["status"] == "success"
+        assert result["plan"]["mode"] == "spill"
+        assert result["metrics"]["spill_sensitive_data"]["bytes_out"] > 0
+        output = wr.s3.read_parquet(path="s3://processed-data/dummy.parquet")
+        assert (output["email_address"] == "***").all()
+
+    @pytest.mark.parametrize(
+        "key,settings",
+        [
+            ("dummy.csv", {}),
+            ("dummy.csv", {"reader": "pyarrow", "masking": {"email_address": "hash"}}),
+            ("dummy.csv", {"use_arrow": True}),
+            ("dummy.json", {"use_arrow": True}),
+            ("dummy.parquet", {"use_arrow": True}),
+        ],
+    )
+    def test_output_does_not_depend_on_the_planned_mode(self, buckets, monkeypatch, key, settings):
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "secret")
+        event = {
+            "file_to_obfuscate": f"s3://ingested-data/{key}",
+            "pii_fields": ["email_address"],
+            "destination": f"s3://processed-data/{key}",
+            **settings,
+        }
+        assert lambda_handler(event, None)["plan"]["mode"] == "in_memory"
+        in_memory = buckets.get_object(Bucket="processed-data", Key=key)["Body"].read()
+
+        monkeypatch.setattr(planner_utils, "available_memory", lambda: 100 * 1024 * 1024)
+        monkeypatch.setattr(planner_utils, "PANDAS_EXPANSION", {".csv": 1_000_000.0})
+        monkeypatch.setattr(planner_utils, "ARROW_EXPANSION", dict.fromkeys([".csv", ".json", ".parquet"], 1_000_000.0))
+        monkeypatch.setattr(planner_utils, "available_disk", lambda: 1 << 50)
+        assert lambda_handler(event, None)["plan"]["mode"] != "in_memory"
+        assert buckets.get_object(Bucket="processed-data", Key=key)["Body"].read() == in_memory
+
+    @pytest.mark.parametrize(
+        "key,body,modes",
+        [
+            (
+                "phones.csv",
+                b"id,phone\n1,07700900123\n2,07700900123\n",
+                [{}, {"streaming": True}, {"reader": "pyarrow"}, {"use_arrow": True}],
+            ),
+            (
+                "phones.json",
+                b'[{"id":1,"phone":"07700900123"},{"id":2,"phone":"07700900123"}]',
+                [{}, {"reader": "pyarrow"}, {"use_arrow": True}, {"use_arrow": True, "spill": True}],
+            ),
+        ],
+    )
+    def test_hash_tokens_do_not_depend_on_the_mode(self, buckets, monkeypatch, key, body, modes):
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "secret")
+        buckets.put_object(Bucket="ingested-data", Key=key, Body=body)
+        tokens = []
+        for settings in modes:
+            event = {
+                "file_to_obfuscate": f"s3://ingested-data/{key}",
+                "pii_fields": ["phone"],
+                "masking": {"phone": "hash"},
+                "destination": f"s3://processed-data/{key}",
+                **settings,
+            }
+            assert lambda_handler(event, None)["status"] == "success"
+            if key.endswith(".csv"):
+                output = wr.s3.read_csv(path=f"s3://processed-data/{key}", dtype=str)
+            else:
+                output = wr.s3.read_json(path=f"s3://processed-data/{key}", dtype=str)
+            tokens.append(output["phone"].tolist())
+        assert tokens[0][0] == tokens[0][1]
+        assert all(mode_tokens == tokens[0] for mode_tokens in tokens)
+
+    def test_file_too_large_fails_rather_than_changing_its_output(self, buckets, monkeypatch):
+        monkeypatch.setattr(planner_utils, "available_memory", lambda: 100 * 1024 * 1024)
+        monkeypatch.setattr(planner_utils, "PANDAS_EXPANSION", {".json": 1_000_000.0})
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.json",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.json",
+        }
+        result = lambda_handler(event, None)
+        assert result["status"] == "failure"
+        assert "set streaming or spill in the job to allow it" in result["message"]
+        assert "Contents" not in buckets.list_objects_v2(Bucket="processed-data")
+
+    def test_explicit_streaming_setting_skips_planning(self, buckets):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.csv",
+            "streaming": False,
+        }
+        result = lambda_handler(event, None)
+        assert result["status"] == "success"
+        assert "plan" not in result
+
+
+class TestMetrics:
+    def test_metrics_are_returned_and_logged(self, buckets, capsys):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.csv",
+            "metrics": True,
+        }
+        result = lambda_handler(event, None)
+        assert result["status"] == "success"
+        metrics = result["metrics"]
+        assert list(metrics) == [
+            "preflight_check",
+            "plan_execution",
+            "get_data_from_bucket",
+            "censor_sensitive_data",
+            "write_sensitive_data",
+        ]
+        assert metrics["get_data_from_bucket"]["bytes_in"] == os.path.getsize(
+            "data/dummy_csv.csv"
+        )
+        assert metrics["get_data_from_bucket"]["rows"] == 20
+        assert metrics["write_sensitive_data"]["bytes_out"] > 0
+        lines = [
+            json.loads(line)
+            for line in capsys.readouterr().out.splitlines()
+            if line.startswith("{")
+        ]
+        assert [line["Stage"] for line in lines] == list(metrics)
+        assert all(line["Format"] == ".csv" for line in lines)
+
+    def test_streaming_metrics_record_bytes_in_and_out(self, buckets):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.csv",
+            "streaming": True,
+            "metrics": True,
+        }
+        result = lambda_handler(event, None)
+        stage = result["metrics"]["stream_sensitive_data"]
+        assert stage["bytes_in"] == os.path.getsize("data/dummy_csv.csv")
+        assert stage["bytes_out"] > 0
+
+    def test_metrics_are_off_by_default(self, buckets, capsys):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.csv",
+        }
+        result = lambda_handler(event, None)
+        assert "metrics" not in result
+        assert "_aws" not in capsys.readouterr().out
+
+
+class TestProfile:
+    def test_profile_is_written_for_each_stage(self, buckets, s3_client):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.csv",
+            "profile": {"destination": "s3://processed-data/profiles"},
+        }
+        result = lambda_handler(event, None)
+        assert result["status"] == "success"
+        assert "metrics" not in result
+        paths = result["profile"]["data"]
+        names = {path.rsplit("/", 1)[1] for path in paths}
+        assert {"get_data_from_bucket.pstats", "censor_sensitive_data.allocations.json"} <= names
+        keys = [item["Key"] for item in s3_client.list_objects_v2(Bucket="processed-data", Prefix="profiles/")["Contents"]]
+        assert sorted(f"s3://processed-data/{key}" for key in keys) == sorted(paths)
+        assert keys[0].startswith("profiles/dummy.csv-")
+
+    def test_profiled_batch_shares_tracemalloc_between_threads(self, buckets):
+        event = {
+            "pii_fields": ["email_address"],
+            "profile": {"profilers": ["tracemalloc"], "destination": "memory://profiles"},
+            "files": [
+                {
+                    "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+                    "destination": f"s3://processed-data/{i}/dummy.csv",
+                }
+                for i in range(8)
+            ],
+        }
+        result = lambda_handler(event, None)
+        assert result["message"] == "8 of 8 files obfuscated"
+        assert all(r["profile"]["status"] == "success" for r in result["results"])
+        assert not tracemalloc.is_tracing()
+
+    def test_profile_is_off_by_default(self, buckets):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.csv",
+        }
+        result = lambda_handler(event, None)
+        assert "profile" not in result
+        assert not tracemalloc.is_tracing()
+
+    def test_profile_without_destination_fails(self, buckets, monkeypatch):
+        monkeypatch.delenv("OBFUSCATOR_PROFILE_DESTINATION", raising=False)
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.csv",
+            "profile": True,
+        }
+        assert lambda_handler(event, None)["status"] == "failure"
+
+    def test_malformed_profile_is_rejected(self, buckets):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.csv",
+            "profile": "cprofile",
+        }
+        assert lambda_handler(event, None) == {
+            "status": "failure",
+            "message": "profile must be true or a dictionary of profilers, top and destination",
+        }
+
+
+class TestBatch:
+    def test_handler_obfuscates_every_file(self, buckets):
+        event = {
+            "pii_fields": ["email_address"],
+            "files": [
+                {
+                    "file_to_obfuscate": f"s3://ingested-data/dummy.{extension}",
+                    "destination": f"s3://processed-data/dummy.{extension}",
+                }
+                for extension in ["csv", "json", "parquet"]
+            ],
+        }
+        result = lambda_handler(event, None)
+        assert result["status"] == "success"
+        assert result["message"] == "3 of 3 files obfuscated"
+        assert [r["file_to_obfuscate"] for r in result["results"]] == [
+            "s3://ingested-data/dummy.csv",
+            "s3://ingested-data/dummy.json",
+            "s3://ingested-data/dummy.parquet",
+        ]
+        keys = buckets.list_objects_v2(Bucket="processed-data")["Contents"]
+        assert len(keys) == 3
+
+    def test_job_settings_override_batch_defaults(self, buckets):
+        event = {
+            "pii_fields": ["email_address"],
+            "max_workers": 2,
+            "files": [
+                {
+                    "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+                    "destination": "s3://processed-data/first.csv",
+                },
+                {
+                    "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+                    "pii_fields": ["first_name"],
+                    "destination": "s3://processed-data/second.csv",
+                    "streaming": True,
+                },
+            ],
+        }
+        result = lambda_handler(event, None)
+        assert result["status"] == "success"
+        first = wr.s3.read_csv(path="s3://processed-data/first.csv")
+        second = wr.s3.read_csv(path="s3://processed-data/second.csv")
+        assert (first["email_address"] == "***").all()
+        assert (first["first_name"] != "***").all()
+        assert (second["first_name"] == "***").all()
+        assert (second["email_address"] != "***").all()
+
+    def test_failures_are_reported_per_file(self, buckets):
+        event = {
+            "pii_fields": ["email_address"],
+            "files": [
+                {
+                    "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+                    "destination": "s3://processed-data/dummy.csv",
+                },
+                {
+                    "file_to_obfuscate": "s3://ingested-data/dummy.txt",
+                    "destination": "s3://processed-data/dummy.txt",
+                },
+                {"file_to_obfuscate": "s3://ingested-data/dummy.json"},
+            ],
+        }
+        result = lambda_handler(event, None)
+        assert result["status"] == "failure"
+        assert result["message"] == "1 of 3 files obfuscated"
+        statuses = [r["status"] for r in result["results"]]
+        assert statuses == ["success", "failure", "failure"]
+        assert result["results"][2]["message"] == "json input is incorrect"
+
+    @pytest.mark.parametrize("max_workers", [0, -1])
+    def test_batch_needs_at_least_one_worker(self, buckets, max_workers):
+        event = {
+            "pii_fields": ["email_address"],
+            "files": [
+                {
+                    "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+                    "destination": "s3://processed-data/dummy.csv",
+                }
+            ],
+            "max_workers": max_workers,
+        }
+        result = lambda_handler(event, None)
+        assert result == {"status": "failure", "message": "max_workers must be at least 1"}
+
+
+class TestColdStart:
+    def test_importing_handler_does_not_load_format_libraries(self):
+        code = (
+            "import sys, src.transform_lambda.handler; "
+            "print(sorted(m for m in ['pandas', 'awswrangler', 'pyarrow'] if m in sys.modules))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        assert result.stdout.strip() == "[]"
+
+    def test_session_is_reused_between_invocations(self, buckets):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.csv",
+        }
+        session = get_session()
+        assert lambda_handler(event, None)["status"] == "success"
+        assert lambda_handler(event, None)["status"] == "success"
+        assert get_session() is session
+
+
+class TestIdempotency:
+    def test_second_invocation_is_skipped(self, buckets, s3_client, tmp_path):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.csv",
+            "idempotency": {"path": str(tmp_path / "idempotency.db")},
+        }
+        assert lambda_handler(event, None)["status"] == "success"
+        modified = s3_client.head_object(Bucket="processed-data", Key="dummy.csv")["LastModified"]
+
+        result = lambda_handler(event, None)
+        assert result == {
+            "status": "success",
+            "message": "s3://processed-data/dummy.csv already obfuscated",
+        }
+        assert s3_client.head_object(Bucket="processed-data", Key="dummy.csv")["LastModified"] == modified
+
+    def test_local_destination_skips_idempotency(self, buckets, tmp_path):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": f"file://{tmp_path}/dummy.csv",
+            "idempotency": {"path": str(tmp_path / "idempotency.db")},
+        }
+        for _ in range(2):
+            result = lambda_handler(event, None)
+            assert result["status"] == "success"
+            assert result["message"] == f"csv written to file://{tmp_path}/dummy.csv"
+        assert (pd.read_csv(tmp_path / "dummy.csv")["email_address"] == "***").all()
+
+    def test_changed_settings_run_again(self, buckets, tmp_path):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.csv",
+            "idempotency": {"path": str(tmp_path / "idempotency.db")},
+        }
+        assert lambda_handler(event, None)["status"] == "success"
+        event["pii_fields"] = ["email_address", "first_name"]
+        result = lambda_handler(event, None)
+        assert result["status"] == "success"
+        assert "already obfuscated" not in result["message"]
+        output = wr.s3.read_csv(path="s3://processed-data/dummy.csv")
+        assert (output["first_name"] == "***").all()
+
+
+class TestResultCache:
+    def test_second_invocation_is_served_from_cache(self, buckets, tmp_path, monkeypatch):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/first.csv",
+            "cache": {"path": str(tmp_path)},
+        }
+        first = lambda_handler(event, None)
+        assert first["status"] == "success"
+        assert first["message"] == "csv written to s3://processed-data/first.csv"
+        assert first["cache"] == {"hit": False, "hits": 0, "misses": 1}
+
+        monkeypatch.setattr(handler, "run_pipeline", None)
+        second = lambda_handler({**event, "destination": "s3://processed-data/second.csv"}, None)
+        assert second == {
+            "status": "success",
+            "message": "s3://processed-data/second.csv written from cache",
+            "cache": {"hit": True, "hits": 1, "misses": 1},
+        }
+        first_output = wr.s3.read_csv(path="s3://processed-data/first.csv")
+        assert first_output.equals(wr.s3.read_csv(path="s3://processed-data/second.csv"))
+        assert (first_output["email_address"] == "***").all()
+
+    def test_changed_masking_misses(self, buckets, tmp_path, monkeypatch):
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "test-key")
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.parquet",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.parquet",
+            "cache": {"path": str(tmp_path)},
+        }
+        assert lambda_handler(event, None)["cache"]["hit"] is False
+        result = lambda_handler({**event, "masking": {"email_address": "hash"}}, None)
+        assert result["cache"] == {"hit": False, "hits": 0, "misses": 2}
+        assert len(os.listdir(tmp_path)) == 2
+
+    def test_failed_upload_leaves_nothing_in_cache(self, buckets, tmp_path, monkeypatch):
+        def failing_upload(stream, destination, session):
+            stream.close()
+            raise OSError("upload failed")
+
+        monkeypatch.setattr(handler, "upload_cached_file", failing_upload)
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.csv",
+            "cache": {"path": str(tmp_path)},
+        }
+        assert lambda_handler(event, None) == {"status": "failure", "message": "unexpected error"}
+        assert os.listdir(tmp_path) == []
+
+    def test_cached_jobs_are_recorded_for_idempotency(self, buckets, tmp_path):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.csv",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.csv",
+            "cache": {"path": str(tmp_path / "cache")},
+            "idempotency": {"path": str(tmp_path / "idempotency.db")},
+        }
+        assert lambda_handler(event, None)["cache"]["hit"] is False
+        assert lambda_handler(event, None) == {
+            "status": "success",
+            "message": "s3://processed-data/dummy.csv already obfuscated",
+        }
+
+    def test_outputs_over_budget_are_evicted(self, buckets, tmp_path):
+        event = {
+            "file_to_obfuscate": "s3://ingested-data/dummy.json",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/dummy.json",
+            # room for two of the three outputs below
+            "cache": {"path": str(tmp_path), "max_bytes": 8000},
+            "metrics": True,
+        }
+        first = lambda_handler(event, None)
+        assert first["metrics"]["cache_upload"]["bytes_out"] > 0
+        for pii_fields in [["first_name"], ["first_name", "email_address"]]:
+            assert lambda_handler({**event, "pii_fields": pii_fields}, None)["status"] == "success"
+        assert len(os.listdir(tmp_path)) == 2
+        assert lambda_handler(event, None)["cache"]["hit"] is False
+
+
+class TestPrefix:
+    def test_prefix_event_obfuscates_every_file(self, buckets, s3_client):
+        event = {
+            "prefix_to_obfuscate": "s3://ingested-data/",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/out/",
+            "max_workers": 2,
+        }
+        result = lambda_handler(event, None)
+        assert result["message"] == "3 of 3 files obfuscated, 0 already obfuscated"
+        output = wr.s3.read_json(path="s3://processed-data/out/dummy.json")
+        assert (output["email_address"] == "***").all()
+        assert lambda_handler(event, None)["message"] == (
+            "0 of 0 files obfuscated, 3 already obfuscated"
+        )
+
+    def test_queued_shards_are_run_from_sqs_records(self, buckets):
+        sqs = boto3.client("sqs")
+        queue_url = sqs.create_queue(QueueName="obfuscator")["QueueUrl"]
+        event = {
+            "prefix_to_obfuscate": "s3://ingested-data/",
+            "pii_fields": ["email_address"],
+            "destination": "s3://processed-data/out/",
+            "queue_url": queue_url,
+        }
+        assert lambda_handler(event, None)["status"] == "success"
+        messages = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10)["Messages"]
+        records = [{"eventSource": "aws:sqs", "body": m["Body"]} for m in messages]
+        result = lambda_handler({"Records": records}, None)
+        assert result["message"] == "3 of 3 files obfuscated, 0 already obfuscated"
+
+    def test_prefix_event_without_pii_fields_is_rejected(self, buckets):
+        event = {
+            "prefix_to_obfuscate": "s3://ingested-data/",
+            "destination": "s3://processed-data/out/",
+        }
+        result = lambda_handler(event, None)
+        assert result == {"status": "failure", "message": "json input is incorrect"}
+
+    def test_prefix_event_needs_at_least_one_worker(self, buckets):
+        event = {
+            "prefix_to_obfuscate": "s3://ingested-data/",
+            "destination": "s3://processed-data/out/",
+            "pii_fields": ["email_address"],
+            "max_workers": 0,
+        }
+        result = lambda_handler(event, None)
+        assert result == {"status": "failure", "message": "max_workers must be at least 1"}
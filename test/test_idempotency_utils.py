@@ -0,0 +1,155 @@
+import pytest
+import boto3
+import os
+from moto import mock_aws
+from src.transform_lambda.idempotency_utils import (
+    IdempotencyStore,
+    SqliteIdempotencyStore,
+    DynamoDbIdempotencyStore,
+    get_idempotency_store,
+    idempotency_key,
+    check_idempotency,
+    record_idempotency,
+)
+
+
+@pytest.fixture(scope="function")
+def aws_creds():
+    os.environ["AWS_ACCESS_KEY_ID"] = "test"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "test"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture(scope="function")
+def s3_client(aws_creds):
+    with mock_aws():
+        yield boto3.client("s3")
+
+
+@pytest.fixture(scope="function")
+def buckets(s3_client):
+    for bucket in ["ingested-data", "processed-data"]:
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+    s3_client.put_object(Bucket="ingested-data", Key="file.csv", Body=b"id,name\n1,a\n")
+    s3_client.put_object(Bucket="processed-data", Key="file.csv", Body=b"id,name\n1,***\n")
+    return s3_client
+
+
+@pytest.fixture(scope="function")
+def dynamodb_table(s3_client):
+    client = boto3.client("dynamodb")
+    client.create_table(
+        TableName="idempotency",
+        KeySchema=[{"AttributeName": "idempotency_key", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "idempotency_key", "AttributeType": "S"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    return "idempotency"
+
+
+@pytest.fixture(scope="function")
+def job():
+    return {
+        "file_to_obfuscate": "s3://ingested-data/file.csv",
+        "pii_fields": ["name"],
+        "destination": "s3://processed-data/file.csv",
+    }
+
+
+class TestStores:
+    def test_sqlite_store_round_trips_records(self, tmp_path):
+        store = SqliteIdempotencyStore(str(tmp_path / "idempotency.db"))
+        assert store.get("key") is None
+        store.put("key", {"destination": "s3://b/k"}, ttl_seconds=60)
+        assert store.get("key") == {"destination": "s3://b/k"}
+
+    def test_sqlite_store_ignores_expired_records(self, tmp_path):
+        store = SqliteIdempotencyStore(str(tmp_path / "idempotency.db"))
+        store.put("key", {"destination": "s3://b/k"}, ttl_seconds=-1)
+        assert store.get("key") is None
+
+    def test_dynamodb_store_round_trips_records(self, dynamodb_table):
+        store = DynamoDbIdempotencyStore(dynamodb_table, boto3.session.Session())
+        assert store.get("key") is None
+        store.put("key", {"destination": "s3://b/k"}, ttl_seconds=60)
+        assert store.get("key") == {"destination": "s3://b/k"}
+        store.put("expired", {"destination": "s3://b/k"}, ttl_seconds=-10)
+        assert store.get("expired") is None
+
+    def test_stores_are_reused(self, tmp_path):
+        session = boto3.session.Session()
+        config = {"store": "sqlite", "path": str(tmp_path / "idempotency.db")}
+        assert get_idempotency_store(config, session) is get_idempotency_store(config, session)
+        assert get_idempotency_store(None, session) is None
+
+    def test_unknown_store_is_rejected(self):
+        with pytest.raises(ValueError):
+            get_idempotency_store({"store": "redis"}, boto3.session.Session())
+
+    def test_store_missing_a_method_cannot_be_created(self):
+        class WriteOnlyStore(IdempotencyStore):
+            def put(self, key, record, ttl_seconds=0):
+                pass
+
+        with pytest.raises(TypeError):
+            WriteOnlyStore()
+
+
+class TestIdempotencyKey:
+    def test_key_ignores_field_order_and_source_path(self, job):
+        job["pii_fields"] = ["name", "id"]
+        other = dict(job, file_to_obfuscate="s3://elsewhere/copy.csv", pii_fields=["id", "name"])
+        assert idempotency_key('"etag"', job) == idempotency_key('"etag"', other)
+
+    def test_key_changes_with_content_and_settings(self, job):
+        key = idempotency_key('"etag"', job)
+        assert idempotency_key('"other"', job) != key
+        assert idempotency_key('"etag"', dict(job, pii_fields=["id"])) != key
+        assert idempotency_key('"etag"', dict(job, destination="s3://b/file.json")) != key
+        assert idempotency_key('"etag"', dict(job, streaming=True)) != key
+
+    def test_key_changes_with_hmac_key(self, job, monkeypatch):
+        job["masking"] = {"name": "hash"}
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "one")
+        key = idempotency_key('"etag"', job)
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "two")
+        assert idempotency_key('"etag"', job) != key
+
+
+class TestCheckIdempotency:
+    def test_unseen_job_has_to_run(self, buckets, job, tmp_path):
+        store = SqliteIdempotencyStore(str(tmp_path / "idempotency.db"))
+        key, response = check_idempotency(job, store, boto3.session.Session())
+        assert key is not None
+        assert response is None
+
+    def test_recorded_job_is_skipped(self, buckets, job, tmp_path):
+        session = boto3.session.Session()
+        store = SqliteIdempotencyStore(str(tmp_path / "idempotency.db"))
+        key, _ = check_idempotency(job, store, session)
+        record_idempotency(key, job, store, session)
+        assert check_idempotency(job, store, session) == (
+            key,
+            {"status": "success", "message": "s3://processed-data/file.csv already obfuscated"},
+        )
+
+    def test_changed_output_is_written_again(self, buckets, job, tmp_path):
+        session = boto3.session.Session()
+        store = SqliteIdempotencyStore(str(tmp_path / "idempotency.db"))
+        key, _ = check_idempotency(job, store, session)
+        record_idempotency(key, job, store, session)
+        buckets.put_object(Bucket="processed-data", Key="file.csv", Body=b"tampered")
+        assert check_idempotency(job, store, session) == (key, None)
+
+    def test_output_is_copied_to_a_new_destination(self, buckets, job, tmp_path):
+        session = boto3.session.Session()
+        store = SqliteIdempotencyStore(str(tmp_path / "idempotency.db"))
+        key, _ = check_idempotency(job, store, session)
+        record_idempotency(key, job, store, session)
+        _, response = check_idempotency(dict(job, destination="s3://processed-data/copy.csv"), store, session)
+        assert response["status"] == "success"
+        body = buckets.get_object(Bucket="processed-data", Key="copy.csv")["Body"].read()
+        assert body == b"id,name\n1,***\n"
@@ -0,0 +1,167 @@
+import pytest
+import boto3
+import gzip
+import json
+import os
+from moto import mock_aws
+from src.transform_lambda.json_splice_utils import (
+    JsonSplicer,
+    split_json_path,
+    parse_json_paths,
+    mask_json_path,
+    splice_json_data,
+)
+
+
+@pytest.fixture(scope="function")
+def aws_creds():
+    os.environ["AWS_ACCESS_KEY_ID"] = "test"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "test"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture(scope="function")
+def s3_client(aws_creds):
+    with mock_aws():
+        yield boto3.client("s3")
+
+
+RECORDS = [
+    {
+        "id": 1,
+        "customer": {"name": "Ann", "contact": {"email": "ann@x.com", "phone": 123}},
+        "orders": [{"card_number": 4111, "note": "a \"quoted\" ]} note"}, {"card_number": None}],
+    },
+    {"id": 2, "customer": {"contact": {"email": {"work": "w@x.com"}}}, "orders": []},
+    {"id": 3, "customer": "unknown"},
+]
+
+
+class TestJsonPaths:
+    def test_paths_are_split_into_keys(self):
+        assert split_json_path("email") == ["email"]
+        assert split_json_path("customer.contact.email") == ["customer", "contact", "email"]
+        assert split_json_path("orders[].card_number") == ["orders", "[]", "card_number"]
+        assert split_json_path("matrix[][]") == ["matrix", "[]", "[]"]
+
+    def test_shorter_path_masks_whole_subtree(self):
+        paths = parse_json_paths(["customer.contact.email", "customer.contact"])
+        assert paths == {"customer": {"contact": "customer.contact"}}
+
+    def test_in_memory_values_are_masked_along_path(self):
+        value = {"contact": {"email": "a@b.com"}, "cards": [{"n": 1}, {"n": 2}]}
+        assert mask_json_path(value, ["contact", "email"]) == {
+            "contact": {"email": "***"},
+            "cards": [{"n": 1}, {"n": 2}],
+        }
+        assert mask_json_path(value, ["cards", "[]", "n"])["cards"] == [{"n": "***"}, {"n": "***"}]
+        assert mask_json_path("plain", ["contact", "email"]) == "plain"
+
+
+class TestJsonSplicer:
+    def test_splicer_masks_only_pii_paths(self):
+        splicer = JsonSplicer(["customer.contact.email", "orders[].card_number"])
+        data = json.dumps(RECORDS).encode()
+        result = json.loads(splicer.feed(data) + splicer.finish())
+        expected = json.loads(data)
+        expected[0]["customer"]["contact"]["email"] = "***"
+        expected[0]["orders"][0]["card_number"] = "***"
+        expected[0]["orders"][1]["card_number"] = "***"
+        expected[1]["customer"]["contact"]["email"] = "***"
+        assert result == expected
+
+    def test_unmasked_bytes_are_passed_through_unchanged(self):
+        splicer = JsonSplicer(["email"])
+        data = b'[ {"email" : "a@b.com",  "amount": 1.50e0, "when": "2022-11-03"} ]\n'
+        result = splicer.feed(data) + splicer.finish()
+        assert result == b'[ {"email" : "***",  "amount": 1.50e0, "when": "2022-11-03"} ]\n'
+
+    def test_splicer_output_does_not_depend_on_chunk_boundaries(self):
+        data = json.dumps(RECORDS, indent=1).encode()
+        pii_fields = ["customer.contact.email", "orders[].card_number", "id"]
+        splicer = JsonSplicer(pii_fields)
+        expected = splicer.feed(data) + splicer.finish()
+        for size in range(1, len(data) + 1):
+            splicer = JsonSplicer(pii_fields)
+            chunks = [data[i : i + size] for i in range(0, len(data), size)]
+            result = b"".join(splicer.feed(chunk) for chunk in chunks) + splicer.finish()
+            assert result == expected
+
+    def test_newline_delimited_records_are_masked(self):
+        splicer = JsonSplicer(["customer.contact.email", "tags[]"])
+        data = b"".join(json.dumps(record).encode() + b"\n" for record in RECORDS)
+        data += b'{"tags": ["a", 1, {"b": [2]}]}\n'
+        lines = (splicer.feed(data) + splicer.finish()).splitlines()
+        assert len(lines) == 4
+        assert json.loads(lines[0])["customer"]["contact"]["email"] == "***"
+        assert json.loads(lines[2]) == RECORDS[2]
+        assert json.loads(lines[3]) == {"tags": ["***", "***", "***"]}
+
+    def test_splicer_matches_in_memory_censoring(self):
+        with open("data/dummy_json.json", "rb") as f:
+            data = f.read()
+        splicer = JsonSplicer(["first_name", "email_address"])
+        result = json.loads(splicer.feed(data) + splicer.finish())
+        expected = json.loads(data)
+        for record in expected:
+            record["first_name"] = "***"
+            record["email_address"] = "***"
+        assert result == expected
+
+    def test_splicer_records_missing_fields(self):
+        splicer = JsonSplicer(["email", "customer.phone"])
+        splicer.feed(b'{"email": "a@b.com", "customer": {"name": "x"}}')
+        splicer.finish()
+        assert splicer.missing_fields == ["customer.phone"]
+
+    def test_truncated_json_raises_value_error(self):
+        splicer = JsonSplicer(["customer.contact"])
+        splicer.feed(b'{"customer": {"contact": {"email": "a@')
+        with pytest.raises(ValueError):
+            splicer.finish()
+
+
+class TestSpliceJson:
+    def test_function_writes_censored_file(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "blackwater-processed-zone"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        body = b"".join(json.dumps(record).encode() + b"\n" for record in RECORDS)
+        s3_client.put_object(Bucket=bucket, Key="records.jsonl.gz", Body=gzip.compress(body))
+        result = splice_json_data(
+            f"s3://{bucket}/records.jsonl.gz",
+            f"s3://{bucket}/spliced.jsonl",
+            ["customer.contact.email", "orders[].card_number"],
+            session,
+            chunk_size=16,
+            compression="gzip",
+        )
+        assert result["status"] == "success"
+        output = s3_client.get_object(Bucket=bucket, Key="spliced.jsonl")["Body"].read()
+        records = [json.loads(line) for line in output.splitlines()]
+        assert records[0]["customer"]["contact"] == {"email": "***", "phone": 123}
+        assert [order["card_number"] for order in records[0]["orders"]] == ["***", "***"]
+        assert records[2] == RECORDS[2]
+
+    def test_missing_source_returns_failure(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "blackwater-processed-zone"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        result = splice_json_data(
+            f"s3://{bucket}/missing.json",
+            f"s3://{bucket}/out.json",
+            ["email"],
+            session,
+        )
+        assert result["status"] == "failure"
+        assert result["message"]["Error"]["Code"] == "NoSuchKey"
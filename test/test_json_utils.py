@@ -1,10 +1,12 @@
 import pytest
 import boto3
 import os
+import json
 import pandas as pd
 import awswrangler as wr
 from moto import mock_aws
-from src.transform_lambda.json_utils import write_json_data
+from src.transform_lambda.json_utils import write_json_data, read_json_records
+from src.transform_lambda.storage_utils import read_object_bytes
 from botocore.exceptions import ClientError
 
 
@@ -66,6 +68,22 @@ class TestWritejson:
             2: {"F Name": "Stefani"},
         }
 
+    @pytest.mark.parametrize("destination", ["s3://blackwater-processed-zone/movie.json", "memory://zone/movie.json"])
+    def test_function_writes_a_list_of_records(self, s3_client, destination):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        s3_client.create_bucket(
+            Bucket="blackwater-processed-zone",
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        df = pd.DataFrame({"id": [1, 2], "email": ["***", "***"]})
+        write_json_data(df, destination, session)
+        assert json.loads(read_object_bytes(destination, session)) == [
+            {"id": 1, "email": "***"},
+            {"id": 2, "email": "***"},
+        ]
+
     def test_missing_bucket_raises_client_error(self, s3_client):
         session = boto3.session.Session(
             aws_access_key_id="test", aws_secret_access_key="test"
@@ -80,3 +98,24 @@ class TestWritejson:
         result = write_json_data(df, f"s3://fake_bucket/movie.json", session)
         assert result["status"] == "failure"
         assert result["message"]["Error"]["Code"] == "NoSuchBucket"
+
+
+class TestReadJsonRecords:
+    def test_records_are_read_into_columns(self):
+        table = read_json_records(b'[{"id": 1, "tags": ["a"]},\n {"id": 2, "email": "a@b.com"}]')
+        assert table.column_names == ["id", "tags", "email"]
+        assert table.to_pylist() == [
+            {"id": 1, "tags": ["a"], "email": None},
+            {"id": 2, "tags": None, "email": "a@b.com"},
+        ]
+
+    def test_text_that_looks_like_a_timestamp_stays_text(self):
+        table = read_json_records(b'[{"joined": "2022-11-03", "address": {"since": "2022-11-03 10:00:00"}}]')
+        assert table.to_pylist() == [{"joined": "2022-11-03", "address": {"since": "2022-11-03 10:00:00"}}]
+
+    def test_empty_list_gives_empty_table(self):
+        assert read_json_records(b"[]").num_columns == 0
+
+    def test_list_of_values_raises_value_error(self):
+        with pytest.raises(ValueError):
+            read_json_records(b"[1, 2]")
@@ -0,0 +1,78 @@
+import pytest
+import hashlib
+import hmac
+import pandas as pd
+import pyarrow as pa
+from src.transform_lambda.masking_utils import (
+    get_hmac_key,
+    hash_values,
+    pseudonymize_series,
+    pseudonymize_array,
+    constant_column,
+    censor_table,
+)
+
+
+@pytest.fixture(scope="function")
+def hmac_key(monkeypatch):
+    monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "test-key")
+    return b"test-key"
+
+
+class TestHmacKey:
+    def test_missing_key_raises_value_error(self, monkeypatch):
+        monkeypatch.delenv("OBFUSCATOR_HMAC_KEY", raising=False)
+        with pytest.raises(ValueError):
+            get_hmac_key()
+
+
+class TestPseudonymize:
+    def test_values_are_replaced_with_their_hmac(self, hmac_key):
+        expected = hmac.new(hmac_key, b"a@b.com", hashlib.sha256).hexdigest()
+        assert hash_values(["a@b.com"], get_hmac_key()) == [expected]
+
+    def test_equal_values_get_equal_tokens(self, hmac_key):
+        series = pd.Series(["a", "b", "a", None, "b"], index=[5, 6, 7, 8, 9])
+        result = pseudonymize_series(series, hmac_key)
+        assert list(result.index) == [5, 6, 7, 8, 9]
+        assert result[5] == result[7]
+        assert result[6] == result[9]
+        assert result[5] != result[6]
+        assert result[8] is None
+
+    def test_different_keys_give_different_tokens(self):
+        series = pd.Series(["a"])
+        assert pseudonymize_series(series, b"one")[0] != pseudonymize_series(series, b"two")[0]
+
+    def test_arrow_and_pandas_tokens_match(self, hmac_key):
+        values = ["a", "b", None, "a", "c"]
+        array = pa.chunked_array([pa.array(values[:2]), pa.array(values[2:])])
+        result = pseudonymize_array(array, hmac_key)
+        assert result.to_pylist() == pseudonymize_series(pd.Series(values), hmac_key).tolist()
+
+
+class TestCensorTable:
+    def test_masked_columns_are_dictionary_encoded_constants(self):
+        column = constant_column("***", 4)
+        assert column.type == pa.dictionary(pa.int8(), pa.string())
+        assert column.dictionary.to_pylist() == ["***"]
+        assert column.to_pylist() == ["***"] * 4
+
+    def test_only_pii_columns_are_replaced(self, hmac_key):
+        table = pa.table(
+            {
+                "id": [1, 2, 3],
+                "email": ["a@b.com", "c@d.com", "a@b.com"],
+                "name": ["John", "Steve", "Stefani"],
+            }
+        )
+        result = censor_table(table, ["email", "name", "phone"], {"email": "hash"})
+        assert result.column_names == ["id", "email", "name"]
+        # untouched columns share their buffers with the input
+        assert (
+            result["id"].chunk(0).buffers()[1].address
+            == table["id"].chunk(0).buffers()[1].address
+        )
+        assert result["name"].to_pylist() == ["***"] * 3
+        emails = result["email"].to_pylist()
+        assert emails[0] == emails[2] != emails[1]
@@ -0,0 +1,72 @@
+import json
+import time
+import src.transform_lambda.metrics_utils as metrics_utils
+from src.transform_lambda.metrics_utils import StageMetrics
+
+
+class TestStageMetrics:
+    def test_stage_records_wall_time_and_peak_rss(self):
+        metrics = StageMetrics()
+        with metrics.stage("download") as stage:
+            time.sleep(0.01)
+            stage["rows"] = 3
+        result = metrics.to_dict()
+        assert result["download"]["rows"] == 3
+        assert result["download"]["wall_seconds"] >= 0.01
+        assert result["download"]["peak_rss_bytes"] > 0
+
+    def test_peak_rss_is_measured_per_stage(self):
+        metrics = StageMetrics()
+        with metrics.stage("large"):
+            block = bytearray(200 * 2**20)
+            block[:: 4096] = b"x" * len(block[:: 4096])
+            del block
+        with metrics.stage("small"):
+            pass
+        result = metrics.to_dict()
+        assert result["large"]["peak_rss_bytes"] - result["small"]["peak_rss_bytes"] > 150 * 2**20
+
+    def test_process_peak_is_recorded_where_the_peak_cannot_be_reset(self, monkeypatch):
+        monkeypatch.setattr(metrics_utils, "_reset_peak_rss", lambda: False)
+        metrics = StageMetrics()
+        with metrics.stage("download"):
+            pass
+        record = metrics.to_dict()["download"]
+        assert "peak_rss_bytes" not in record
+        assert record["process_peak_rss_bytes"] > 0
+        assert "ProcessPeakRss" in metrics.emf_records()[0]
+
+    def test_disabled_metrics_record_nothing(self):
+        metrics = StageMetrics(enabled=False)
+        with metrics.stage("download") as stage:
+            stage["rows"] = 3
+        assert metrics.to_dict() == {}
+        assert metrics.emf_records() == []
+
+    def test_emf_record_declares_every_metric(self):
+        metrics = StageMetrics(dimensions={"Format": ".csv"})
+        with metrics.stage("download") as stage:
+            stage["bytes_in"] = 100
+        record = metrics.emf_records()[0]
+        directive = record["_aws"]["CloudWatchMetrics"][0]
+        assert directive["Namespace"] == "GdprObfuscator"
+        assert directive["Dimensions"] == [["Stage", "Format"]]
+        assert {m["Name"] for m in directive["Metrics"]} == {
+            "BytesIn",
+            "WallTime",
+            "PeakRss",
+        }
+        assert record["Stage"] == "download"
+        assert record["Format"] == ".csv"
+        assert record["BytesIn"] == 100
+        assert isinstance(record["_aws"]["Timestamp"], int)
+
+    def test_emit_prints_one_json_line_per_stage(self, capsys):
+        metrics = StageMetrics()
+        with metrics.stage("download"):
+            pass
+        with metrics.stage("upload"):
+            pass
+        metrics.emit()
+        lines = capsys.readouterr().out.splitlines()
+        assert [json.loads(line)["Stage"] for line in lines] == ["download", "upload"]
@@ -4,7 +4,9 @@ import os
 import pandas as pd
 import awswrangler as wr
 from moto import mock_aws
-from src.transform_lambda.parquet_utils import write_parquet_data
+import pyarrow as pa
+import pyarrow.parquet as pq
+from src.transform_lambda.parquet_utils import write_parquet_data, stream_parquet_data
 from botocore.exceptions import ClientError
 
 
@@ -80,3 +82,126 @@ class TestWriteParquet:
         result = write_parquet_data(df, f"s3://fake_bucket/movie.parquet", session)
         assert result["status"] == "failure"
         assert result["message"]["Error"]["Code"] == "NoSuchBucket"
+
+
+class TestStreamParquet:
+    def test_function_censors_every_row_group(self, s3_client, tmp_path):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "blackwater-processed-zone"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        table = pa.table(
+            {
+                "id": list(range(10)),
+                "email": [f"person{i}@example.com" for i in range(10)],
+                "phone": list(range(100, 110)),
+                "score": [i / 2 for i in range(10)],
+            }
+        )
+        pq.write_table(table, tmp_path / "source.parquet", row_group_size=4)
+        s3_client.upload_file(
+            Filename=str(tmp_path / "source.parquet"), Bucket=bucket, Key="source.parquet"
+        )
+        result = stream_parquet_data(
+            f"s3://{bucket}/source.parquet",
+            f"s3://{bucket}/censored.parquet",
+            ["email", "phone"],
+            session,
+        )
+        assert result["status"] == "success"
+        s3_client.download_file(
+            Bucket=bucket, Key="censored.parquet", Filename=str(tmp_path / "out.parquet")
+        )
+        output = pq.ParquetFile(tmp_path / "out.parquet")
+        assert output.num_row_groups == 3
+        censored = output.read()
+        assert censored.column_names == ["id", "email", "phone", "score"]
+        assert set(censored["email"].to_pylist()) == {"***"}
+        assert set(censored["phone"].to_pylist()) == {"***"}
+        assert censored["id"].equals(table["id"])
+        assert censored["score"].equals(table["score"])
+
+    def test_hashed_fields_are_pseudonymized(self, s3_client, tmp_path, monkeypatch):
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "test-key")
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "blackwater-processed-zone"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        table = pa.table(
+            {
+                "id": list(range(6)),
+                "email": ["a@b.com", "c@d.com"] * 3,
+                "phone": list(range(100, 106)),
+            }
+        )
+        pq.write_table(table, tmp_path / "source.parquet", row_group_size=4)
+        s3_client.upload_file(
+            Filename=str(tmp_path / "source.parquet"), Bucket=bucket, Key="source.parquet"
+        )
+        result = stream_parquet_data(
+            f"s3://{bucket}/source.parquet",
+            f"s3://{bucket}/censored.parquet",
+            ["email", "phone"],
+            session,
+            masking={"email": "hash"},
+        )
+        assert result["status"] == "success"
+        s3_client.download_file(
+            Bucket=bucket, Key="censored.parquet", Filename=str(tmp_path / "out.parquet")
+        )
+        censored = pq.read_table(tmp_path / "out.parquet")
+        emails = censored["email"].to_pylist()
+        assert len(set(emails)) == 2
+        assert emails[0] == emails[4] and emails[1] == emails[5]
+        assert "a@b.com" not in emails
+        assert set(censored["phone"].to_pylist()) == {"***"}
+
+    def test_streamed_output_is_readable_by_wrangler(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "blackwater-processed-zone"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        s3_client.upload_file(
+            Filename="data/dummy_parquet.parquet", Bucket=bucket, Key="dummy.parquet"
+        )
+        stream_parquet_data(
+            f"s3://{bucket}/dummy.parquet",
+            f"s3://{bucket}/censored.parquet",
+            ["email_address", "staff_id"],
+            session,
+        )
+        source = pd.read_parquet("data/dummy_parquet.parquet")
+        result = wr.s3.read_parquet(path=f"s3://{bucket}/censored.parquet")
+        assert (result["email_address"] == "***").all()
+        assert (result["staff_id"] == "***").all()
+        assert result["first_name"].tolist() == source["first_name"].tolist()
+
+    def test_missing_source_returns_failure(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "blackwater-processed-zone"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        result = stream_parquet_data(
+            f"s3://{bucket}/missing.parquet",
+            f"s3://{bucket}/out.parquet",
+            ["email"],
+            session,
+        )
+        assert result["status"] == "failure"
+        assert result["message"]["Error"]["Code"] == "404"
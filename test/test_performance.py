@@ -0,0 +1,59 @@
+import pytest
+import boto3
+import os
+from moto import mock_aws
+from benchmark.data_generator import parse_size
+from benchmark.run_benchmark import (
+    SOURCE_BUCKET,
+    DESTINATION_BUCKET,
+    benchmark_file,
+    generated_file,
+)
+from benchmark.compare_results import load_results, index_results, compare, report
+
+pytestmark = pytest.mark.perf
+
+BASELINE_PATH = os.path.join("benchmark", "baselines", "perf_baseline.json")
+# must match the arguments "make perf-baseline" passes to run_benchmark.py
+PERF_SIZE = "4MB"
+PERF_REPEAT = 5
+# timings are compared relative to run_benchmark.reference_run, so the
+# baseline holds on other machines. They are noisier than tracemalloc peaks,
+# and stages taking a few milliseconds are given an absolute slack on top of
+# the tolerance
+TIME_TOLERANCE = float(os.environ.get("OBFUSCATOR_PERF_TOLERANCE", "0.5"))
+MEMORY_TOLERANCE = 0.25
+MIN_SECONDS = 0.005
+
+
+@pytest.fixture(scope="module")
+def session():
+    os.environ["AWS_ACCESS_KEY_ID"] = "test"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "test"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+    with mock_aws():
+        session = boto3.session.Session(region_name="eu-west-2")
+        for bucket in [SOURCE_BUCKET, DESTINATION_BUCKET]:
+            session.client("s3").create_bucket(
+                Bucket=bucket,
+                CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+            )
+        yield session
+
+
+@pytest.fixture(scope="module")
+def baseline():
+    return load_results(BASELINE_PATH)
+
+
+class TestPerformance:
+    @pytest.mark.parametrize("file_format", [".csv", ".json", ".parquet"])
+    def test_stages_are_no_slower_than_baseline(self, session, baseline, file_format):
+        file_info = generated_file(file_format, parse_size(PERF_SIZE), 8, 0.25, 0)
+        latest = index_results(benchmark_file(file_info, session, PERF_REPEAT))
+        rows = compare(baseline, latest, TIME_TOLERANCE, MEMORY_TOLERANCE, MIN_SECONDS)
+        assert len(rows) == len(latest), (
+            f"no baseline for {file_format} at {file_info['bytes']} bytes, run make perf-baseline"
+        )
+        print("\n" + report(rows))
+        assert not any(row["regressed"] for row in rows), "stages regressed:\n" + report(rows)
@@ -0,0 +1,140 @@
+import pytest
+import asyncio
+import boto3
+import gzip
+import os
+import time
+from moto import mock_aws
+from src.transform_lambda.pipeline_utils import run_stages, pipeline_splice_data
+from src.transform_lambda.csv_splice_utils import CsvSplicer, splice_csv_data
+from src.transform_lambda.json_splice_utils import JsonSplicer
+from src.transform_lambda.utils import stream_sensitive_data
+
+
+@pytest.fixture(scope="function")
+def aws_creds():
+    os.environ["AWS_ACCESS_KEY_ID"] = "test"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "test"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture(scope="function")
+def s3_client(aws_creds):
+    with mock_aws():
+        yield boto3.client("s3")
+
+
+@pytest.fixture(scope="function")
+def session():
+    return boto3.session.Session(aws_access_key_id="test", aws_secret_access_key="test")
+
+
+@pytest.fixture(scope="function")
+def bucket(s3_client):
+    s3_client.create_bucket(
+        Bucket="ingested-data",
+        CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+    )
+    for filename, key in [("data/dummy_csv.csv", "dummy.csv"), ("data/dummy_json.json", "dummy.json")]:
+        with open(filename, "rb") as f:
+            body = f.read()
+        s3_client.put_object(Bucket="ingested-data", Key=key, Body=body)
+        s3_client.put_object(Bucket="ingested-data", Key=key + ".gz", Body=gzip.compress(body))
+    return "ingested-data"
+
+
+def slow(function, seconds):
+    def call(*args):
+        time.sleep(seconds)
+        return function(*args)
+
+    return call
+
+
+class TestRunStages:
+    def test_stages_overlap(self):
+        chunks = iter([b"a", b"b", b"c", b"d", b"e", b"f", b""])
+        written = []
+        start = time.perf_counter()
+        asyncio.run(
+            run_stages(
+                slow(lambda: next(chunks), 0.05),
+                slow(bytes.upper, 0.05),
+                lambda: b"!",
+                slow(written.append, 0.05),
+            )
+        )
+        elapsed = time.perf_counter() - start
+        assert written == [b"A", b"B", b"C", b"D", b"E", b"F", b"!"]
+        # one stage after another would take 6 * 3 * 0.05 = 0.9 seconds
+        assert elapsed < 0.7
+
+    def test_queues_bound_chunks_in_flight(self):
+        read, written = [], []
+
+        def read_chunk():
+            read.append(len(read))
+            # chunks read but not yet written: at most one in each stage
+            # and queue_size in each of the two queues
+            assert len(read) - len(written) <= 3 + 2 * 1
+            return b"x" if len(read) < 50 else b""
+
+        asyncio.run(
+            run_stages(read_chunk, bytes, lambda: b"", slow(written.append, 0.002), queue_size=1)
+        )
+        assert len(written) == 49
+
+    def test_failing_stage_raises_without_hanging(self):
+        def transform(chunk):
+            raise ValueError("bad chunk")
+
+        with pytest.raises(ValueError):
+            asyncio.run(run_stages(lambda: b"x", transform, lambda: b"", lambda chunk: None))
+
+
+class TestPipelineSplice:
+    def test_output_matches_sequential_splice(self, s3_client, bucket, session):
+        path = f"s3://{bucket}/dummy.csv"
+        splice_csv_data(path, f"s3://{bucket}/sequential.csv", ["email_address"], session)
+        result = pipeline_splice_data(
+            path, f"s3://{bucket}/pipelined.csv", CsvSplicer(["email_address"]), session, chunk_size=64
+        )
+        assert result["status"] == "success"
+        sequential = s3_client.get_object(Bucket=bucket, Key="sequential.csv")["Body"].read()
+        pipelined = s3_client.get_object(Bucket=bucket, Key="pipelined.csv")["Body"].read()
+        assert pipelined == sequential
+
+    def test_compressed_json_is_decompressed_and_recompressed(self, s3_client, bucket, session):
+        result = pipeline_splice_data(
+            f"s3://{bucket}/dummy.json.gz",
+            f"s3://{bucket}/pipelined.json.gz",
+            JsonSplicer(["email_address"]),
+            session,
+            chunk_size=100,
+            compression="gzip",
+            output_compression="gzip",
+        )
+        assert result["status"] == "success"
+        body = s3_client.get_object(Bucket=bucket, Key="pipelined.json.gz")["Body"].read()
+        splicer = JsonSplicer(["email_address"])
+        with open("data/dummy_json.json", "rb") as f:
+            expected = splicer.feed(f.read()) + splicer.finish()
+        assert gzip.decompress(body) == expected
+
+    def test_failure_leaves_no_output(self, s3_client, bucket, session):
+        s3_client.put_object(Bucket=bucket, Key="bad.csv", Body=b'id,email\n1,"a@b.com\n')
+        result = pipeline_splice_data(
+            f"s3://{bucket}/bad.csv", f"s3://{bucket}/bad_out.csv", CsvSplicer(["email"]), session
+        )
+        assert result == {"status": "failure", "message": "csv ends inside a quoted field"}
+        assert "Contents" not in s3_client.list_objects_v2(Bucket=bucket, Prefix="bad_out")
+
+    def test_only_splice_engines_can_be_pipelined(self, bucket, session):
+        path = f"s3://{bucket}/dummy.csv"
+        destination = f"s3://{bucket}/out.csv"
+        result = stream_sensitive_data(path, ["email_address"], destination, session, pipelined=True)
+        assert result["status"] == "failure"
+        result = stream_sensitive_data(
+            path, ["email_address"], destination, session, "splice", pipelined=True
+        )
+        assert result["status"] == "success"
@@ -0,0 +1,139 @@
+import pytest
+import boto3
+import gzip
+import os
+from moto import mock_aws
+import src.transform_lambda.planner_utils as planner_utils
+from src.transform_lambda.planner_utils import plan_execution, available_memory
+
+MIB = 1024 * 1024
+
+
+@pytest.fixture(scope="function")
+def aws_creds():
+    os.environ["AWS_ACCESS_KEY_ID"] = "test"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "test"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture(scope="function")
+def s3_client(aws_creds):
+    with mock_aws():
+        yield boto3.client("s3")
+
+
+@pytest.fixture(scope="function")
+def session():
+    return boto3.session.Session(aws_access_key_id="test", aws_secret_access_key="test")
+
+
+@pytest.fixture(scope="function")
+def bucket(s3_client):
+    s3_client.create_bucket(
+        Bucket="ingested-data",
+        CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+    )
+    for filename, key in [
+        ("data/dummy_csv.csv", "dummy.csv"),
+        ("data/dummy_json.json", "dummy.json"),
+        ("data/dummy_parquet.parquet", "dummy.parquet"),
+    ]:
+        s3_client.upload_file(Filename=filename, Bucket="ingested-data", Key=key)
+    return "ingested-data"
+
+
+@pytest.fixture(scope="function")
+def little_memory(monkeypatch):
+    # pretend every file needs a thousand times its size when held whole
+    monkeypatch.setattr(planner_utils, "available_memory", lambda: 200 * MIB)
+    monkeypatch.setattr(planner_utils, "PANDAS_EXPANSION", {".csv": 1e6, ".json": 1e6, ".parquet": 1e6})
+
+
+class TestAvailableMemory:
+    def test_lambda_memory_size_is_the_limit(self, monkeypatch):
+        monkeypatch.setenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "1024")
+        assert 0 < available_memory() < 1024 * MIB
+
+    def test_host_memory_is_used_outside_lambda(self, monkeypatch):
+        monkeypatch.delenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", raising=False)
+        assert available_memory() > 0
+
+
+class TestPlanExecution:
+    @pytest.mark.parametrize("key", ["dummy.csv", "dummy.json", "dummy.parquet"])
+    def test_small_files_are_processed_in_memory(self, bucket, session, key):
+        result = plan_execution(f"s3://{bucket}/{key}", session)
+        assert result["status"] == "success"
+        plan = result["data"]
+        assert plan["mode"] == "in_memory"
+        assert plan["streaming_memory"] is None
+        assert plan["estimated_memory"] > plan["size"] > 0
+        assert plan["available_memory"] > 0 and plan["available_disk"] > 0
+
+    def test_compressed_size_is_scaled_up(self, s3_client, bucket, session):
+        with open("data/dummy_csv.csv", "rb") as f:
+            body = gzip.compress(f.read())
+        s3_client.put_object(Bucket=bucket, Key="dummy.csv.gz", Body=body)
+        plan = plan_execution(f"s3://{bucket}/dummy.csv.gz", session)["data"]
+        assert plan["compression"] == "gzip"
+        assert plan["estimated_memory"] == int(len(body) * 5.0 * 6.0)
+
+    def test_arrow_needs_less_memory_than_pandas(self, bucket, session):
+        path = f"s3://{bucket}/dummy.csv"
+        pandas_plan = plan_execution(path, session)["data"]
+        arrow_plan = plan_execution(path, session, {"use_arrow": True})["data"]
+        assert arrow_plan["estimated_memory"] < pandas_plan["estimated_memory"]
+
+    def test_large_csv_is_streamed(self, bucket, session, little_memory):
+        plan = plan_execution(f"s3://{bucket}/dummy.csv", session)["data"]
+        assert plan["mode"] == "streaming"
+        assert plan["modes"] == ["in_memory", "streaming"]
+        assert plan["streaming_memory"] <= plan["available_memory"]
+
+    @pytest.mark.parametrize(
+        "key,job",
+        [
+            ("dummy.json", {}),
+            ("dummy.parquet", {}),
+            ("dummy.csv", {"engine": "splice"}),
+            ("dummy.csv", {"column_types": {"department_id": "int64"}}),
+        ],
+    )
+    def test_large_files_are_not_switched_to_a_different_output(
+        self, bucket, session, little_memory, key, job
+    ):
+        result = plan_execution(f"s3://{bucket}/{key}", session, job)
+        assert result["status"] == "failure"
+        assert result["plan"]["modes"] == ["in_memory"]
+        assert result["message"].endswith(
+            "Streaming or spill would write a different file, set streaming or spill in the job to allow it"
+        )
+
+    def test_large_arrow_files_are_spilled(self, bucket, session, little_memory, monkeypatch):
+        monkeypatch.setattr(planner_utils, "ARROW_EXPANSION", {".json": 1e6})
+        monkeypatch.setattr(planner_utils, "available_disk", lambda: 1 << 50)
+        plan = plan_execution(f"s3://{bucket}/dummy.json", session, {"use_arrow": True})["data"]
+        assert plan["mode"] == "spill"
+        assert plan["modes"] == ["in_memory", "spill"]
+        assert plan["streaming_memory"] is None
+        assert 0 < plan["spill_disk"] <= plan["available_disk"]
+
+    def test_job_that_fits_nowhere_fails_with_estimates(
+        self, bucket, session, little_memory, monkeypatch
+    ):
+        monkeypatch.setattr(planner_utils, "ARROW_EXPANSION", {".json": 1e6})
+        monkeypatch.setattr(planner_utils, "available_disk", lambda: 0)
+        result = plan_execution(f"s3://{bucket}/dummy.json", session, {"use_arrow": True})
+        assert result["status"] == "failure"
+        assert "MB of memory, only 150 MB is available" in result["message"]
+        assert "MB of disk to spill to, 0 MB is free. Streaming would write" in result["message"]
+        assert result["plan"]["streaming_memory"] is None
+
+    def test_newline_delimited_json_is_always_streamed(self, s3_client, bucket, session):
+        s3_client.put_object(Bucket=bucket, Key="records.jsonl", Body=b'{"email": "a@b.com"}\n')
+        plan = plan_execution(f"s3://{bucket}/records.jsonl", session)["data"]
+        assert plan["mode"] == "streaming"
+
+    def test_missing_file_fails(self, bucket, session):
+        result = plan_execution(f"s3://{bucket}/missing.csv", session)
+        assert result["status"] == "failure"
@@ -0,0 +1,166 @@
+import pytest
+import boto3
+import json
+import os
+import awswrangler as wr
+from moto import mock_aws
+from src.transform_lambda.prefix_utils import (
+    list_objects,
+    load_checkpoint,
+    plan_shards,
+    process_prefix,
+    enqueue_prefix,
+    drain_queue,
+)
+
+
+@pytest.fixture(scope="function")
+def aws_creds():
+    os.environ["AWS_ACCESS_KEY_ID"] = "test"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "test"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture(scope="function")
+def s3_client(aws_creds):
+    with mock_aws():
+        yield boto3.client("s3")
+
+
+@pytest.fixture(scope="function")
+def session(aws_creds):
+    return boto3.session.Session(region_name="eu-west-2")
+
+
+@pytest.fixture(scope="function")
+def prefix(s3_client):
+    for bucket in ["ingested-data", "processed-data"]:
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+    for key in ["backfill/a.csv", "backfill/b.csv", "backfill/2024/c.csv"]:
+        s3_client.upload_file(Filename="data/dummy_csv.csv", Bucket="ingested-data", Key=key)
+    s3_client.upload_file(
+        Filename="data/dummy_json.json", Bucket="ingested-data", Key="backfill/d.json"
+    )
+    s3_client.upload_file(
+        Filename="data/dummy_parquet.parquet",
+        Bucket="ingested-data",
+        Key="backfill/2024/e.parquet",
+    )
+    s3_client.put_object(Bucket="ingested-data", Key="backfill/readme.txt", Body=b"notes")
+    return "s3://ingested-data/backfill/"
+
+
+JOB = {"pii_fields": ["email_address"]}
+OUTPUTS = ["2024/c.csv", "2024/e.parquet", "a.csv", "b.csv", "d.json"]
+
+
+def output_keys(s3_client):
+    contents = s3_client.list_objects_v2(Bucket="processed-data", Prefix="out/")["Contents"]
+    return sorted(
+        item["Key"][len("out/") :] for item in contents if "_checkpoint" not in item["Key"]
+    )
+
+
+class TestPlanShards:
+    def test_shards_have_similar_total_size(self):
+        objects = [{"path": f"s3://b/{i}.csv", "size": size} for i, size in enumerate([9, 1, 5, 4, 3, 2])]
+        shards = plan_shards(objects, 2)
+        assert sorted(sum(item["size"] for item in shard) for shard in shards) == [12, 12]
+
+    def test_there_are_never_empty_shards(self):
+        objects = [{"path": "s3://b/a.csv", "size": 1}]
+        assert plan_shards(objects, 8) == [objects]
+        assert plan_shards([], 8) == []
+
+
+class TestProcessPrefix:
+    def test_lists_only_supported_files(self, prefix, session):
+        paths = [item["path"] for item in list_objects(prefix, session)]
+        assert len(paths) == 5
+        assert "s3://ingested-data/backfill/readme.txt" not in paths
+
+    def test_every_file_is_written_under_the_destination(self, prefix, session, s3_client):
+        result = process_prefix(
+            prefix, "s3://processed-data/out/", JOB, session, max_workers=2, pool="thread"
+        )
+        assert result == {
+            "status": "success",
+            "message": "5 of 5 files obfuscated, 0 already obfuscated",
+            "failures": [],
+        }
+        assert output_keys(s3_client) == OUTPUTS
+        output = wr.s3.read_csv(path="s3://processed-data/out/2024/c.csv", boto3_session=session)
+        assert (output["email_address"] == "***").all()
+        done = load_checkpoint("s3://processed-data/out/_checkpoint/", session)
+        assert len(done) == 5
+
+    def test_prefix_without_slash_leaves_out_sibling_prefixes(self, prefix, session, s3_client):
+        s3_client.upload_file(Filename="data/dummy_csv.csv", Bucket="ingested-data", Key="backfill2/f.csv")
+        paths = [item["path"] for item in list_objects("s3://ingested-data/backfill", session)]
+        assert len(paths) == 5
+        assert "s3://ingested-data/backfill2/f.csv" not in paths
+        result = process_prefix(
+            "s3://ingested-data/backfill", "s3://processed-data/out", JOB, session, max_workers=2, pool="thread"
+        )
+        assert result["message"] == "5 of 5 files obfuscated, 0 already obfuscated"
+        assert output_keys(s3_client) == OUTPUTS
+
+    def test_rerun_only_processes_unfinished_files(self, prefix, session, s3_client):
+        s3_client.put_object(
+            Bucket="ingested-data", Key="backfill/b.csv", Body=b"id,name\n1,John\n"
+        )
+        first = process_prefix(
+            prefix, "s3://processed-data/out/", JOB, session, max_workers=2, pool="thread"
+        )
+        assert first["status"] == "failure"
+        assert [f["file_to_obfuscate"] for f in first["failures"]] == [
+            "s3://ingested-data/backfill/b.csv"
+        ]
+        s3_client.upload_file(Filename="data/dummy_csv.csv", Bucket="ingested-data", Key="backfill/b.csv")
+        second = process_prefix(
+            prefix, "s3://processed-data/out/", JOB, session, max_workers=2, pool="thread"
+        )
+        assert second["message"] == "1 of 1 files obfuscated, 4 already obfuscated"
+        assert output_keys(s3_client) == OUTPUTS
+
+    def test_changed_files_are_processed_again(self, prefix, session, s3_client):
+        process_prefix(prefix, "s3://processed-data/out/", JOB, session, pool="thread")
+        s3_client.put_object(
+            Bucket="ingested-data",
+            Key="backfill/a.csv",
+            Body=b"id,email_address\n1,a@b.com\n",
+        )
+        result = process_prefix(prefix, "s3://processed-data/out/", JOB, session, pool="thread")
+        assert result["message"] == "1 of 1 files obfuscated, 4 already obfuscated"
+
+    def test_shards_run_in_worker_processes(self, prefix, session):
+        # worker processes get a copy of the mocked S3 state, so only the
+        # returned summary is visible here
+        result = process_prefix(
+            prefix, "s3://processed-data/out/", JOB, session, max_workers=2, pool="process"
+        )
+        assert result["message"] == "5 of 5 files obfuscated, 0 already obfuscated"
+
+    def test_unknown_pool_fails(self, prefix, session):
+        result = process_prefix(prefix, "s3://processed-data/out/", JOB, session, pool="fibres")
+        assert result["status"] == "failure"
+
+
+class TestQueue:
+    def test_queued_shards_are_processed_by_workers(self, prefix, session, s3_client):
+        queue_url = session.client("sqs").create_queue(QueueName="obfuscator")["QueueUrl"]
+        result = enqueue_prefix(
+            prefix, "s3://processed-data/out/", JOB, session, queue_url, shard_size=2
+        )
+        assert result["message"] == "5 files queued in 3 shards, 0 already obfuscated"
+        assert drain_queue(queue_url, session, max_messages=1)["message"] == (
+            "2 of 2 files obfuscated, 0 already obfuscated"
+        )
+        rest = drain_queue(queue_url, session)
+        assert rest["message"] == "3 of 3 files obfuscated, 0 already obfuscated"
+        assert output_keys(s3_client) == OUTPUTS
+        requeued = enqueue_prefix(prefix, "s3://processed-data/out/", JOB, session, queue_url)
+        assert requeued["message"] == "0 files queued in 0 shards, 5 already obfuscated"
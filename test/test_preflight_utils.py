@@ -0,0 +1,224 @@
+import pytest
+import boto3
+import gzip
+import json
+import os
+from moto import mock_aws
+import src.transform_lambda.preflight_utils as preflight_utils
+from src.transform_lambda.preflight_utils import (
+    masking_strategies,
+    sniff_schema,
+    preflight_check,
+)
+
+
+@pytest.fixture(scope="function")
+def aws_creds():
+    os.environ["AWS_ACCESS_KEY_ID"] = "test"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "test"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture(scope="function")
+def s3_client(aws_creds):
+    with mock_aws():
+        yield boto3.client("s3")
+
+
+@pytest.fixture(scope="function")
+def bucket(s3_client):
+    s3_client.create_bucket(
+        Bucket="ingested-data",
+        CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+    )
+    s3_client.upload_file(
+        Filename="data/dummy_csv.csv", Bucket="ingested-data", Key="dummy.csv"
+    )
+    s3_client.upload_file(
+        Filename="data/dummy_json.json", Bucket="ingested-data", Key="dummy.json"
+    )
+    s3_client.upload_file(
+        Filename="data/dummy_parquet.parquet",
+        Bucket="ingested-data",
+        Key="dummy.parquet",
+    )
+    return "ingested-data"
+
+
+@pytest.fixture(scope="function")
+def session():
+    return boto3.session.Session(aws_access_key_id="test", aws_secret_access_key="test")
+
+
+COLUMNS = [
+    "staff_id",
+    "first_name",
+    "last_name",
+    "department_id",
+    "email_address",
+    "created_at",
+    "last_updated",
+]
+
+
+class TestMaskingStrategies:
+    def test_fields_are_masked_by_default(self):
+        assert masking_strategies(["email", "name"], {"email": "hash"}) == {
+            "email": "hash",
+            "name": "mask",
+        }
+
+    def test_unknown_strategy_raises_value_error(self):
+        with pytest.raises(ValueError):
+            masking_strategies(["email"], {"email": "encrypt"})
+
+
+class TestSniffSchema:
+    @pytest.mark.parametrize("key", ["dummy.csv", "dummy.json", "dummy.parquet"])
+    def test_columns_are_read_for_every_format(self, bucket, session, key):
+        result = sniff_schema(f"s3://{bucket}/{key}", session)
+        assert result["status"] == "success"
+        assert result["data"]["columns"] == COLUMNS
+        assert result["data"]["size"] == os.path.getsize(
+            {"dummy.csv": "data/dummy_csv.csv", "dummy.json": "data/dummy_json.json"}.get(
+                key, "data/dummy_parquet.parquet"
+            )
+        )
+
+    def test_types_come_from_parquet_footer_and_first_json_record(self, bucket, session):
+        parquet = sniff_schema(f"s3://{bucket}/dummy.parquet", session)["data"]
+        assert parquet["types"]["staff_id"] == "int64"
+        assert parquet["types"]["email_address"] == "string"
+        data = sniff_schema(f"s3://{bucket}/dummy.json", session)["data"]
+        assert data["types"]["staff_id"] == "int64"
+
+    def test_range_grows_until_header_is_complete(self, s3_client, bucket, session, monkeypatch):
+        monkeypatch.setattr(preflight_utils, "SNIFF_BYTES", 4)
+        body = b'id,"long\nname",email\n1,a,b\n'
+        s3_client.put_object(Bucket=bucket, Key="quoted.csv", Body=body)
+        result = sniff_schema(f"s3://{bucket}/quoted.csv", session)
+        assert result["data"]["columns"] == ["id", "long\nname", "email"]
+
+    def test_first_json_record_is_read_in_growing_ranges(self, s3_client, bucket, session, monkeypatch):
+        monkeypatch.setattr(preflight_utils, "SNIFF_BYTES", 8)
+        body = json.dumps([{"id": 1, "email": "a@b.com", "address": {"city": "Leeds"}}] * 100)
+        s3_client.put_object(Bucket=bucket, Key="records.json", Body=body.encode())
+        result = sniff_schema(f"s3://{bucket}/records.json", session)
+        assert result["data"]["types"] == {"id": "int64", "email": "string", "address": "struct"}
+
+    @pytest.mark.parametrize("key,separator", [("optional.json", ","), ("optional.jsonl", "\n")])
+    def test_json_columns_are_merged_from_several_records(self, s3_client, bucket, session, key, separator):
+        records = [{"id": 1, "email": None}, {"id": 2, "email": "a@b.com", "phone": "07700900123"}]
+        body = separator.join(json.dumps(record) for record in records)
+        if key.endswith(".json"):
+            body = f"[{body}]"
+        s3_client.put_object(Bucket=bucket, Key=key, Body=body.encode())
+        data = sniff_schema(f"s3://{bucket}/{key}", session)["data"]
+        assert data["types"] == {"id": "int64", "email": "string", "phone": "string"}
+        assert data["sampled"] is False
+
+    def test_json_records_beyond_the_sample_are_flagged(self, s3_client, bucket, session, monkeypatch):
+        monkeypatch.setattr(preflight_utils, "SNIFF_RECORDS", 2)
+        body = json.dumps([{"id": 1}, {"id": 2}, {"id": 3, "phone": "07700900123"}])
+        s3_client.put_object(Bucket=bucket, Key="records.json", Body=body.encode())
+        data = sniff_schema(f"s3://{bucket}/records.json", session)["data"]
+        assert data["columns"] == ["id"]
+        assert data["sampled"] is True
+
+    @pytest.mark.parametrize("key", ["dummy.csv", "dummy.json"])
+    def test_compressed_files_are_sniffed(self, s3_client, bucket, session, key):
+        with open(f"data/dummy_{key.split('.')[1]}.{key.split('.')[1]}", "rb") as f:
+            s3_client.put_object(Bucket=bucket, Key=key + ".gz", Body=gzip.compress(f.read()))
+        result = sniff_schema(f"s3://{bucket}/{key}.gz", session)
+        assert result["status"] == "success"
+        assert result["data"]["compression"] == "gzip"
+        assert result["data"]["columns"] == COLUMNS
+
+    def test_compressed_parquet_fails(self, bucket, session):
+        result = sniff_schema(f"s3://{bucket}/dummy.parquet.gz", session)
+        assert result["status"] == "failure"
+
+    def test_column_oriented_json_is_not_sniffed(self, s3_client, bucket, session):
+        s3_client.put_object(Bucket=bucket, Key="columns.json", Body=b'{"id":{"0":1}}')
+        result = sniff_schema(f"s3://{bucket}/columns.json", session)
+        assert result["status"] == "success"
+        assert result["data"]["columns"] is None
+
+    def test_missing_file_fails(self, bucket, session):
+        result = sniff_schema(f"s3://{bucket}/missing.csv", session)
+        assert result["status"] == "failure"
+
+    def test_unsupported_file_type_fails(self, bucket, session):
+        result = sniff_schema(f"s3://{bucket}/dummy.txt", session)
+        assert result["status"] == "failure"
+
+
+class TestPreflightCheck:
+    def test_plan_splits_columns_by_strategy(self, bucket, session):
+        result = preflight_check(
+            f"s3://{bucket}/dummy.parquet",
+            ["email_address", "first_name"],
+            session,
+            {"first_name": "hash"},
+        )
+        assert result["status"] == "success"
+        plan = result["data"]
+        assert plan["masked"] == ["email_address"]
+        assert plan["hashed"] == ["first_name"]
+        assert plan["passed_through"] == [
+            "staff_id",
+            "last_name",
+            "department_id",
+            "created_at",
+            "last_updated",
+        ]
+
+    def test_missing_fields_fail(self, bucket, session):
+        result = preflight_check(
+            f"s3://{bucket}/dummy.csv", ["email_address", "phone", "nino"], session
+        )
+        assert result == {"status": "failure", "message": "phone, nino not in data set"}
+
+    def test_first_json_record_may_omit_a_pii_field(self, s3_client, bucket, session):
+        body = json.dumps([{"id": 1}, {"id": 2, "phone": "07700900123"}])
+        s3_client.put_object(Bucket=bucket, Key="optional.json", Body=body.encode())
+        result = preflight_check(f"s3://{bucket}/optional.json", ["phone"], session, {"phone": "hash"})
+        assert result["status"] == "success"
+        assert result["data"]["hashed"] == ["phone"]
+        assert result["data"]["warnings"] == []
+
+    def test_fields_missing_from_sampled_json_records_are_a_warning(self, s3_client, bucket, session, monkeypatch):
+        monkeypatch.setattr(preflight_utils, "SNIFF_RECORDS", 1)
+        body = json.dumps([{"id": 1}, {"id": 2, "phone": "07700900123"}])
+        s3_client.put_object(Bucket=bucket, Key="optional.json", Body=body.encode())
+        result = preflight_check(f"s3://{bucket}/optional.json", ["phone"], session, {"phone": "hash"})
+        assert result["status"] == "success"
+        assert result["data"]["warnings"] == ["phone not in the first 1 records"]
+
+    def test_nested_fields_cannot_be_hashed(self, s3_client, bucket, session):
+        body = json.dumps([{"id": 1, "address": {"city": "Leeds"}}])
+        s3_client.put_object(Bucket=bucket, Key="nested.json", Body=body.encode())
+        path = f"s3://{bucket}/nested.json"
+        assert preflight_check(path, ["address"], session)["status"] == "success"
+        result = preflight_check(path, ["address"], session, {"address": "hash"})
+        assert result["status"] == "failure"
+
+    def test_nested_json_paths_need_their_top_level_key(self, s3_client, bucket, session):
+        lines = [{"id": 1, "customer": {"contact": {"email": "a@b.com"}}}, {"id": 2}]
+        body = "\n".join(json.dumps(line) for line in lines)
+        s3_client.put_object(Bucket=bucket, Key="nested.jsonl", Body=body.encode())
+        path = f"s3://{bucket}/nested.jsonl"
+        result = preflight_check(path, ["customer.contact.email"], session)
+        assert result["status"] == "success"
+        assert result["data"]["passed_through"] == ["id"]
+        result = preflight_check(path, ["account.email"], session)
+        assert result == {"status": "failure", "message": "account.email not in data set"}
+        masking = {"customer.contact.email": "hash"}
+        result = preflight_check(path, ["customer.contact.email"], session, masking)
+        assert result["status"] == "failure"
+
+    def test_unknown_strategy_fails(self, bucket, session):
+        result = preflight_check(
+            f"s3://{bucket}/dummy.csv", ["email_address"], session, {"email_address": "x"}
+        )
+        assert result["status"] == "failure"
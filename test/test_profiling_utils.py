@@ -0,0 +1,95 @@
+import pytest
+import json
+import pstats
+import tracemalloc
+from src.transform_lambda.metrics_utils import StageMetrics
+from src.transform_lambda.profiling_utils import (
+    StageProfiler,
+    get_profiler,
+    profile_destination,
+    write_profile,
+)
+
+
+def build_rows():
+    return [{"email_address": f"user{i}@example.com"} for i in range(10_000)]
+
+
+class TestStageProfiler:
+    def test_each_stage_gets_pstats_and_allocations(self, tmp_path):
+        profiler = StageProfiler()
+        with profiler.stage("censor_sensitive_data"):
+            rows = build_rows()
+        assert sorted(profiler.artifacts) == [
+            "censor_sensitive_data.allocations.json",
+            "censor_sensitive_data.pstats",
+        ]
+        (tmp_path / "stage.pstats").write_bytes(profiler.artifacts["censor_sensitive_data.pstats"])
+        functions = {function for _, _, function in pstats.Stats(str(tmp_path / "stage.pstats")).stats}
+        assert "build_rows" in functions
+
+        allocations = json.loads(profiler.artifacts["censor_sensitive_data.allocations.json"])
+        assert allocations["stage"] == "censor_sensitive_data"
+        assert allocations["peak_traced_bytes"] > 0
+        assert allocations["top_allocations"][0]["file"] == __file__
+        assert len(rows) == 10_000
+
+    def test_tracing_started_elsewhere_is_left_running(self):
+        tracemalloc.start()
+        try:
+            profiler = StageProfiler(cprofile=False, top=3)
+            with profiler.stage("download"):
+                rows = build_rows()
+            assert tracemalloc.is_tracing()
+        finally:
+            tracemalloc.stop()
+        allocations = json.loads(profiler.artifacts["download.allocations.json"])
+        assert len(allocations["top_allocations"]) == 3
+        assert list(profiler.artifacts) == ["download.allocations.json"]
+        assert len(rows) == 10_000
+
+    def test_profiler_runs_with_metrics_disabled(self):
+        profiler = StageProfiler(trace_allocations=False)
+        metrics = StageMetrics(enabled=False, profiler=profiler)
+        with metrics.stage("download") as stage:
+            stage["rows"] = 3
+        assert metrics.to_dict() == {}
+        assert list(profiler.artifacts) == ["download.pstats"]
+        assert not tracemalloc.is_tracing()
+
+
+class TestProfileSettings:
+    def test_profile_is_off_by_default(self):
+        assert get_profiler(None) is None
+        assert get_profiler(False) is None
+
+    def test_profilers_can_be_chosen(self):
+        profiler = get_profiler({"profilers": ["tracemalloc"], "top": 5})
+        assert (profiler.cprofile, profiler.trace_allocations, profiler.top) == (False, True, 5)
+        with pytest.raises(ValueError):
+            get_profiler({"profilers": ["perf"]})
+
+    @pytest.mark.parametrize(
+        "config", ["cprofile", ["cprofile"], {"profilers": "cprofile"}, {"profilers": []}, {"top": "5"}, {"top": 0}]
+    )
+    def test_malformed_profile_raises_value_error(self, config):
+        with pytest.raises(ValueError):
+            get_profiler(config)
+
+    def test_destination_comes_from_event_or_environment(self, monkeypatch):
+        monkeypatch.delenv("OBFUSCATOR_PROFILE_DESTINATION", raising=False)
+        with pytest.raises(ValueError):
+            profile_destination(True, "s3://ingested-data/dummy.csv")
+        prefix = profile_destination({"destination": "s3://profiles/"}, "s3://ingested-data/dummy.csv")
+        assert prefix.startswith("s3://profiles/dummy.csv-")
+        monkeypatch.setenv("OBFUSCATOR_PROFILE_DESTINATION", "memory://profiles")
+        assert profile_destination(True, "s3://ingested-data/dummy.csv").startswith("memory://profiles/dummy.csv-")
+
+    def test_artifacts_are_written_under_prefix(self, tmp_path):
+        profiler = StageProfiler(trace_allocations=False)
+        with profiler.stage("download"):
+            pass
+        result = write_profile(profiler, f"file://{tmp_path}/run/", None)
+        assert result == {"status": "success", "data": [f"file://{tmp_path}/run/download.pstats"]}
+        assert (tmp_path / "run" / "download.pstats").stat().st_size > 0
+        assert write_profile(profiler, "gs://profiles", None)["status"] == "failure"
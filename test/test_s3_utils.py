@@ -0,0 +1,267 @@
+import pytest
+import boto3
+import os
+import awswrangler as wr
+from botocore.exceptions import ClientError
+from moto import mock_aws
+from src.transform_lambda.s3_utils import (
+    split_s3_path,
+    get_s3_client,
+    connection_pool,
+    download_s3_object,
+    read_downloaded_object,
+    S3RangeReader,
+    S3MultipartWriter,
+    MIN_PART_SIZE,
+)
+
+
+@pytest.fixture(scope="function")
+def aws_creds():
+    os.environ["AWS_ACCESS_KEY_ID"] = "test"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "test"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture(scope="function")
+def s3_client(aws_creds):
+    with mock_aws():
+        yield boto3.client("s3")
+
+
+class TestSplitS3Path:
+    def test_function_returns_bucket_and_key(self):
+        assert split_s3_path("s3://my-bucket/dir/my-file.csv") == (
+            "my-bucket",
+            "dir/my-file.csv",
+        )
+
+    def test_function_rejects_non_s3_path(self):
+        with pytest.raises(ValueError):
+            split_s3_path("my-bucket/my-file.csv")
+
+
+class TestGetS3Client:
+    def test_client_is_reused_for_the_same_session(self, aws_creds):
+        session = boto3.session.Session(region_name="eu-west-2")
+        assert get_s3_client(session) is get_s3_client(session)
+
+    def test_pool_sizes_and_sessions_get_their_own_clients(self, aws_creds):
+        session = boto3.session.Session(region_name="eu-west-2")
+        other = boto3.session.Session(region_name="eu-west-2")
+        pooled = get_s3_client(session, 32)
+        assert pooled is not get_s3_client(session)
+        assert pooled.meta.config.max_pool_connections == 32
+        assert get_s3_client(other) is not get_s3_client(session)
+
+    def test_connection_pool_is_sized_only_inside_the_block(self, aws_creds):
+        session = boto3.session.Session(region_name="eu-west-2")
+        default = get_s3_client(session)
+        with connection_pool(session, 32):
+            assert get_s3_client(session).meta.config.max_pool_connections == 32
+            assert wr.config.botocore_config.max_pool_connections == 32
+        assert get_s3_client(session) is default
+        assert wr.config.botocore_config is None
+
+    def test_connection_pool_is_never_made_smaller(self, aws_creds):
+        session = boto3.session.Session(region_name="eu-west-2")
+        with connection_pool(session, 4):
+            assert get_s3_client(session).meta.config.max_pool_connections == 10
+            assert wr.config.botocore_config is None
+
+
+class TestDownloadS3Object:
+    def test_object_is_downloaded_into_buffer(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "ingested-data"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        body = os.urandom(100_003)
+        s3_client.put_object(Bucket=bucket, Key="random.bin", Body=body)
+        result = download_s3_object(
+            f"s3://{bucket}/random.bin", session, part_size=1000, max_concurrency=4
+        )
+        assert isinstance(result, bytearray)
+        assert result == body
+
+    def test_object_is_downloaded_into_local_file(self, s3_client, tmp_path):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "ingested-data"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        body = os.urandom(50_000)
+        s3_client.put_object(Bucket=bucket, Key="random.bin", Body=body)
+        local_path = str(tmp_path / "random.bin")
+        result = download_s3_object(
+            f"s3://{bucket}/random.bin",
+            session,
+            part_size=4096,
+            local_path=local_path,
+        )
+        assert result == local_path
+        with open(local_path, "rb") as f:
+            assert f.read() == body
+
+    def test_empty_object_is_downloaded(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "ingested-data"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        s3_client.put_object(Bucket=bucket, Key="empty.bin", Body=b"")
+        assert download_s3_object(f"s3://{bucket}/empty.bin", session) == b""
+
+    def test_local_copy_is_removed_after_parsing(self, s3_client, tmp_path):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "ingested-data"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        s3_client.put_object(Bucket=bucket, Key="digits.txt", Body=b"0123456789")
+        local_path = str(tmp_path / "digits.txt")
+
+        def parser(source):
+            with open(source, "rb") as f:
+                return f.read()
+
+        result = read_downloaded_object(
+            f"s3://{bucket}/digits.txt", session, parser, local_path=local_path
+        )
+        assert result == b"0123456789"
+        assert not os.path.exists(local_path)
+
+    @pytest.mark.parametrize("failure", ["download", "parse"])
+    def test_local_copy_is_removed_when_reading_fails(self, s3_client, tmp_path, failure):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "ingested-data"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        s3_client.put_object(Bucket=bucket, Key="digits.txt", Body=b"0123456789")
+        local_path = str(tmp_path / "digits.txt")
+
+        def fail(**kwargs):
+            raise ValueError(f"{failure} failed")
+
+        if failure == "download":
+            get_s3_client(session, 2).meta.events.register("before-call.s3.GetObject", fail)
+        with pytest.raises(ValueError, match=f"{failure} failed"):
+            read_downloaded_object(
+                f"s3://{bucket}/digits.txt",
+                session,
+                lambda source: fail(),
+                part_size=4,
+                max_concurrency=2,
+                local_path=local_path,
+            )
+        assert not os.path.exists(local_path)
+
+
+class TestS3RangeReader:
+    def test_reader_returns_requested_ranges(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "ingested-data"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        s3_client.put_object(Bucket=bucket, Key="digits.txt", Body=b"0123456789")
+        reader = S3RangeReader(f"s3://{bucket}/digits.txt", session)
+        assert reader.size == 10
+        assert reader.read(3) == b"012"
+        reader.seek(-2, os.SEEK_END)
+        assert reader.read() == b"89"
+        assert reader.read() == b""
+        reader.seek(4)
+        assert reader.read(100) == b"456789"
+
+    def test_overwritten_object_fails_instead_of_mixing_versions(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "ingested-data"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        s3_client.put_object(Bucket=bucket, Key="digits.txt", Body=b"0123456789")
+        reader = S3RangeReader(f"s3://{bucket}/digits.txt", session)
+        assert reader.read(3) == b"012"
+        s3_client.put_object(Bucket=bucket, Key="digits.txt", Body=b"abcdefghij")
+        with pytest.raises(ClientError) as error:
+            reader.read(3)
+        assert error.value.response["Error"]["Code"] == "PreconditionFailed"
+
+
+class TestS3MultipartWriter:
+    def test_small_object_is_written_with_single_put(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "blackwater-processed-zone"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        with S3MultipartWriter(f"s3://{bucket}/small.txt", session) as writer:
+            writer.write(b"hello ")
+            writer.write(b"world")
+        result = s3_client.get_object(Bucket=bucket, Key="small.txt")
+        assert result["Body"].read() == b"hello world"
+        assert "-" not in result["ETag"]
+
+    def test_large_object_is_written_in_parts(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "blackwater-processed-zone"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        block = os.urandom(1024 * 1024)
+        with S3MultipartWriter(
+            f"s3://{bucket}/large.bin", session, MIN_PART_SIZE
+        ) as writer:
+            for _ in range(12):
+                writer.write(block)
+        assert len(writer.parts) == 3
+        result = s3_client.get_object(Bucket=bucket, Key="large.bin")
+        assert result["Body"].read() == block * 12
+        assert result["ETag"].endswith('-3"')
+
+    def test_exception_aborts_upload(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "blackwater-processed-zone"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        with pytest.raises(RuntimeError):
+            with S3MultipartWriter(f"s3://{bucket}/broken.bin", session) as writer:
+                writer.write(os.urandom(9 * 1024 * 1024))
+                raise RuntimeError("boom")
+        assert "Contents" not in s3_client.list_objects_v2(Bucket=bucket)
+        uploads = s3_client.list_multipart_uploads(Bucket=bucket)
+        assert "Uploads" not in uploads
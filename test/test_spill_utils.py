@@ -0,0 +1,165 @@
+import pytest
+import boto3
+import gzip
+import io
+import json
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import awswrangler as wr
+from moto import mock_aws
+import src.transform_lambda.spill_utils as spill_utils
+from src.transform_lambda.spill_utils import spill_to_disk, open_spilled_table
+from src.transform_lambda.json_utils import read_json_table_source
+from src.transform_lambda.utils import spill_sensitive_data
+
+
+@pytest.fixture(scope="function")
+def aws_creds():
+    os.environ["AWS_ACCESS_KEY_ID"] = "test"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "test"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture(scope="function")
+def s3_client(aws_creds):
+    with mock_aws():
+        yield boto3.client("s3")
+
+
+@pytest.fixture(scope="function")
+def session():
+    return boto3.session.Session(aws_access_key_id="test", aws_secret_access_key="test")
+
+
+@pytest.fixture(scope="function")
+def bucket(s3_client):
+    s3_client.create_bucket(
+        Bucket="ingested-data",
+        CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+    )
+    for filename, key in [
+        ("data/dummy_csv.csv", "dummy.csv"),
+        ("data/dummy_json.json", "dummy.json"),
+        ("data/dummy_parquet.parquet", "dummy.parquet"),
+    ]:
+        with open(filename, "rb") as f:
+            body = f.read()
+        s3_client.put_object(Bucket="ingested-data", Key=key, Body=body)
+        s3_client.put_object(Bucket="ingested-data", Key=key + ".gz", Body=gzip.compress(body))
+    return "ingested-data"
+
+
+class TestSpillToDisk:
+    @pytest.mark.parametrize(
+        "key", ["dummy.csv", "dummy.json", "dummy.parquet", "dummy.csv.gz", "dummy.json.gz"]
+    )
+    def test_every_format_is_spilled(self, bucket, session, tmp_path, key):
+        result = spill_to_disk(f"s3://{bucket}/{key}", session, str(tmp_path))
+        assert result["status"] == "success"
+        table = open_spilled_table(result["data"])
+        assert table.num_rows == 20
+        assert table["email_address"].to_pylist() == pd.read_csv("data/dummy_csv.csv")[
+            "email_address"
+        ].tolist()
+
+    def test_spilled_table_is_memory_mapped(self, bucket, session, tmp_path):
+        local_path = spill_to_disk(f"s3://{bucket}/dummy.parquet", session, str(tmp_path))["data"]
+        allocated = pa.total_allocated_bytes()
+        table = open_spilled_table(local_path)
+        assert table.num_rows == 20
+        assert pa.total_allocated_bytes() == allocated
+
+    def test_huge_row_group_is_decoded_in_batches(self, s3_client, bucket, session, tmp_path, monkeypatch):
+        monkeypatch.setattr(spill_utils, "SPILL_BATCH_ROWS", 1000)
+        table = pa.table({"id": range(5000), "email": ["a@b.com"] * 5000})
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer, row_group_size=5000)
+        s3_client.put_object(Bucket=bucket, Key="big.parquet", Body=buffer.getvalue())
+        local_path = spill_to_disk(f"s3://{bucket}/big.parquet", session, str(tmp_path))["data"]
+        with pa.memory_map(local_path) as source:
+            assert pa.ipc.open_file(source).num_record_batches == 5
+        assert open_spilled_table(local_path).equals(table)
+
+    def test_json_records_are_batched(self, s3_client, bucket, session, tmp_path, monkeypatch):
+        monkeypatch.setattr(spill_utils, "SPILL_BATCH_ROWS", 3)
+        monkeypatch.setattr(spill_utils, "SPILL_READ_SIZE", 7)
+        records = [{"id": i, "email": f"{i}@b.com", "tags": [i]} for i in range(10)]
+        s3_client.put_object(Bucket=bucket, Key="records.json", Body=json.dumps(records).encode())
+        local_path = spill_to_disk(f"s3://{bucket}/records.json", session, str(tmp_path))["data"]
+        assert open_spilled_table(local_path).to_pylist() == records
+
+    def test_json_batches_are_typed_as_the_whole_file(self, s3_client, bucket, session, tmp_path, monkeypatch):
+        monkeypatch.setattr(spill_utils, "SPILL_BATCH_ROWS", 2)
+        records = [
+            {"id": 1, "joined": "2022-11-03", "score": 1, "address": {"city": "Leeds"}},
+            {"id": 2, "joined": "2022-11-04 10:00:00", "score": 2.5, "address": None},
+            {"id": 3, "joined": None, "score": 3, "address": {"city": "York"}},
+        ]
+        body = json.dumps(records, indent=2).encode()
+        s3_client.put_object(Bucket=bucket, Key="records.json", Body=body)
+        local_path = spill_to_disk(f"s3://{bucket}/records.json", session, str(tmp_path))["data"]
+        assert open_spilled_table(local_path).to_pylist() == read_json_table_source(io.BytesIO(body)).to_pylist()
+        assert open_spilled_table(local_path)["joined"].to_pylist() == ["2022-11-03", "2022-11-04 10:00:00", None]
+
+    def test_json_fields_appearing_late_fail(self, s3_client, bucket, session, tmp_path, monkeypatch):
+        monkeypatch.setattr(spill_utils, "SPILL_BATCH_ROWS", 2)
+        records = [{"id": 1}, {"id": 2}, {"id": 3, "email": "a@b.com"}]
+        s3_client.put_object(Bucket=bucket, Key="records.json", Body=json.dumps(records).encode())
+        result = spill_to_disk(f"s3://{bucket}/records.json", session, str(tmp_path))
+        assert result["status"] == "failure"
+        assert "email first appear after the first 2 records" in result["message"]
+        assert os.listdir(tmp_path) == []
+
+    def test_column_oriented_json_fails(self, s3_client, bucket, session, tmp_path):
+        body = pd.read_csv("data/dummy_csv.csv").to_json().encode()
+        s3_client.put_object(Bucket=bucket, Key="columns.json", Body=body)
+        result = spill_to_disk(f"s3://{bucket}/columns.json", session, str(tmp_path))
+        assert result["status"] == "failure"
+
+    def test_missing_file_fails(self, bucket, session, tmp_path):
+        result = spill_to_disk(f"s3://{bucket}/missing.csv", session, str(tmp_path))
+        assert result["message"]["Error"]["Code"] == "NoSuchKey"
+        assert os.listdir(tmp_path) == []
+
+
+class TestSpillSensitiveData:
+    @pytest.mark.parametrize(
+        "key, reader",
+        [
+            ("dummy.csv", wr.s3.read_csv),
+            ("dummy.parquet", wr.s3.read_parquet),
+            ("dummy.json", wr.s3.read_json),
+        ],
+    )
+    def test_spilled_file_is_censored_and_removed(self, bucket, session, tmp_path, key, reader):
+        result = spill_sensitive_data(
+            f"s3://{bucket}/{key}",
+            ["email_address"],
+            f"s3://{bucket}/spilled/{key}",
+            session,
+            directory=str(tmp_path),
+        )
+        assert result["status"] == "success"
+        output = reader(path=[f"s3://{bucket}/spilled/{key}"])
+        assert (output["email_address"] == "***").all()
+        assert output["first_name"].tolist() == pd.read_csv("data/dummy_csv.csv")["first_name"].tolist()
+        assert os.listdir(tmp_path) == []
+
+    def test_hashed_fields_match_in_memory_arrow_output(self, bucket, session, tmp_path, monkeypatch):
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "test-key")
+        monkeypatch.setattr(spill_utils, "SPILL_BATCH_ROWS", 7)
+        masking = {"email_address": "hash"}
+        result = spill_sensitive_data(
+            f"s3://{bucket}/dummy.parquet",
+            ["email_address"],
+            f"s3://{bucket}/spilled.parquet",
+            session,
+            masking,
+            directory=str(tmp_path),
+        )
+        assert result["status"] == "success"
+        output = wr.s3.read_parquet(path=[f"s3://{bucket}/spilled.parquet"])
+        assert output["email_address"].nunique() == 20
+        assert "@" not in "".join(output["email_address"])
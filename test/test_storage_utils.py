@@ -0,0 +1,128 @@
+import pytest
+import boto3
+import os
+from moto import mock_aws
+from src.transform_lambda.storage_utils import (
+    split_uri,
+    get_storage,
+    read_object_bytes,
+    open_object_stream,
+    open_object_reader,
+    open_object_writer,
+    get_file_size,
+    ObjectStorage,
+    S3Storage,
+    LocalStorage,
+    MemoryStorage,
+)
+
+
+@pytest.fixture(scope="function")
+def aws_creds():
+    os.environ["AWS_ACCESS_KEY_ID"] = "test"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "test"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture(scope="function")
+def s3_client(aws_creds):
+    with mock_aws():
+        yield boto3.client("s3")
+
+
+@pytest.fixture(scope="function")
+def memory():
+    yield get_storage("memory://bucket/key")
+    MemoryStorage.objects.clear()
+
+
+class TestSplitUri:
+    @pytest.mark.parametrize(
+        "path, expected",
+        [
+            ("s3://bucket/file.csv", ("s3", "bucket/file.csv")),
+            ("file:///tmp/file.csv", ("file", "/tmp/file.csv")),
+            ("memory://bucket/file.csv", ("memory", "bucket/file.csv")),
+        ],
+    )
+    def test_splits_scheme_and_location(self, path, expected):
+        assert split_uri(path) == expected
+
+    @pytest.mark.parametrize("path", ["bucket/file.csv", "gs://bucket/file.csv", "file://"])
+    def test_unsupported_path_raises(self, path):
+        with pytest.raises(ValueError):
+            split_uri(path)
+
+    def test_backend_missing_a_method_cannot_be_created(self):
+        class ReadOnlyStorage(ObjectStorage):
+            def exists(self, path):
+                return True
+
+            def size(self, path):
+                return 0
+
+            def open_stream(self, path):
+                return None
+
+            def open_reader(self, path):
+                return None
+
+        with pytest.raises(TypeError):
+            ReadOnlyStorage()
+
+    def test_storage_is_chosen_by_scheme(self, s3_client):
+        assert isinstance(get_storage("s3://bucket/file.csv", boto3.session.Session()), S3Storage)
+        assert isinstance(get_storage("file:///tmp/file.csv"), LocalStorage)
+        assert isinstance(get_storage("memory://bucket/file.csv"), MemoryStorage)
+
+
+class TestBackends:
+    @pytest.fixture(params=["s3", "file", "memory"])
+    def path(self, request, s3_client, tmp_path, memory):
+        if request.param == "s3":
+            s3_client.create_bucket(
+                Bucket="ingested-data",
+                CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+            )
+            return "s3://ingested-data/file.bin"
+        if request.param == "file":
+            return f"file://{tmp_path}/file.bin"
+        return "memory://ingested-data/file.bin"
+
+    def test_written_file_reads_back(self, path):
+        session = boto3.session.Session()
+        assert not get_storage(path, session).exists(path)
+        with open_object_writer(path, session) as writer:
+            writer.write(b"0123")
+            writer.write(b"456789")
+        assert get_storage(path, session).exists(path)
+        assert get_file_size(path, session) == 10
+        assert read_object_bytes(path, session) == b"0123456789"
+        with open_object_stream(path, session) as stream:
+            assert stream.read(4) == b"0123"
+            assert stream.read() == b"456789"
+        reader = open_object_reader(path, session)
+        reader.seek(-3, os.SEEK_END)
+        assert reader.read() == b"789"
+
+    def test_failed_write_leaves_nothing_behind(self, path):
+        session = boto3.session.Session()
+        with pytest.raises(RuntimeError):
+            with open_object_writer(path, session) as writer:
+                writer.write(b"partial")
+                raise RuntimeError("failed")
+        assert not get_storage(path, session).exists(path)
+
+    def test_local_write_replaces_file_only_when_closed(self, tmp_path):
+        target = tmp_path / "file.csv"
+        target.write_bytes(b"old")
+        writer = open_object_writer(f"file://{target}")
+        writer.write(b"new")
+        assert target.read_bytes() == b"old"
+        writer.close()
+        assert target.read_bytes() == b"new"
+        assert os.listdir(tmp_path) == ["file.csv"]
+
+    def test_missing_memory_file_raises(self, memory):
+        with pytest.raises(FileNotFoundError):
+            read_object_bytes("memory://ingested-data/missing.csv")
@@ -1,14 +1,27 @@
 import pytest
 import boto3
+import bz2
+import gzip
+import io
+import json
 import os
+import subprocess
+import sys
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import awswrangler as wr
 from moto import mock_aws
 from src.transform_lambda.utils import (
     censor_sensitive_data,
     get_data_from_bucket,
     write_sensitive_data,
+    stream_sensitive_data,
+    get_obfuscated_bytes,
+    iter_obfuscated_chunks,
+    load_backend,
 )
+from src.transform_lambda.storage_utils import read_object_bytes, open_object_writer
 from botocore.exceptions import ClientError
 
 
@@ -104,6 +117,70 @@ class TestGetFileContents:
         result = get_data_from_bucket(path, session)
         assert result["format"] == ".json"
 
+    @pytest.mark.parametrize(
+        "filename, key",
+        [
+            ("data/dummy_csv.csv", "dummy.csv"),
+            ("data/dummy_json.json", "dummy.json"),
+            ("data/dummy_parquet.parquet", "dummy.parquet"),
+        ],
+    )
+    def test_ranged_download_matches_default_reader(self, s3_client, filename, key):
+        bucket = "ingested_data"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        s3_client.upload_file(Filename=filename, Bucket=bucket, Key=key)
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        path = f"s3://ingested_data/{key}"
+        expected = get_data_from_bucket(path, session)
+        result = get_data_from_bucket(
+            path, session, {"part_size": 256, "max_concurrency": 4}
+        )
+        assert result["format"] == expected["format"]
+        pd.testing.assert_frame_equal(result["data"], expected["data"])
+
+
+class TestArrowPipeline:
+    @pytest.mark.parametrize(
+        "filename, key, reader",
+        [
+            ("data/dummy_csv.csv", "dummy.csv", wr.s3.read_csv),
+            ("data/dummy_json.json", "dummy.json", wr.s3.read_json),
+            ("data/dummy_parquet.parquet", "dummy.parquet", wr.s3.read_parquet),
+        ],
+    )
+    def test_arrow_output_matches_pandas_output(self, s3_client, filename, key, reader):
+        bucket = "ingested-data"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        s3_client.upload_file(Filename=filename, Bucket=bucket, Key=key)
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        outputs = []
+        for use_arrow in [False, True]:
+            response = get_data_from_bucket(f"s3://{bucket}/{key}", session, use_arrow=use_arrow)
+            assert isinstance(response["data"], pa.Table) == use_arrow
+            response = censor_sensitive_data(response, ["email_address", "first_name"])
+            destination = f"s3://{bucket}/{use_arrow}_{key}"
+            assert write_sensitive_data(response, destination, session)["status"] == "success"
+            outputs.append(reader(path=destination, boto3_session=session))
+        pd.testing.assert_frame_equal(outputs[1], outputs[0])
+        assert (outputs[1]["email_address"] == "***").all()
+
+    def test_arrow_read_of_missing_file_fails(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        result = get_data_from_bucket("s3://no-bucket/dummy.csv", session, use_arrow=True)
+        assert result["status"] == "failure"
+
 
 class TestCensorData:
     def test_censor_function_returns_a_dataframe(self):
@@ -147,6 +224,48 @@ class TestCensorData:
         assert result["data"].loc[0][3] == "***"
         assert result["data"].loc[2][3] == "***"
 
+    def test_hashed_fields_keep_equal_values_equal(self, monkeypatch):
+        monkeypatch.setenv("OBFUSCATOR_HMAC_KEY", "test-key")
+        df = pd.DataFrame(
+            {
+                "email": ["a@b.com", "c@d.com", "a@b.com"],
+                "name": ["John", "Steve", "John"],
+            }
+        )
+        response_dict = {"status": "success", "data": df, "format": ".csv"}
+        result = censor_sensitive_data(response_dict, ["email", "name"], {"email": "hash"})
+        assert result["status"] == "success"
+        emails = result["data"]["email"]
+        assert emails[0] == emails[2] != emails[1]
+        assert "a@b.com" not in emails.values
+        assert (result["data"]["name"] == "***").all()
+
+    def test_nested_json_paths_are_masked_in_place(self):
+        df = pd.DataFrame(
+            {
+                "id": [1, 2],
+                "customer": [{"contact": {"email": "a@b.com"}, "name": "Ann"}, None],
+            }
+        )
+        response_dict = {"status": "success", "data": df, "format": ".json"}
+        result = censor_sensitive_data(response_dict, ["customer.contact.email"])
+        assert result["data"]["customer"].tolist() == [
+            {"contact": {"email": "***"}, "name": "Ann"},
+            None,
+        ]
+        result = censor_sensitive_data(
+            response_dict, ["customer.name"], {"customer.name": "hash"}
+        )
+        assert result["status"] == "failure"
+
+    def test_hashing_without_key_fails(self, monkeypatch):
+        monkeypatch.delenv("OBFUSCATOR_HMAC_KEY", raising=False)
+        df = pd.DataFrame({"email": ["a@b.com"]})
+        response_dict = {"status": "success", "data": df, "format": ".csv"}
+        result = censor_sensitive_data(response_dict, ["email"], {"email": "hash"})
+        assert result["status"] == "failure"
+        assert "OBFUSCATOR_HMAC_KEY" in result["message"]
+
 
 class TestWriteFileContents:
     def test_function_identifies_csv_correctly(self, s3_client):
@@ -279,3 +398,402 @@ class TestWriteFileContents:
         response_dict = {"status": "failed"}
         result = write_sensitive_data(response_dict, "bucket", session)
         assert result["message"] == "unexpected error"
+
+
+class TestObfuscatedBytes:
+    @pytest.mark.parametrize(
+        "filename, key",
+        [
+            ("data/dummy_csv.csv", "dummy.csv"),
+            ("data/dummy_json.json", "dummy.json"),
+        ],
+    )
+    def test_bytes_match_written_file(self, s3_client, filename, key):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "ingested-data"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        s3_client.upload_file(Filename=filename, Bucket=bucket, Key=key)
+        path = f"s3://{bucket}/{key}"
+        response = censor_sensitive_data(
+            get_data_from_bucket(path, session), ["email_address"]
+        )
+        write_sensitive_data(response, f"s3://{bucket}/written/{key}", session)
+        written = s3_client.get_object(Bucket=bucket, Key=f"written/{key}")
+        result = get_obfuscated_bytes(path, ["email_address"], session)
+        assert result["status"] == "success"
+        assert result["data"].read() == written["Body"].read()
+
+    def test_parquet_bytes_can_be_uploaded(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "ingested-data"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        s3_client.upload_file(
+            Filename="data/dummy_parquet.parquet", Bucket=bucket, Key="dummy.parquet"
+        )
+        result = get_obfuscated_bytes(
+            f"s3://{bucket}/dummy.parquet", ["email_address"], session
+        )
+        assert result["format"] == ".parquet"
+        s3_client.put_object(Bucket=bucket, Key="out.parquet", Body=result["data"])
+        output = wr.s3.read_parquet(path=f"s3://{bucket}/out.parquet")
+        assert (output["email_address"] == "***").all()
+        assert len(output) == 20
+
+    def test_missing_file_returns_failure(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        result = get_obfuscated_bytes("s3://no-bucket/dummy.csv", ["email"], session)
+        assert result["status"] == "failure"
+
+    @pytest.mark.parametrize("engine", ["pandas", "splice"])
+    def test_csv_chunks_match_streamed_file(self, s3_client, engine):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "ingested-data"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        s3_client.upload_file(
+            Filename="data/dummy_csv.csv", Bucket=bucket, Key="dummy.csv"
+        )
+        path = f"s3://{bucket}/dummy.csv"
+        stream_sensitive_data(
+            path, ["email_address"], f"s3://{bucket}/streamed.csv", session, engine
+        )
+        streamed = s3_client.get_object(Bucket=bucket, Key="streamed.csv")
+        result = iter_obfuscated_chunks(path, ["email_address"], session, engine)
+        assert result["status"] == "success"
+        assert b"".join(result["data"]) == streamed["Body"].read()
+
+    def test_json_is_streamed_with_nested_paths(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "ingested-data"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        records = [{"id": 1, "contact": {"email": "a@b.com"}}, {"id": 2, "contact": {}}]
+        body = "\n".join(json.dumps(record) for record in records)
+        s3_client.put_object(Bucket=bucket, Key="records.ndjson", Body=body.encode())
+        path = f"s3://{bucket}/records.ndjson"
+        result = stream_sensitive_data(
+            path, ["contact.email"], f"s3://{bucket}/streamed.ndjson", session
+        )
+        assert result["status"] == "success"
+        streamed = s3_client.get_object(Bucket=bucket, Key="streamed.ndjson")["Body"].read()
+        assert [json.loads(line) for line in streamed.splitlines()] == [
+            {"id": 1, "contact": {"email": "***"}},
+            {"id": 2, "contact": {}},
+        ]
+        result = iter_obfuscated_chunks(path, ["contact.email"], session)
+        assert b"".join(result["data"]) == streamed
+        assert get_data_from_bucket(path, session)["status"] == "failure"
+
+    def test_splice_engine_rejects_hashing(self):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        result = iter_obfuscated_chunks(
+            "s3://ingested-data/dummy.csv",
+            ["email_address"],
+            session,
+            "splice",
+            masking={"email_address": "hash"},
+        )
+        assert result["status"] == "failure"
+
+    def test_parquet_chunks_form_a_parquet_file(self, s3_client):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        bucket = "ingested-data"
+        s3_client.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        s3_client.upload_file(
+            Filename="data/dummy_parquet.parquet", Bucket=bucket, Key="dummy.parquet"
+        )
+        result = iter_obfuscated_chunks(
+            f"s3://{bucket}/dummy.parquet", ["email_address"], session
+        )
+        output = pd.read_parquet(io.BytesIO(b"".join(result["data"])))
+        assert (output["email_address"] == "***").all()
+        assert len(output) == 20
+
+    def test_unsupported_format_returns_failure(self):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        result = iter_obfuscated_chunks("s3://bucket/file.txt", ["email"], session)
+        assert result["status"] == "failure"
+
+
+@pytest.fixture(scope="function")
+def compressed_bucket(s3_client):
+    s3_client.create_bucket(
+        Bucket="ingested-data",
+        CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+    )
+    for filename, key in [("data/dummy_csv.csv", "dummy.csv"), ("data/dummy_json.json", "dummy.json")]:
+        with open(filename, "rb") as f:
+            body = f.read()
+        s3_client.put_object(Bucket="ingested-data", Key=key, Body=body)
+        s3_client.put_object(Bucket="ingested-data", Key=key + ".gz", Body=gzip.compress(body))
+        s3_client.put_object(Bucket="ingested-data", Key=key + ".bz2", Body=bz2.compress(body))
+    return s3_client
+
+
+class TestCompressedFiles:
+    @pytest.mark.parametrize("key", ["dummy.csv.gz", "dummy.csv.bz2", "dummy.json.gz", "dummy.json.bz2"])
+    @pytest.mark.parametrize("use_arrow", [False, True])
+    def test_compressed_file_reads_like_uncompressed(self, compressed_bucket, key, use_arrow):
+        session = boto3.session.Session()
+        plain = key.rsplit(".", 1)[0]
+        result = get_data_from_bucket(f"s3://ingested-data/{key}", session, use_arrow=use_arrow)
+        expected = get_data_from_bucket(f"s3://ingested-data/{plain}", session, use_arrow=use_arrow)
+        assert result["status"] == "success"
+        assert result["format"] == expected["format"]
+        assert result["data"].equals(expected["data"])
+
+    @pytest.mark.parametrize("engine", ["pandas", "splice"])
+    def test_stream_decompresses_and_recompresses(self, compressed_bucket, engine):
+        session = boto3.session.Session()
+        stream_sensitive_data(
+            "s3://ingested-data/dummy.csv", ["email_address"], "s3://ingested-data/plain.csv", session, engine
+        )
+        result = stream_sensitive_data(
+            "s3://ingested-data/dummy.csv.bz2",
+            ["email_address"],
+            "s3://ingested-data/out.csv.gz",
+            session,
+            engine,
+            compression_level=1,
+        )
+        assert result["status"] == "success"
+        plain = compressed_bucket.get_object(Bucket="ingested-data", Key="plain.csv")["Body"].read()
+        body = compressed_bucket.get_object(Bucket="ingested-data", Key="out.csv.gz")["Body"].read()
+        assert gzip.decompress(body) == plain
+
+    def test_chunks_of_compressed_file_are_decompressed(self, compressed_bucket):
+        session = boto3.session.Session()
+        result = iter_obfuscated_chunks("s3://ingested-data/dummy.csv.gz", ["email_address"], session, "splice")
+        expected = iter_obfuscated_chunks("s3://ingested-data/dummy.csv", ["email_address"], session, "splice")
+        assert b"".join(result["data"]) == b"".join(expected["data"])
+
+    @pytest.mark.parametrize("use_arrow", [False, True])
+    def test_in_memory_output_is_compressed(self, compressed_bucket, use_arrow):
+        session = boto3.session.Session()
+        response = get_data_from_bucket("s3://ingested-data/dummy.json", session, use_arrow=use_arrow)
+        response = censor_sensitive_data(response, ["email_address"])
+        result = write_sensitive_data(response, "s3://ingested-data/out.json.gz", session)
+        assert result["status"] == "success"
+        output = get_data_from_bucket("s3://ingested-data/out.json.gz", session)
+        assert (output["data"]["email_address"] == "***").all()
+
+    @pytest.mark.parametrize("use_arrow", [False, True])
+    def test_parquet_codec_can_be_chosen(self, s3_client, use_arrow):
+        session = boto3.session.Session()
+        s3_client.create_bucket(
+            Bucket="ingested-data",
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        s3_client.upload_file(
+            Filename="data/dummy_parquet.parquet", Bucket="ingested-data", Key="dummy.parquet"
+        )
+        response = get_data_from_bucket("s3://ingested-data/dummy.parquet", session, use_arrow=use_arrow)
+        result = write_sensitive_data(
+            response, "s3://ingested-data/out.parquet", session, parquet_compression="zstd"
+        )
+        assert result["status"] == "success"
+        body = s3_client.get_object(Bucket="ingested-data", Key="out.parquet")["Body"].read()
+        metadata = pq.ParquetFile(io.BytesIO(body)).metadata
+        assert metadata.row_group(0).column(0).compression == "ZSTD"
+
+    def test_unknown_parquet_codec_fails(self, s3_client):
+        session = boto3.session.Session()
+        response = {"status": "success", "data": pd.DataFrame({"a": [1]}), "format": ".parquet"}
+        result = write_sensitive_data(response, "s3://bucket/out.parquet", session, parquet_compression="lzma")
+        assert result["status"] == "failure"
+        assert "lzma" in result["message"]
+
+    def test_compressed_parquet_is_rejected(self):
+        session = boto3.session.Session(
+            aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        result = get_data_from_bucket("s3://bucket/file.parquet.gz", session)
+        assert result["status"] == "failure"
+
+    def test_corrupt_file_fails(self, compressed_bucket):
+        compressed_bucket.put_object(Bucket="ingested-data", Key="bad.csv.gz", Body=b"not gzip")
+        result = get_data_from_bucket("s3://ingested-data/bad.csv.gz", boto3.session.Session())
+        assert result["status"] == "failure"
+
+
+class TestPyarrowReader:
+    @pytest.mark.parametrize("key", ["dummy.csv", "dummy.csv.gz", "dummy.json", "dummy.json.bz2"])
+    def test_pyarrow_reader_matches_pandas_reader(self, compressed_bucket, key):
+        session = boto3.session.Session()
+        path = f"s3://ingested-data/{key}"
+        result = get_data_from_bucket(path, session, reader="pyarrow")
+        expected = get_data_from_bucket(path, session)
+        assert result["status"] == "success"
+        assert result["format"] == expected["format"]
+        # pandas guesses the json timestamp columns from their names
+        for column in ["created_at", "last_updated"]:
+            expected["data"][column] = expected["data"][column].astype(str)
+            result["data"][column] = pd.to_datetime(result["data"][column]).astype(str)
+        pd.testing.assert_frame_equal(result["data"], expected["data"])
+
+    def test_ranged_download_uses_pyarrow_reader(self, compressed_bucket):
+        session = boto3.session.Session()
+        result = get_data_from_bucket(
+            "s3://ingested-data/dummy.csv",
+            session,
+            {"part_size": 5 * 1024 * 1024, "max_concurrency": 2},
+            reader="pyarrow",
+        )
+        expected = get_data_from_bucket("s3://ingested-data/dummy.csv", session)
+        assert result["data"].equals(expected["data"])
+
+    @pytest.mark.parametrize("key", ["dummy.csv", "dummy.json"])
+    def test_column_types_are_applied(self, compressed_bucket, key):
+        session = boto3.session.Session()
+        result = get_data_from_bucket(
+            f"s3://ingested-data/{key}",
+            session,
+            reader="pyarrow",
+            column_types={"staff_id": "string", "missing": "string"},
+        )
+        assert result["data"]["staff_id"].tolist()[:3] == ["1", "2", "3"]
+        # csv columns are all read as text unless typed
+        assert result["data"]["department_id"].dtype == ("int64" if key == "dummy.json" else "object")
+
+    def test_column_oriented_json_is_read(self, compressed_bucket):
+        session = boto3.session.Session()
+        response = get_data_from_bucket("s3://ingested-data/dummy.json", session)
+        write_sensitive_data(response, "s3://ingested-data/columns.json", session)
+        result = get_data_from_bucket("s3://ingested-data/columns.json", session, reader="pyarrow")
+        assert result["status"] == "success"
+        assert len(result["data"]) == len(response["data"])
+
+    def test_unknown_column_type_fails(self, compressed_bucket):
+        result = get_data_from_bucket(
+            "s3://ingested-data/dummy.csv",
+            boto3.session.Session(),
+            reader="pyarrow",
+            column_types={"staff_id": "not_a_type"},
+        )
+        assert result["status"] == "failure"
+
+    def test_unknown_reader_fails(self, compressed_bucket):
+        result = get_data_from_bucket(
+            "s3://ingested-data/dummy.csv", boto3.session.Session(), reader="polars"
+        )
+        assert result == {"status": "failure", "message": "reader must be pandas or pyarrow"}
+
+
+class TestStorageBackends:
+    @pytest.mark.parametrize(
+        "filename, key",
+        [
+            ("data/dummy_csv.csv", "dummy.csv"),
+            ("data/dummy_json.json", "dummy.json"),
+            ("data/dummy_parquet.parquet", "dummy.parquet"),
+            ("data/dummy_csv.csv", "dummy.csv.gz"),
+        ],
+    )
+    @pytest.mark.parametrize("use_arrow", [False, True])
+    @pytest.mark.parametrize("scheme", ["file", "memory"])
+    def test_output_matches_s3_output(self, s3_client, tmp_path, filename, key, use_arrow, scheme):
+        s3_client.create_bucket(
+            Bucket="ingested-data",
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        with open(filename, "rb") as f:
+            body = f.read()
+        if key.endswith(".gz"):
+            body = gzip.compress(body)
+        session = boto3.session.Session()
+        root = f"file://{tmp_path}" if scheme == "file" else "memory://ingested-data"
+        s3_client.put_object(Bucket="ingested-data", Key=key, Body=body)
+        with open_object_writer(f"{root}/{key}") as writer:
+            writer.write(body)
+        outputs = []
+        for prefix in ["s3://ingested-data", root]:
+            response = get_data_from_bucket(f"{prefix}/{key}", session, use_arrow=use_arrow)
+            assert response["status"] == "success"
+            response = censor_sensitive_data(response, ["email_address"])
+            result = write_sensitive_data(response, f"{prefix}/out_{key}", session)
+            assert result["status"] == "success"
+            outputs.append(read_object_bytes(f"{prefix}/out_{key}", session))
+        if key.endswith(".gz"):
+            outputs = [gzip.decompress(output) for output in outputs]
+        if key.endswith(".parquet"):
+            # awswrangler writes its own parquet metadata, the values are the same
+            outputs = [pd.read_parquet(io.BytesIO(output)) for output in outputs]
+            assert outputs[1].equals(outputs[0])
+        else:
+            assert outputs[1] == outputs[0]
+
+    @pytest.mark.parametrize(
+        "path",
+        ["file:///no/such/dummy.csv", "memory://no-bucket/dummy.csv", "gs://bucket/dummy.csv"],
+    )
+    def test_missing_or_unsupported_path_fails(self, path):
+        result = get_data_from_bucket(path, boto3.session.Session())
+        assert result["status"] == "failure"
+
+    @pytest.mark.parametrize("engine", ["pandas", "splice"])
+    def test_local_file_is_streamed(self, tmp_path, engine):
+        source = f"file://{os.path.abspath('data/dummy_csv.csv')}"
+        result = stream_sensitive_data(
+            source, ["email_address"], f"file://{tmp_path}/out.csv", boto3.session.Session(), engine
+        )
+        assert result["status"] == "success"
+        output = pd.read_csv(tmp_path / "out.csv")
+        assert (output["email_address"] == "***").all()
+
+
+class TestLoadBackend:
+    @pytest.mark.parametrize(
+        "file_extension, engine, module",
+        [
+            (".csv", "pandas", "src.transform_lambda.csv_utils"),
+            (".csv", "splice", "src.transform_lambda.csv_splice_utils"),
+            (".parquet", "pandas", "src.transform_lambda.parquet_utils"),
+            (".json", "pandas", "src.transform_lambda.json_utils"),
+            (".json", "splice", "src.transform_lambda.json_splice_utils"),
+            (".jsonl", "pandas", "src.transform_lambda.json_splice_utils"),
+        ],
+    )
+    def test_returns_module_for_format(self, file_extension, engine, module):
+        assert load_backend(file_extension, engine).__name__ == module
+
+    def test_backends_are_only_imported_when_used(self):
+        code = (
+            "import sys; from src.transform_lambda.utils import load_backend; "
+            "before = [m for m in ['pandas', 'src.transform_lambda.csv_utils'] if m in sys.modules]; "
+            "load_backend('.csv', 'splice'); "
+            "after = [m for m in ['pandas', 'awswrangler', 'numpy'] if m in sys.modules]; "
+            "print(before, after)"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        assert result.stdout.strip() == "[] ['numpy']"